@@ -1,10 +1,33 @@
 import argparse
+import os
+import shutil
 import sys
 from functools import partial
-from typing import Callable, Iterator
+from typing import Callable, Iterator, NamedTuple
 
-from src import terms, utils
-from src.runs import run_0, run_0_stopwords, run_0_tagblacklist, run_0_tfidf
+from src import (
+    async_server,
+    collection_stats,
+    doc_cache,
+    indexing,
+    log,
+    masked,
+    runs,
+    segments,
+    server,
+    shards,
+    storage,
+    terms,
+    utils,
+)
+from src.index import ENGINES
+from src.runs import (
+    run_0,
+    run_0_lemmas,
+    run_0_stopwords,
+    run_0_tagblacklist,
+    run_0_tfidf,
+)
 
 parser = argparse.ArgumentParser()
 
@@ -22,67 +45,465 @@ parser.add_argument(
 parser.add_argument(
     "-r", "--run", type=str, default=None, help="Identifier of the run/experiment."
 )
+parser.add_argument("-o", "--output", type=str, help="Name of the output file.")
+parser.add_argument(
+    "-i",
+    "--index",
+    type=str,
+    default=None,
+    help=(
+        "Persisted index file or directory of index segments. When it exists, it is"
+        " memory-mapped instead of indexing the documents."
+    ),
+)
+parser.add_argument(
+    "--build_index",
+    action="store_true",
+    help="Only build the index of the run and save it to the output file.",
+)
+parser.add_argument(
+    "--runs",
+    type=str,
+    nargs="+",
+    default=None,
+    help=(
+        "With --build_index, build indexes of all given runs from a single parse"
+        " of the documents, saved as `<run>.idx` to the output directory."
+    ),
+)
+parser.add_argument(
+    "--memory_budget",
+    type=float,
+    default=None,
+    help=(
+        "Memory budget in MB for building the index. When set, partial indexes are"
+        " flushed to disk once they exceed it and merged into the output file."
+    ),
+)
+parser.add_argument(
+    "--shards",
+    type=int,
+    default=None,
+    help=(
+        "Build the index partitioned into given number of shards, saved to the"
+        " output directory. Each shard is then searched by its own process."
+    ),
+)
+parser.add_argument(
+    "--compression",
+    type=str,
+    default="none",
+    choices=storage.COMPRESSIONS,
+    help="Compression of postings in the built index.",
+)
+parser.add_argument(
+    "--engine",
+    type=str,
+    default="python",
+    choices=ENGINES,
+    help="Scoring engine used to rank documents.",
+)
+parser.add_argument(
+    "--postings_budget",
+    type=int,
+    default=None,
+    help="Maximum number of postings processed per topic by the impact engine.",
+)
+parser.add_argument(
+    "--time_budget",
+    type=float,
+    default=None,
+    help="Maximum time in milliseconds spent per topic by the impact engine.",
+)
+parser.add_argument(
+    "--query_processes",
+    type=int,
+    default=None,
+    help="Number of processes evaluating the batch of topics.",
+)
+parser.add_argument(
+    "--query_stopwords",
+    type=str,
+    nargs="+",
+    default=[],
+    help=(
+        "Files with stop words excluded at query time from the index and topics,"
+        " so that a single index serves experiments with different stop words."
+    ),
+)
+parser.add_argument(
+    "--exclude_terms",
+    type=str,
+    nargs="+",
+    default=[],
+    help="Terms excluded at query time, as if they were stop words.",
+)
+parser.add_argument(
+    "--serve",
+    type=str,
+    default=None,
+    help=(
+        "Instead of searching the topics, serve queries over HTTP on given"
+        " `host:port` or Unix socket `unix:path`."
+    ),
+)
+parser.add_argument(
+    "--serve_async",
+    type=str,
+    default=None,
+    help=(
+        "Serve queries over HTTP on given `host:port` or Unix socket `unix:path`"
+        " from an asyncio front-end, scoring batches of queries in"
+        " `--query_processes` processes which memory-map the index."
+    ),
+)
+parser.add_argument(
+    "--batch_window",
+    type=float,
+    default=2,
+    help="Time in milliseconds for which queries are collected into one batch.",
+)
+parser.add_argument(
+    "--request_timeout",
+    type=float,
+    default=10,
+    help="Time in seconds after which a served query fails.",
+)
+parser.add_argument(
+    "--doc_cache",
+    type=str,
+    default=None,
+    help=(
+        "Directory caching parsed documents, so that unchanged collection files are"
+        " parsed only once."
+    ),
+)
+parser.add_argument(
+    "--metrics",
+    type=str,
+    default=None,
+    help=(
+        "JSON file to which stage timers, counters and peak memory of all"
+        " processes are written at the end of the run."
+    ),
+)
 parser.add_argument(
-    "-o", "--output", type=str, help="Name of the output file.", required=True
+    "--profile_stages",
+    type=str,
+    nargs="+",
+    default=[],
+    help=(
+        "Stages profiled by cProfile when collecting metrics, their merged"
+        " profiles are saved next to the metrics file."
+    ),
 )
 parser.add_argument(
     "--gen_stopwords",
     type=float,
-    default=-1,
+    nargs="+",
+    default=[],
     help=(
-        "When set to positive number, stopwords will be generated with frequency per"
-        " document above the specified number."
-    ),
-)
-
-Experiment = Callable[[Iterator[str], str, str, str], None]
-AVAILABLE_RUNS: dict[str, Experiment] = {
-    "run-0_cs": run_0.experiment,
-    "run-0_en": run_0.experiment,
-    "run-0-tfidf_cs": run_0_tfidf.experiment,
-    "run-0-tfidf_en": run_0_tfidf.experiment,
-    "run-0-stopwords_cs": partial(run_0_stopwords.experiment, "cs"),
-    "run-0-stopwords_en": partial(run_0_stopwords.experiment, "en"),
-    "run-0-tagblacklist_cs": partial(run_0_tagblacklist.experiment, "cs"),
-    "run-0-tagblacklist_en": partial(run_0_tagblacklist.experiment, "en"),
-    "run-1_cs": partial(run_0_stopwords.experiment, "cs"),
-    "run-1_en": partial(run_0_stopwords.experiment, "en"),
+        "When set, stopwords will be generated with frequency per document above"
+        " each of the specified numbers. With several numbers, each list is saved"
+        " to the output file with the number appended."
+    ),
+)
+parser.add_argument(
+    "--stopwords_by",
+    type=str,
+    choices=collection_stats.STOPWORD_CRITERIA,
+    default="cf",
+    help=(
+        "Frequency of generated stopwords, average occurrences per document (cf)"
+        " or fraction of documents containing the term (df)."
+    ),
+)
+parser.add_argument(
+    "--sketch_width",
+    type=int,
+    default=2**18,
+    help=(
+        "Counters per row of sketches approximating term frequencies when"
+        " generating stopwords, 0 counts exactly."
+    ),
+)
+parser.add_argument(
+    "--sketch_depth",
+    type=int,
+    default=4,
+    help="Rows of sketches approximating term frequencies.",
+)
+parser.add_argument(
+    "--heavy_hitters",
+    type=int,
+    default=10000,
+    help="Most frequent terms kept by each process as stopword candidates.",
+)
+
+
+class Run(NamedTuple):
+    pipeline: Callable[..., indexing.Pipeline]
+    weighting: str
+
+    def tokenizer(self) -> terms.Tokenizer:
+        return self.pipeline().tokenizer
+
+    def index_paths(self) -> indexing.IndexPaths:
+        return runs.index_paths(self.pipeline())
+
+
+AVAILABLE_RUNS: dict[str, Run] = {
+    "run-0_cs": Run(run_0.get_pipeline, run_0.WEIGHTING),
+    "run-0_en": Run(run_0.get_pipeline, run_0.WEIGHTING),
+    "run-0-tfidf_cs": Run(run_0_tfidf.get_pipeline, run_0_tfidf.WEIGHTING),
+    "run-0-tfidf_en": Run(run_0_tfidf.get_pipeline, run_0_tfidf.WEIGHTING),
+    "run-0-stopwords_cs": Run(
+        partial(run_0_stopwords.get_pipeline, "cs"), run_0_stopwords.WEIGHTING
+    ),
+    "run-0-stopwords_en": Run(
+        partial(run_0_stopwords.get_pipeline, "en"), run_0_stopwords.WEIGHTING
+    ),
+    "run-0-tagblacklist_cs": Run(
+        partial(run_0_tagblacklist.get_pipeline, "cs"), run_0_tagblacklist.WEIGHTING
+    ),
+    "run-0-tagblacklist_en": Run(
+        partial(run_0_tagblacklist.get_pipeline, "en"), run_0_tagblacklist.WEIGHTING
+    ),
+    "run-0-lemmas_cs": Run(
+        partial(run_0_lemmas.get_pipeline, "cs"), run_0_lemmas.WEIGHTING
+    ),
+    "run-0-lemmas_en": Run(
+        partial(run_0_lemmas.get_pipeline, "en"), run_0_lemmas.WEIGHTING
+    ),
+    "run-1_cs": Run(
+        partial(run_0_stopwords.get_pipeline, "cs"), run_0_stopwords.WEIGHTING
+    ),
+    "run-1_en": Run(
+        partial(run_0_stopwords.get_pipeline, "en"), run_0_stopwords.WEIGHTING
+    ),
 }
 
 
+def build_runs(
+    run_ids: list[str], docs_paths_iter: Iterator[str], out_dir: str, compression: str
+) -> None:
+    """
+    Builds indexes of all `run_ids` parsing each document once. Runs with the
+    same tokenization share a single index.
+    """
+    pipelines: dict[tuple, tuple[indexing.Pipeline, str]] = {}
+    run_pipelines = {}
+    for run_id in run_ids:
+        pipeline = AVAILABLE_RUNS[run_id].pipeline()
+        key = (id(pipeline.tokenizer), pipeline.create_doc)
+        pipelines.setdefault(key, (pipeline, run_id))
+        run_pipelines[run_id] = key
+
+    os.makedirs(out_dir, exist_ok=True)
+    indexing.build_indexes(
+        docs_paths_iter,
+        [pipeline for pipeline, _ in pipelines.values()],
+        [os.path.join(out_dir, f"{run_id}.idx") for _, run_id in pipelines.values()],
+        compression=compression,
+    )
+    for run_id, key in run_pipelines.items():
+        built_run_id = pipelines[key][1]
+        if run_id != built_run_id:
+            shutil.copyfile(
+                os.path.join(out_dir, f"{built_run_id}.idx"),
+                os.path.join(out_dir, f"{run_id}.idx"),
+            )
+
+    log.timed(f"Built {len(pipelines)} indexes of {len(run_pipelines)} runs")
+
+
 def main(args: argparse.Namespace) -> None:
     doc_dir = args.documents[: args.documents.rfind(".")]
     docs_paths_iter = utils.get_filename_iter(doc_dir, args.documents)
+    doc_cache.set_cache_dir(args.doc_cache)
 
-    if args.gen_stopwords > 0:
-        utils.generate_stopwords(
+    serving = args.serve is not None or args.serve_async is not None
+    if args.output is None and not serving:
+        print("Output file must be specified if not serving.", file=sys.stderr)
+        sys.exit(1)
+
+    if len(args.gen_stopwords) > 0:
+        collection_stats.generate_stopwords(
             docs_paths_iter,
             terms.WHSP_SEPS + terms.PUNCT_SEPS,
             args.gen_stopwords,
             args.output,
+            args.stopwords_by,
+            args.sketch_width if args.sketch_width > 0 else None,
+            args.sketch_depth,
+            args.heavy_hitters,
         )
         return
 
+    if args.build_index and args.runs is not None:
+        unknown_runs = [run_id for run_id in args.runs if run_id not in AVAILABLE_RUNS]
+        if len(unknown_runs) > 0:
+            print(
+                f"Runs {unknown_runs} are not available."
+                f" Choose from {AVAILABLE_RUNS.keys()}.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+        log.timed("Indexing started")
+        build_runs(args.runs, docs_paths_iter, args.output, args.compression)
+        return
+
     if args.run is None:
         print("Run must be specified if not generating stopwords.", file=sys.stderr)
         sys.exit(1)
 
-    if args.queries is None:
+    if args.run is None or args.run not in AVAILABLE_RUNS:
+        print(
+            f"Run {args.run} is not available. Choose one of {AVAILABLE_RUNS.keys()}.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    run = AVAILABLE_RUNS[args.run]
+
+    if args.build_index:
+        log.timed("Indexing started")
+        if args.shards is not None:
+            shards.build_shards(
+                docs_paths_iter,
+                run.index_paths(),
+                args.output,
+                args.shards,
+                compression=args.compression,
+            )
+            return
+
+        if args.memory_budget is not None:
+            indexing.build_index_spimi(
+                docs_paths_iter,
+                run.index_paths(),
+                args.output,
+                int(args.memory_budget * 2**20),
+                compression=args.compression,
+            )
+        else:
+            indexing.build_index_file(
+                docs_paths_iter,
+                run.index_paths(),
+                args.output,
+                compression=args.compression,
+            )
+        with storage.load(args.output) as index:
+            postings_bytes, uncompressed_bytes = index.postings_size()
+        log.timed(
+            f"Index saved to {args.output}, postings take {postings_bytes} B,"
+            f" compression ratio {uncompressed_bytes / max(postings_bytes, 1):.2f}"
+        )
+        return
+
+    if args.queries is None and not serving:
         print("Topics must be specified if not generating stopwords.", file=sys.stderr)
         sys.exit(1)
 
-    if args.run is None or args.run not in AVAILABLE_RUNS:
+    excluded_terms = set(args.exclude_terms)
+    for stopwords_path in args.query_stopwords:
+        excluded_terms.update(utils.load_stopwords(stopwords_path))
+
+    if args.serve_async is not None:
+        if args.index is None or not os.path.exists(args.index):
+            print("Existing index must be specified to serve.", file=sys.stderr)
+            sys.exit(1)
+
+        try:
+            query_server = async_server.AsyncQueryServer(
+                args.index,
+                run.tokenizer(),
+                run.weighting,
+                args.run,
+                engine=args.engine,
+                processes=args.query_processes,
+                batch_window=args.batch_window / 1000,
+                timeout=args.request_timeout,
+                excluded_terms=excluded_terms,
+            )
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+
+        async_server.serve(args.serve_async, query_server)
+        return
+
+    if args.index is not None and os.path.exists(
+        os.path.join(args.index, shards.MANIFEST)
+    ):
+        # shards hide excluded terms themselves, keeping queries scattered
+        index = shards.ShardedIndex(args.index, excluded_terms)
+        log.timed(f"Index loaded from {index.shard_count()} shards in {args.index}")
+    elif args.index is not None and os.path.exists(
+        os.path.join(args.index, segments.MANIFEST)
+    ):
+        index = segments.SegmentedIndex(args.index)
+        log.timed(f"Index loaded from {index.segment_count()} segments in {args.index}")
+    elif args.index is not None and os.path.isdir(args.index):
         print(
-            f"Run {args.run} is not available. Choose one of {AVAILABLE_RUNS.keys()}.",
+            f"{args.index} is neither a sharded nor a segmented index.",
             file=sys.stderr,
         )
         sys.exit(1)
+    elif args.index is not None and os.path.exists(args.index):
+        index = storage.load(args.index)
+        log.timed(f"Index loaded from {args.index}")
+    else:
+        log.timed("Indexing started")
+        index = indexing.build_index(docs_paths_iter, run.index_paths())
+        index.compute_norms()
+        log.timed("Indexing complete")
+
+    if len(excluded_terms) > 0:
+        if not isinstance(index, shards.ShardedIndex):
+            index = masked.MaskedIndex(index, excluded_terms)
+        log.timed(f"Excluded {len(excluded_terms)} terms from the index")
+
+    if args.engine == "impact":
+        # built before queries, so that their time budgets are not spent
+        # building them
+        index.compute_impacts(run.weighting)
+        log.timed("Impact ordered postings built")
 
-    experiment = AVAILABLE_RUNS[args.run]
-    sys.setrecursionlimit(20000)
-    experiment(docs_paths_iter, args.queries, args.output, args.run)
+    if args.serve is not None:
+        service = server.QueryService(
+            index, run.tokenizer(), run.weighting, args.run, engine=args.engine
+        )
+        server.serve(args.serve, service)
+        return
+
+    runs.search(
+        run.tokenizer(),
+        run.weighting,
+        index,
+        args.queries,
+        args.output,
+        args.run,
+        engine=args.engine,
+        processes=args.query_processes,
+        postings_budget=args.postings_budget,
+        time_budget=None if args.time_budget is None else args.time_budget / 1000,
+    )
+    print(
+        f"Result cache: {index.result_cache.hits} hits,"
+        f" {index.result_cache.misses} misses"
+    )
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    main(args)
+    if args.metrics is not None:
+        log.enable_metrics(tuple(args.profile_stages))
+
+    try:
+        main(args)
+    finally:
+        if args.metrics is not None:
+            log.export_metrics(args.metrics)
+            log.disable_metrics()
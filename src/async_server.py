@@ -0,0 +1,341 @@
+import asyncio
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from src import log, masked, segments, shards, storage, utils
+from src.index import InvertedIndex
+from src.server import LatencyStats, parse_first_k
+
+# maximum number of queued queries, further queries are rejected
+MAX_PENDING = 1024
+# maximum number of queries scored by a worker at once
+MAX_BATCH = 64
+
+_worker_index: Optional[InvertedIndex] = None
+_worker_tokenizer: Optional[Callable[[str], dict[str, int]]] = None
+
+
+def index_type(index_path: str) -> Callable[[str], InvertedIndex]:
+    """
+    Returns function opening index persisted at `index_path`. Directories are
+    recognized by their manifest, other directories are rejected.
+    """
+    if not os.path.isdir(index_path):
+        return storage.load
+    if os.path.exists(os.path.join(index_path, shards.MANIFEST)):
+        return shards.ShardedIndex
+    if os.path.exists(os.path.join(index_path, segments.MANIFEST)):
+        return segments.SegmentedIndex
+
+    raise ValueError(f"{index_path} is neither a sharded nor a segmented index.")
+
+
+def _init_worker(
+    open_index: Callable[[str], InvertedIndex],
+    index_path: str,
+    excluded_terms: frozenset[str],
+    tokenizer: Callable[[str], dict[str, int]],
+    weighting: str,
+    engine: str,
+) -> None:
+    global _worker_index, _worker_tokenizer  # pylint: disable=global-statement
+    if open_index is shards.ShardedIndex:
+        # shards hide excluded terms themselves, keeping queries scattered
+        _worker_index = shards.ShardedIndex(index_path, excluded_terms)
+    else:
+        _worker_index = open_index(index_path)
+        if len(excluded_terms) > 0:
+            _worker_index = masked.MaskedIndex(_worker_index, excluded_terms)
+    if engine == "impact":
+        # built before serving, so that time budgets of queries are not spent
+        # building them
+        _worker_index.compute_impacts(weighting)
+    _worker_tokenizer = tokenizer
+
+
+def _score_batch(
+    texts: list[str], weighting: str, first_k: int, engine: str
+) -> list[list[tuple[float, str]]]:
+    queries = [_worker_tokenizer(text) for text in texts]
+    similars = _worker_index.get_most_similar_batch(queries, weighting, first_k, engine)
+    log.flush_metrics()
+    return similars
+
+
+class Overloaded(Exception):
+    pass
+
+
+@dataclass
+class _PendingQuery:
+    text: str
+    first_k: int
+    result: asyncio.Future
+
+
+class AsyncQueryServer:
+    """
+    Asyncio HTTP front-end which scores queries in a pool of worker processes.
+
+    Each worker memory-maps the index at `index_path`, so the processes share
+    its pages, and hides `excluded_terms` from it. Queries arriving within
+    `batch_window` seconds are scored by a single worker as one batch. At most
+    `MAX_PENDING` queries wait for a worker, others are rejected, and each
+    query fails after `timeout` seconds.
+
+    Raises `ValueError` if `index_path` is a directory of neither shards nor
+    segments.
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        tokenizer: Callable[[str], dict[str, int]],
+        weighting: str,
+        run_id: str,
+        engine: str = "python",
+        first_k: int = 1000,
+        processes: Optional[int] = None,
+        batch_window: float = 0.002,
+        timeout: float = 10.0,
+        excluded_terms: Iterable[str] = (),
+    ) -> None:
+        self.index_path = index_path
+        self.open_index = index_type(index_path)
+        self.excluded_terms = frozenset(excluded_terms)
+        self.tokenizer = tokenizer
+        self.weighting = weighting
+        self.run_id = run_id
+        self.engine = engine
+        self.first_k = first_k
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.latencies = LatencyStats()
+        self._rejected = 0
+        self._timed_out = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # the event loop keeps only weak references to tasks
+        self._scoring_tasks: set[asyncio.Task] = set()
+
+    async def search(
+        self, text: str, query_id: str, first_k: Optional[int] = None
+    ) -> str:
+        """
+        Returns ranking of documents most similar to `text` in TREC format.
+        Raises `Overloaded` when too many queries are pending and
+        `asyncio.TimeoutError` when the query is not scored in time.
+        """
+        start = time.perf_counter()
+        result = asyncio.get_running_loop().create_future()
+        query = _PendingQuery(
+            text, self.first_k if first_k is None else first_k, result
+        )
+        try:
+            self._queue.put_nowait(query)
+        except asyncio.QueueFull as error:
+            self._rejected += 1
+            raise Overloaded() from error
+
+        try:
+            similars = await asyncio.wait_for(result, self.timeout)
+        except asyncio.TimeoutError:
+            self._timed_out += 1
+            raise
+
+        output = io.StringIO()
+        utils.write_qrels(output, similars, query_id, self.run_id)
+        self.latencies.record(time.perf_counter() - start)
+        return output.getvalue()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.latencies.summary(),
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+        }
+
+    async def _batch_queries(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # queries which timed out meanwhile are not scored
+            batch = [query for query in batch if not query.result.done()]
+            if len(batch) == 0:
+                continue
+
+            # waits while all workers are busy, so that queries pile up in the
+            # bounded queue
+            await self._slots.acquire()
+            task = asyncio.create_task(self._score(batch))
+            self._scoring_tasks.add(task)
+            task.add_done_callback(self._scoring_tasks.discard)
+
+    async def _score(self, batch: list[_PendingQuery]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            for first_k in {query.first_k for query in batch}:
+                queries = [query for query in batch if query.first_k == first_k]
+                try:
+                    all_similars = await loop.run_in_executor(
+                        self._pool,
+                        _score_batch,
+                        [query.text for query in queries],
+                        self.weighting,
+                        first_k,
+                        self.engine,
+                    )
+                except Exception as error:  # pylint: disable=broad-except
+                    for query in queries:
+                        if not query.result.done():
+                            query.result.set_exception(error)
+                    continue
+
+                for query, similars in zip(queries, all_similars):
+                    if not query.result.done():
+                        query.result.set_result(similars)
+        finally:
+            self._slots.release()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request_line.decode("latin-1").split()
+                status, content_type, body = await self._respond(parts)
+                data = body.encode("utf-8")
+                keep_alive = (
+                    len(parts) == 3
+                    and parts[2] == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status}\r\n"
+                        f"Content-Type: {content_type}; charset=utf-8\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request: list[str]) -> tuple[str, str, str]:
+        """
+        Serves `GET /search?query=...&id=...&k=...` with TREC formatted ranking
+        and `GET /stats` with JSON statistics.
+        """
+        if len(request) < 2 or request[0] != "GET":
+            return "405 Method Not Allowed", "text/plain", "Only GET is supported.\n"
+
+        url = urlsplit(request[1])
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == "/stats":
+            return "200 OK", "application/json", json.dumps(self.stats())
+        if url.path != "/search" or "query" not in params:
+            return "404 Not Found", "text/plain", "Use /search?query=... or /stats.\n"
+
+        try:
+            first_k = parse_first_k(params)
+        except ValueError as error:
+            return "400 Bad Request", "text/plain", f"{error}\n"
+
+        try:
+            ranking = await self.search(params["query"], params.get("id", "0"), first_k)
+        except Overloaded:
+            return "503 Service Unavailable", "text/plain", "Too many queries.\n"
+        except asyncio.TimeoutError:
+            return "504 Gateway Timeout", "text/plain", "Query timed out.\n"
+        except Exception as error:  # pylint: disable=broad-except
+            return "500 Internal Server Error", "text/plain", f"{error}\n"
+
+        return "200 OK", "text/plain", ranking
+
+    async def serve(self, address: str) -> None:
+        """
+        Serves queries until cancelled. `address` is either `host:port` or
+        `unix:path` of a Unix socket.
+        """
+        self._queue = asyncio.Queue(MAX_PENDING)
+        # two batches per worker keep it busy while the other one is transferred
+        self._slots = asyncio.Semaphore(2 * self.processes)
+        with ProcessPoolExecutor(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(
+                self.open_index,
+                self.index_path,
+                self.excluded_terms,
+                self.tokenizer,
+                self.weighting,
+                self.engine,
+            ),
+        ) as pool:
+            self._pool = pool
+            batcher = asyncio.create_task(self._batch_queries())
+            if address.startswith("unix:"):
+                path = address[len("unix:") :]
+                if os.path.exists(path):
+                    os.remove(path)
+                server = await asyncio.start_unix_server(self._handle_connection, path)
+            else:
+                host, _, port = address.rpartition(":")
+                server = await asyncio.start_server(
+                    self._handle_connection, host, int(port)
+                )
+
+            async with server:
+                print(f"Serving queries on {address} with {self.processes} workers")
+                try:
+                    await server.serve_forever()
+                finally:
+                    batcher.cancel()
+
+
+def serve(address: str, server: AsyncQueryServer) -> None:
+    """
+    Runs `server` on `address` until interrupted.
+    """
+    try:
+        asyncio.run(server.serve(address))
+    except KeyboardInterrupt:
+        pass
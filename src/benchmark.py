@@ -0,0 +1,445 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+import main
+from src import indexing, log, runs, sgml, storage, utils
+from src.document import StreamedDocument
+from src.index import ENGINES
+from src.query import Query
+
+SYLLABLES = ("ka", "to", "ne", "li", "mo", "ra", "su", "ve", "di", "po", "ze", "chu")
+# approximate number of words in a generated sentence
+_SENTENCE_LENGTH = 12
+
+
+class BenchmarkedRun(NamedTuple):
+    """
+    Run of `main.AVAILABLE_RUNS`. Stop words of runs omitting them are replaced
+    by those of the synthetic collection, so that no files outside of the
+    repository are needed.
+    """
+
+    run: main.Run
+    omits_stopwords: bool = False
+
+    @property
+    def weighting(self) -> str:
+        return self.run.weighting
+
+    def pipeline(self, stopwords_path: str) -> indexing.Pipeline:
+        if not self.omits_stopwords:
+            return self.run.pipeline()
+
+        stop_words = frozenset(utils.load_stopwords(stopwords_path))
+        return self.run.pipeline(stop_words=stop_words)
+
+
+RUNS: dict[str, BenchmarkedRun] = {
+    "run-0": BenchmarkedRun(main.AVAILABLE_RUNS["run-0_cs"]),
+    "run-0-tfidf": BenchmarkedRun(main.AVAILABLE_RUNS["run-0-tfidf_cs"]),
+    "run-0-stopwords": BenchmarkedRun(main.AVAILABLE_RUNS["run-0-stopwords_cs"], True),
+    "run-0-tagblacklist": BenchmarkedRun(
+        main.AVAILABLE_RUNS["run-0-tagblacklist_cs"], True
+    ),
+}
+
+
+def _word(rank: int) -> str:
+    """
+    Returns pronounceable word unique to given frequency rank.
+    """
+    syllables = []
+    rank += 1
+    while rank > 0:
+        rank, syllable = divmod(rank - 1, len(SYLLABLES))
+        syllables.append(SYLLABLES[syllable])
+
+    return "".join(reversed(syllables))
+
+
+class ZipfSampler:
+    """
+    Samples words of a vocabulary with frequencies following Zipf's law, the
+    word of rank `r` is drawn with probability proportional to `r^-exponent`.
+    """
+
+    def __init__(self, vocabulary_size: int, exponent: float, seed: int) -> None:
+        self.words = [_word(rank) for rank in range(vocabulary_size)]
+        self._cum_weights = list(
+            itertools.accumulate(
+                (rank + 1) ** -exponent for rank in range(vocabulary_size)
+            )
+        )
+        self._random = random.Random(seed)
+
+    def sample(self, count: int) -> list[str]:
+        return self._random.choices(self.words, cum_weights=self._cum_weights, k=count)
+
+    def length(self, mean: int) -> int:
+        """
+        Returns length uniformly distributed around `mean`.
+        """
+        return self._random.randint(mean // 2, mean + mean // 2)
+
+
+def _sentences(words: list[str]) -> str:
+    return ". ".join(
+        " ".join(words[i : i + _SENTENCE_LENGTH])
+        for i in range(0, len(words), _SENTENCE_LENGTH)
+    )
+
+
+def generate_collection(
+    directory: str,
+    file_count: int = 20,
+    docs_per_file: int = 50,
+    doc_length: int = 200,
+    vocabulary_size: int = 20000,
+    exponent: float = 1.0,
+    topic_count: int = 50,
+    query_length: int = 4,
+    stopword_count: int = 100,
+    seed: int = 0,
+) -> tuple[str, str, str]:
+    """
+    Generates synthetic collection of SGML files in TREC format with Zipfian
+    distribution of words together with a topic file and a file of its
+    `stopword_count` most frequent words. Returns path of the file listing the
+    documents, path of the topic file and path of the stop words, laid out as
+    expected by `main.py`.
+    """
+    sampler = ZipfSampler(vocabulary_size, exponent, seed)
+    documents_path = os.path.join(directory, "documents.lst")
+    doc_dir = os.path.join(directory, "documents")
+    os.makedirs(doc_dir, exist_ok=True)
+
+    filenames = [f"file-{i}.sgml" for i in range(file_count)]
+    for i, filename in enumerate(filenames):
+        with open(os.path.join(doc_dir, filename), mode="w", encoding="utf-8") as file:
+            for j in range(docs_per_file):
+                title = " ".join(sampler.sample(sampler.length(8)))
+                text = _sentences(sampler.sample(sampler.length(doc_length)))
+                file.write(
+                    f"<DOC>\n<DOCNO>BENCH-{i}-{j}</DOCNO>\n"
+                    f"<DOCID>{i * docs_per_file + j}</DOCID>\n"
+                    f"<TITLE>{title}</TITLE>\n<TEXT>\n{text}.\n</TEXT>\n</DOC>\n"
+                )
+
+    with open(documents_path, mode="w", encoding="utf-8") as file:
+        file.writelines(f"{filename}\n" for filename in filenames)
+
+    topics_path = os.path.join(directory, "topics.xml")
+    with open(topics_path, mode="w", encoding="utf-8") as file:
+        file.write("<topics>\n")
+        for i in range(topic_count):
+            title = " ".join(sampler.sample(query_length))
+            file.write(f"<top>\n<num>{i}</num>\n<title>{title}</title>\n</top>\n")
+        file.write("</topics>\n")
+
+    stopwords_path = os.path.join(directory, "stopwords.txt")
+    with open(stopwords_path, mode="w", encoding="utf-8") as file:
+        file.writelines(f"{word}\n" for word in sampler.words[:stopword_count])
+
+    return documents_path, topics_path, stopwords_path
+
+
+def _time(function: Callable[[], Any]) -> tuple[Any, float]:
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def _throughput(amount: int, seconds: float) -> float:
+    return amount / seconds if seconds > 0 else 0.0
+
+
+def benchmark_parsing(
+    paths: list[str],
+) -> tuple[dict[str, Any], list[list[tuple[str, str]]]]:
+    """
+    Measures parsing of documents in `paths`. Returns the measurements and
+    fields of parsed documents.
+    """
+
+    def parse() -> list[list[tuple[str, str]]]:
+        docs = []
+        for path in paths:
+            with open(path, mode="r", encoding="utf-8") as file:
+                docs.extend(map(sgml.parse_fields, sgml.iter_doc_sources(file)))
+        return docs
+
+    docs, seconds = _time(parse)
+    size = sum(os.path.getsize(path) for path in paths)
+    return {
+        "seconds": seconds,
+        "docs": len(docs),
+        "bytes": size,
+        "docs_per_s": _throughput(len(docs), seconds),
+        "mb_per_s": _throughput(size, seconds) / 2**20,
+    }, docs
+
+
+def benchmark_run(
+    run: BenchmarkedRun,
+    paths: list[str],
+    parsed_docs: list[list[tuple[str, str]]],
+    topics_path: str,
+    stopwords_path: str,
+    work_dir: str,
+    engines: list[str],
+    processes: Optional[int],
+    blocks: int,
+    first_k: int,
+) -> dict[str, Any]:
+    """
+    Measures tokenization, indexing, merging and query throughput of `run`.
+    """
+    results = {}
+    pipeline = run.pipeline(stopwords_path)
+    tokenizer = pipeline.tokenizer
+    index_paths = runs.index_paths(pipeline)
+
+    texts = [
+        StreamedDocument(fields, pipeline.create_doc.TAG_BLACKLIST).str_all
+        for fields in parsed_docs
+    ]
+    token_count, seconds = _time(
+        lambda: sum(sum(tokenizer(text).values()) for text in texts)
+    )
+    results["tokenize"] = {
+        "seconds": seconds,
+        "tokens": token_count,
+        "tokens_per_s": _throughput(token_count, seconds),
+    }
+
+    index, seconds = _time(
+        lambda: indexing.build_index(iter(paths), index_paths, processes=processes)
+    )
+    postings_count = sum(len(index.postings(term)) for term in index.terms())
+    results["index"] = {
+        "seconds": seconds,
+        "processes": processes or os.cpu_count(),
+        "docs_per_s": _throughput(index.doc_count, seconds),
+        "postings_per_s": _throughput(postings_count, seconds),
+        "terms": sum(1 for _ in index.terms()),
+        "postings": postings_count,
+    }
+
+    block_size = max(len(paths) // blocks, 1)
+    block_paths = []
+    for i in range(0, len(paths), block_size):
+        block_path = os.path.join(work_dir, f"block-{len(block_paths)}.idx")
+        storage.save(
+            index_paths(paths[i : i + block_size]), block_path, with_norms=False
+        )
+        block_paths.append(block_path)
+
+    index_path = os.path.join(work_dir, "index.idx")
+    _, seconds = _time(lambda: storage.merge(block_paths, index_path))
+    results["merge"] = {
+        "seconds": seconds,
+        "blocks": len(block_paths),
+        "postings_per_s": _throughput(postings_count, seconds),
+    }
+    for block_path in block_paths:
+        os.remove(block_path)
+
+    index = storage.load(index_path)
+    # repeated topics would otherwise be answered from the cache
+    index.result_cache.max_bytes = 0
+    queries = [
+        tokenizer(query.title) for query in utils.get_query_iter(topics_path, Query)
+    ]
+    results["query"] = {}
+    for engine in engines:
+        _, seconds = _time(
+            lambda engine=engine: index.get_most_similar_batch(
+                queries, run.weighting, first_k, engine
+            )
+        )
+        results["query"][engine] = {
+            "seconds": seconds,
+            "queries": len(queries),
+            "queries_per_s": _throughput(len(queries), seconds),
+        }
+    index.close()
+
+    return results
+
+
+def find_regressions(
+    baseline: dict[str, Any], results: dict[str, Any], tolerance: float
+) -> list[str]:
+    """
+    Returns descriptions of throughputs in `results` lower than those in
+    `baseline` by more than `tolerance` fraction.
+    """
+    regressions = []
+
+    def compare(baseline_node: Any, node: Any, path: str) -> None:
+        if not isinstance(baseline_node, dict) or not isinstance(node, dict):
+            return
+
+        for key, baseline_value in baseline_node.items():
+            if key not in node:
+                continue
+            if key.endswith("_per_s") and baseline_value > 0:
+                if node[key] < (1 - tolerance) * baseline_value:
+                    regressions.append(
+                        f"{path}{key}: {node[key]:.1f} < {baseline_value:.1f}"
+                    )
+            else:
+                compare(baseline_value, node[key], f"{path}{key}.")
+
+    compare(baseline, results, "")
+    return regressions
+
+
+parser = argparse.ArgumentParser(
+    description=(
+        "Benchmarks parsing, tokenization, indexing, merging and querying on a"
+        " synthetic collection."
+    )
+)
+parser.add_argument(
+    "-o", "--output", type=str, default="benchmark.json", help="Output JSON file."
+)
+parser.add_argument(
+    "--runs",
+    type=str,
+    nargs="+",
+    default=list(RUNS),
+    choices=list(RUNS),
+    help="Benchmarked runs.",
+)
+parser.add_argument(
+    "--engines",
+    type=str,
+    nargs="+",
+    default=list(ENGINES),
+    choices=ENGINES,
+    help="Benchmarked scoring engines.",
+)
+parser.add_argument("--files", type=int, default=20, help="Number of SGML files.")
+parser.add_argument("--docs_per_file", type=int, default=50)
+parser.add_argument(
+    "--doc_length", type=int, default=200, help="Mean number of words per document."
+)
+parser.add_argument("--vocabulary", type=int, default=20000, help="Number of words.")
+parser.add_argument(
+    "--zipf_exponent",
+    type=float,
+    default=1.0,
+    help="Exponent of the Zipfian distribution of words.",
+)
+parser.add_argument("--topics", type=int, default=50, help="Number of topics.")
+parser.add_argument("--query_length", type=int, default=4)
+parser.add_argument(
+    "--stopwords",
+    type=int,
+    default=100,
+    help="Number of most frequent words omitted by runs using stop words.",
+)
+parser.add_argument("--first_k", type=int, default=1000)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--processes", type=int, default=None, help="Number of indexing processes."
+)
+parser.add_argument(
+    "--blocks", type=int, default=4, help="Number of partial indexes merged."
+)
+parser.add_argument(
+    "--work_dir",
+    type=str,
+    default=None,
+    help="Directory for the collection and indexes, temporary when not given.",
+)
+parser.add_argument(
+    "--baseline",
+    type=str,
+    default=None,
+    help="Results of a previous benchmark. Exits with an error on regressions.",
+)
+parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    help="Tolerated fraction of throughput lost against the baseline.",
+)
+
+
+def main(args: argparse.Namespace) -> None:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        documents_path, topics_path, stopwords_path = generate_collection(
+            work_dir,
+            args.files,
+            args.docs_per_file,
+            args.doc_length,
+            args.vocabulary,
+            args.zipf_exponent,
+            args.topics,
+            args.query_length,
+            args.stopwords,
+            args.seed,
+        )
+        doc_dir = documents_path[: documents_path.rfind(".")]
+        paths = list(utils.get_filename_iter(doc_dir, documents_path))
+        log.timed(f"Generated collection in {work_dir}")
+
+        results: dict[str, Any] = {
+            "config": {
+                name: value
+                for name, value in vars(args).items()
+                if name not in ("output", "work_dir", "baseline", "tolerance")
+            },
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        }
+        results["parse"], parsed_docs = benchmark_parsing(paths)
+        log.timed("Benchmarked parsing")
+
+        results["runs"] = {}
+        for name in args.runs:
+            results["runs"][name] = benchmark_run(
+                RUNS[name],
+                paths,
+                parsed_docs,
+                topics_path,
+                stopwords_path,
+                work_dir,
+                args.engines,
+                args.processes,
+                args.blocks,
+                args.first_k,
+            )
+            log.timed(f"Benchmarked {name}")
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, mode="w", encoding="utf-8") as file:
+        json.dump(results, file, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline, mode="r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        regressions = find_regressions(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe mapping which evicts least recently used entries once total
+    size of its values exceeds `max_bytes`. Lookups are counted as hits or
+    misses.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int]) -> None:
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._sizeof = sizeof
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value: int) -> None:
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Stores `value` under `key`, unless it alone exceeds `max_bytes`.
+        """
+        value_size = self._sizeof(value)
+        with self._lock:
+            if value_size > self._max_bytes:
+                return
+
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+
+            self._entries[key] = (value, value_size)
+            self.size += value_size
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self._max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self) -> None:
+        """
+        Removes all entries, counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import array
+import hashlib
+import heapq
+import operator
+import os
+import queue
+from collections import Counter
+from multiprocessing import Process, Queue
+from typing import Any, Iterator, Optional
+
+from src import log, terms, utils
+from src.document import Document
+
+# criteria of stop words, average occurrences per document or fraction of
+# documents containing the term
+STOPWORD_CRITERIA = ("cf", "df")
+# seconds between checks that workers are alive while waiting for them
+_POLL_INTERVAL = 1.0
+
+
+class CountMinSketch:
+    """
+    Approximate counts of terms in `depth` rows of `width` counters. Estimates
+    are never lower than true counts and exceed them by at most
+    `e / width` of the total count with probability `1 - exp(-depth)`.
+    """
+
+    def __init__(self, width: int, depth: int) -> None:
+        self._width = width
+        self._depth = depth
+        self._table = array.array("Q", bytes(8 * width * depth))
+
+    def _cells(self, term: str) -> list[int]:
+        # rows use hashes derived from two halves of a single digest
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+        first = int.from_bytes(digest[:4], "little")
+        second = int.from_bytes(digest[4:], "little") | 1
+        return [
+            row * self._width + (first + row * second) % self._width
+            for row in range(self._depth)
+        ]
+
+    def add(self, term: str, count: int = 1) -> None:
+        for cell in self._cells(term):
+            self._table[cell] += count
+
+    def estimate(self, term: str) -> int:
+        return min(self._table[cell] for cell in self._cells(term))
+
+    def merge(self, other: CountMinSketch) -> None:
+        assert (self._width, self._depth) == (
+            other._width,
+            other._depth,
+        ), "CountMinSketch: Unable to merge sketches of different dimensions."
+        self._table = array.array("Q", map(operator.add, self._table, other._table))
+
+
+class ExactCounts:
+    """
+    Exact counts of terms with the interface of `CountMinSketch`.
+    """
+
+    def __init__(self) -> None:
+        self._counts: Counter[str] = Counter()
+
+    def add(self, term: str, count: int = 1) -> None:
+        self._counts[term] += count
+
+    def estimate(self, term: str) -> int:
+        return self._counts[term]
+
+    def merge(self, other: ExactCounts) -> None:
+        self._counts.update(other._counts)
+
+
+class HeavyHitters:
+    """
+    Misra-Gries summary of term counts. Every term whose count exceeds
+    `1 / (capacity + 1)` of the total is kept, together with at most
+    `2 * capacity` other terms. Keeps all terms if `capacity` is None.
+    """
+
+    def __init__(self, capacity: Optional[int]) -> None:
+        self._capacity = capacity
+        self._counts: dict[str, int] = {}
+
+    def add(self, term: str, count: int) -> None:
+        self._counts[term] = self._counts.get(term, 0) + count
+        if self._capacity is not None and len(self._counts) > 2 * self._capacity:
+            self._compact()
+
+    def _compact(self) -> None:
+        # subtracting the count of the (capacity + 1)-th most frequent term from
+        # all terms keeps at most `capacity` of them
+        cut = heapq.nlargest(self._capacity + 1, self._counts.values())[-1]
+        self._counts = {
+            term: count - cut for term, count in self._counts.items() if count > cut
+        }
+
+    def merge(self, other: HeavyHitters) -> None:
+        for term, count in other._counts.items():
+            self.add(term, count)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._counts)
+
+
+class CollectionStatistics:
+    """
+    Document and collection frequencies of terms in memory bounded by sketch
+    dimensions and number of heavy hitters. Statistics of disjoint parts of a
+    collection can be merged. When `sketch_width` is None, frequencies are
+    exact and all terms are kept.
+    """
+
+    def __init__(
+        self,
+        sketch_width: Optional[int] = 2**18,
+        sketch_depth: int = 4,
+        heavy_hitters: Optional[int] = 10000,
+    ) -> None:
+        if sketch_width is None:
+            self.doc_freqs = ExactCounts()
+            self.collection_freqs = ExactCounts()
+            self.heavy_hitters = HeavyHitters(None)
+        else:
+            self.doc_freqs = CountMinSketch(sketch_width, sketch_depth)
+            self.collection_freqs = CountMinSketch(sketch_width, sketch_depth)
+            self.heavy_hitters = HeavyHitters(heavy_hitters)
+        self.doc_count = 0
+        self.token_count = 0
+
+    def add_file(self, doc_path: str, tokenizer: terms.Tokenizer) -> None:
+        # counts are combined per file first, so that every distinct term of
+        # the file updates the sketches once
+        file_doc_freqs: Counter[str] = Counter()
+        file_collection_freqs: Counter[str] = Counter()
+        for doc in utils.stream_document_iter(doc_path, Document):
+            doc_terms = tokenizer(doc.str_all)
+            self.doc_count += 1
+            self.token_count += sum(doc_terms.values())
+            file_doc_freqs.update(doc_terms.keys())
+            file_collection_freqs.update(doc_terms)
+
+        for term, collection_freq in file_collection_freqs.items():
+            self.doc_freqs.add(term, file_doc_freqs[term])
+            self.collection_freqs.add(term, collection_freq)
+            self.heavy_hitters.add(term, collection_freq)
+
+    def merge(self, other: CollectionStatistics) -> None:
+        self.doc_freqs.merge(other.doc_freqs)
+        self.collection_freqs.merge(other.collection_freqs)
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.doc_count += other.doc_count
+        self.token_count += other.token_count
+
+    def doc_freq(self, term: str) -> int:
+        # overestimated document frequencies cannot exceed the document count
+        return min(self.doc_freqs.estimate(term), self.doc_count)
+
+    def collection_freq(self, term: str) -> int:
+        return self.collection_freqs.estimate(term)
+
+    def stopwords(self, threshold: float, criterion: str = "cf") -> list[str]:
+        """
+        Returns terms whose average number of occurrences per document ("cf")
+        or fraction of documents containing them ("df") exceeds `threshold`,
+        most frequent first.
+
+        Only heavy hitters are considered. With approximate statistics, all
+        stop words are found if `threshold` exceeds `1 / (heavy_hitters + 1)`
+        of the average document length.
+        """
+        if criterion not in STOPWORD_CRITERIA:
+            raise ValueError(
+                f"Unknown criterion {criterion}. Choose one of {STOPWORD_CRITERIA}."
+            )
+
+        freq = self.doc_freq if criterion == "df" else self.collection_freq
+        candidates = sorted(
+            ((freq(term), term) for term in self.heavy_hitters),
+            key=lambda candidate: (-candidate[0], candidate[1]),
+        )
+        return [
+            term
+            for term_freq, term in candidates
+            if term_freq / max(self.doc_count, 1) > threshold
+        ]
+
+
+def _collect_worker(
+    paths_queue: Queue,
+    statistics_queue: Queue,
+    separators: str,
+    sketch_width: Optional[int],
+    sketch_depth: int,
+    heavy_hitters: Optional[int],
+) -> None:
+    # statistics or an error are sent as a `(success, payload)` pair
+    try:
+        tokenizer = terms.Tokenizer(separators)
+        statistics = CollectionStatistics(sketch_width, sketch_depth, heavy_hitters)
+        while True:
+            paths = paths_queue.get()
+            if paths is None:
+                break
+
+            for path in paths:
+                statistics.add_file(path, tokenizer)
+            log.flush_metrics()
+    except Exception as error:  # pylint: disable=broad-except
+        statistics_queue.put((False, error))
+    else:
+        statistics_queue.put((True, statistics))
+
+
+def _receive(statistics_queue: Queue, workers: list[Process]) -> tuple[bool, Any]:
+    """
+    Returns next `(success, payload)` pair sent by `workers`. Raises
+    `RuntimeError` if a worker dies without sending it.
+    """
+    while True:
+        try:
+            return statistics_queue.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            for worker in workers:
+                if worker.exitcode not in (None, 0):
+                    raise RuntimeError(
+                        f"Statistics worker exited with code {worker.exitcode}."
+                    )
+
+
+def collect_statistics(
+    docs_paths_iter: Iterator[str],
+    separators: str,
+    sketch_width: Optional[int] = 2**18,
+    sketch_depth: int = 4,
+    heavy_hitters: Optional[int] = 10000,
+    batch_size: int = 20,
+    processes: Optional[int] = None,
+) -> CollectionStatistics:
+    """
+    Computes statistics of all documents in parallel. Each worker process
+    takes batches of `batch_size` files and accumulates their statistics, which
+    are sent to the parent only once all files are processed.
+    """
+    processes = processes or os.cpu_count() or 1
+    paths_queue = Queue()
+    statistics_queue = Queue()
+    workers = [
+        Process(
+            target=_collect_worker,
+            args=(
+                paths_queue,
+                statistics_queue,
+                separators,
+                sketch_width,
+                sketch_depth,
+                heavy_hitters,
+            ),
+            daemon=True,
+        )
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    for paths in utils.batch(docs_paths_iter, batch_size):
+        paths_queue.put(paths)
+    for _ in workers:
+        paths_queue.put(None)
+
+    statistics = CollectionStatistics(sketch_width, sketch_depth, heavy_hitters)
+    # received before joining, workers exit only once their statistics are sent
+    try:
+        for _ in workers:
+            success, payload = _receive(statistics_queue, workers)
+            if not success:
+                raise payload
+
+            statistics.merge(payload)
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        raise
+    for worker in workers:
+        worker.join()
+
+    return statistics
+
+
+def stopwords_path(output_file: str, threshold: float, threshold_count: int) -> str:
+    """
+    Returns `output_file` if there is a single threshold, otherwise the file
+    name with the threshold appended.
+    """
+    if threshold_count == 1:
+        return output_file
+
+    stem, extension = os.path.splitext(output_file)
+    return f"{stem}-{threshold:g}{extension}"
+
+
+def generate_stopwords(
+    docs_paths_iter: Iterator[str],
+    separators: str,
+    thresholds: list[float],
+    output_file: str,
+    criterion: str = "cf",
+    sketch_width: Optional[int] = 2**18,
+    sketch_depth: int = 4,
+    heavy_hitters: Optional[int] = 10000,
+) -> None:
+    """
+    Writes stop words for each of `thresholds` to a separate file, see
+    `CollectionStatistics.stopwords` and `stopwords_path`.
+    """
+    log.timed("Parsing documents...")
+    statistics = collect_statistics(
+        docs_paths_iter, separators, sketch_width, sketch_depth, heavy_hitters
+    )
+    log.timed(
+        f"Parsed {statistics.doc_count} documents with"
+        f" {statistics.token_count} tokens"
+    )
+
+    for threshold in thresholds:
+        path = stopwords_path(output_file, threshold, len(thresholds))
+        stopwords = statistics.stopwords(threshold, criterion)
+        with open(path, mode="w", encoding="utf-8") as stopword_file:
+            for term in stopwords:
+                print(term, file=stopword_file)
+        print(f"Saved {len(stopwords)} stop words above {threshold:g} to {path}")
@@ -0,0 +1,119 @@
+import array
+import itertools
+from typing import Sequence
+
+BLOCK_SIZE = 128
+
+# maps each final byte (high bit set) to its 7 value bits
+_LOW_BITS = bytes(byte & 0x7F for byte in range(256))
+
+
+def _encode_number(out: bytearray, number: int) -> None:
+    while number >= 0x80:
+        out.append(number & 0x7F)
+        number >>= 7
+    out.append(number | 0x80)
+
+
+def vbyte_encode(numbers: Sequence[int]) -> bytes:
+    """
+    Encodes non-negative integers with variable-byte code. Each number is split
+    into 7-bit groups, least significant first, the last group has the high bit
+    set.
+    """
+    out = bytearray()
+    for number in numbers:
+        _encode_number(out, number)
+
+    return bytes(out)
+
+
+def vbyte_decode(data: bytes) -> list[int]:
+    """
+    Decodes numbers encoded by `vbyte_encode`.
+    """
+    data = bytes(data)
+    if len(data) == 0:
+        return []
+
+    # fast path, every number fits into a single byte
+    if min(data) >= 0x80:
+        return list(data.translate(_LOW_BITS))
+
+    numbers = []
+    number = 0
+    shift = 0
+    for byte in data:
+        if byte < 0x80:
+            number |= byte << shift
+            shift += 7
+        else:
+            numbers.append(number | ((byte & 0x7F) << shift))
+            number = 0
+            shift = 0
+
+    return numbers
+
+
+def encode_postings(
+    docs: Sequence[int], counts: Sequence[int]
+) -> tuple[bytes, array.array]:
+    """
+    Encodes postings sorted by document ordinals. Postings are split into blocks
+    of `BLOCK_SIZE`, each block holds document gaps followed by term counts.
+
+    Returns the encoded postings together with skips of their blocks, pairs of
+    the last document ordinal of a block and the offset of its end.
+    """
+    out = bytearray()
+    skips = array.array("Q")
+    prev_doc = 0
+    for start in range(0, len(docs), BLOCK_SIZE):
+        for doc in docs[start : start + BLOCK_SIZE]:
+            _encode_number(out, doc - prev_doc)
+            prev_doc = doc
+        for count in counts[start : start + BLOCK_SIZE]:
+            _encode_number(out, count)
+        skips.extend((prev_doc, len(out)))
+
+    return bytes(out), skips
+
+
+def _extend_block(
+    docs: array.array, counts: array.array, numbers: list[int], prev_doc: int
+) -> None:
+    size = len(numbers) // 2
+    block_docs = itertools.accumulate(numbers[:size], initial=prev_doc)
+    next(block_docs)
+    docs.extend(block_docs)
+    counts.extend(numbers[size:])
+
+
+def decode_block(
+    data: bytes, prev_doc: int, typecode: str
+) -> tuple[array.array, array.array]:
+    """
+    Decodes a single block of postings encoded by `encode_postings`, which
+    follows the block ending with document ordinal `prev_doc`.
+    """
+    docs = array.array(typecode)
+    counts = array.array(typecode)
+    _extend_block(docs, counts, vbyte_decode(data), prev_doc)
+    return docs, counts
+
+
+def decode_postings(data: bytes, typecode: str) -> tuple[array.array, array.array]:
+    """
+    Decodes postings encoded by `encode_postings` into arrays of document
+    ordinals and term counts.
+    """
+    numbers = vbyte_decode(data)
+    postings_count = len(numbers) // 2
+    docs = array.array(typecode)
+    counts = array.array(typecode)
+    for start in range(0, postings_count, BLOCK_SIZE):
+        size = min(BLOCK_SIZE, postings_count - start)
+        prev_doc = docs[-1] if len(docs) > 0 else 0
+        _extend_block(docs, counts, numbers[2 * start : 2 * (start + size)], prev_doc)
+
+    return docs, counts
@@ -0,0 +1,132 @@
+import array
+import hashlib
+import io
+import os
+import struct
+import tempfile
+import zlib
+from typing import Optional
+
+from src import sgml
+
+MAGIC = b"VSMF"
+# magic, parser version, documents, fields, tags
+_HEADER = struct.Struct("<4sIIII")
+_TAG_SEP = "\0"
+
+_cache_dir: Optional[str] = None
+
+
+def set_cache_dir(cache_dir: Optional[str]) -> None:
+    """
+    Enables caching of parsed documents in `cache_dir`, or disables it when
+    `None`. Should be called before worker processes are started.
+    """
+    global _cache_dir  # pylint: disable=global-statement
+    _cache_dir = cache_dir
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+def cache_dir() -> Optional[str]:
+    return _cache_dir
+
+
+def parsed_documents(doc_path: str) -> list[list[tuple[str, str]]]:
+    """
+    Returns `(tag, text)` fields of all documents in `doc_path`. Fields are
+    cached under the hash of file contents and parser version, so unchanged
+    files are parsed only once.
+    """
+    with open(doc_path, mode="rb") as file:
+        content = file.read()
+
+    digest = hashlib.sha256(content).hexdigest()
+    cache_path = os.path.join(_cache_dir, f"{digest}-{sgml.PARSER_VERSION}.fields")
+    if os.path.exists(cache_path):
+        try:
+            return _read(cache_path)
+        except (ValueError, zlib.error, struct.error):
+            pass
+
+    # decoded the same way as a file opened in text mode
+    text_file = io.TextIOWrapper(io.BytesIO(content), encoding="utf-8")
+    docs = [sgml.parse_fields(source) for source in sgml.iter_doc_sources(text_file)]
+    _write(cache_path, docs)
+    return docs
+
+
+def _write(cache_path: str, docs: list[list[tuple[str, str]]]) -> None:
+    """
+    Writes fields column-wise: field counts of documents, tag indexes and text
+    lengths of fields, tag names and all texts concatenated.
+    """
+    tags: dict[str, int] = {}
+    doc_field_counts = array.array("I", (len(fields) for fields in docs))
+    field_tags = array.array("H")
+    text_lengths = array.array("I")
+    texts = []
+    for fields in docs:
+        for tag, text in fields:
+            field_tags.append(tags.setdefault(tag, len(tags)))
+            text_lengths.append(len(text))
+            texts.append(text)
+
+    payload = b"".join(
+        [
+            _HEADER.pack(
+                MAGIC, sgml.PARSER_VERSION, len(docs), len(field_tags), len(tags)
+            ),
+            doc_field_counts.tobytes(),
+            field_tags.tobytes(),
+            text_lengths.tobytes(),
+            _TAG_SEP.join(tags).encode("utf-8") + _TAG_SEP.encode("utf-8"),
+            "".join(texts).encode("utf-8"),
+        ]
+    )
+
+    # written atomically, other processes may read or write the same entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+    with os.fdopen(fd, mode="wb") as file:
+        file.write(zlib.compress(payload))
+    os.replace(tmp_path, cache_path)
+
+
+def _read(cache_path: str) -> list[list[tuple[str, str]]]:
+    with open(cache_path, mode="rb") as file:
+        payload = zlib.decompress(file.read())
+
+    magic, version, doc_count, field_count, tag_count = _HEADER.unpack_from(payload)
+    if magic != MAGIC or version != sgml.PARSER_VERSION:
+        raise ValueError(f"Document cache: {cache_path} is not a supported entry.")
+
+    pos = _HEADER.size
+
+    def column(typecode: str, length: int) -> array.array:
+        nonlocal pos
+        values = array.array(typecode)
+        values.frombytes(payload[pos : pos + length * values.itemsize])
+        pos += length * values.itemsize
+        return values
+
+    doc_field_counts = column("I", doc_count)
+    field_tags = column("H", field_count)
+    text_lengths = column("I", field_count)
+    strings = payload[pos:].decode("utf-8").split(_TAG_SEP, tag_count)
+    tags, all_text = strings[:tag_count], strings[tag_count]
+
+    docs = []
+    field = 0
+    text_pos = 0
+    for field_count in doc_field_counts:
+        fields = []
+        for tag, length in zip(
+            field_tags[field : field + field_count],
+            text_lengths[field : field + field_count],
+        ):
+            fields.append((tags[tag], all_text[text_pos : text_pos + length]))
+            text_pos += length
+        docs.append(fields)
+        field += field_count
+
+    return docs
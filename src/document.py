@@ -2,6 +2,8 @@ import bs4
 
 
 class Document:
+    TAG_BLACKLIST: frozenset[str] = frozenset()
+
     def __init__(self, tag: bs4.element.Tag) -> None:
         """
         Initializes `Document` instance.
@@ -18,58 +20,71 @@ class Document:
     @property
     def str_all(self) -> str:
         """
-        Returns all string inside SGML tags.
+        Returns all string inside SGML tags, except those in `TAG_BLACKLIST`.
         """
-        string = ""
-        for descendant in self._tag.descendants:
-            if isinstance(descendant, bs4.NavigableString):
-                string += str(descendant)
-
-        return string
+        return "".join(
+            str(descendant)
+            for descendant in self._tag.descendants
+            if isinstance(descendant, bs4.NavigableString)
+            and descendant.parent.name not in self.TAG_BLACKLIST
+        )
 
 
 class DocumentCS(Document):
-    @property
-    def str_all(self) -> str:
-        string = ""
-        for descendant in self._tag.descendants:
-            if isinstance(
-                descendant, bs4.NavigableString
-            ) and descendant.parent.name not in ["DOCNO", "DOCID"]:
-                string += str(descendant)
-
-        return string
+    TAG_BLACKLIST = frozenset(["DOCNO", "DOCID"])
 
 
 class DocumentEN(Document):
-    def __init__(self, tag: bs4.element.Tag) -> None:
-        super().__init__(tag)
-        self._tag_blacklist = set(
-            [
-                "DOCNO",
-                "DOCID",
-                "SN",
-                "PD",
-                "PN",
-                "PG",
-                "PP",
-                "WD",
-                "SM",
-                "SL",
-                "CB",
-                "IN",
-                "FN",
-            ]
-        )
+    TAG_BLACKLIST = frozenset(
+        [
+            "DOCNO",
+            "DOCID",
+            "SN",
+            "PD",
+            "PN",
+            "PG",
+            "PP",
+            "WD",
+            "SM",
+            "SL",
+            "CB",
+            "IN",
+            "FN",
+        ]
+    )
+
+
+class StreamedDocument:
+    def __init__(
+        self, fields: list[tuple[str, str]], tag_blacklist: frozenset[str]
+    ) -> None:
+        """
+        Initializes document from `(tag, text)` pairs produced by streaming
+        parser.
+        """
+        self._fields = fields
+        self._tag_blacklist = tag_blacklist
 
     @property
-    def str_all(self) -> str:
-        string = ""
-        for descendant in self._tag.descendants:
-            if (
-                isinstance(descendant, bs4.NavigableString)
-                and descendant.parent.name not in self._tag_blacklist
-            ):
-                string += str(descendant)
+    def id(self) -> str:
+        """
+        Returns unique document number.
+        """
+        for tag, text in self._fields:
+            if tag == "DOCNO":
+                return text
+
+        raise ValueError("StreamedDocument: Document has no DOCNO.")
+
+    @property
+    def fields(self) -> list[tuple[str, str]]:
+        return self._fields
 
-        return string
+    @property
+    def str_all(self) -> str:
+        """
+        Returns all string inside SGML tags, except those in tag blacklist.
+        """
+        return "".join(
+            text for tag, text in self._fields if tag not in self._tag_blacklist
+        )
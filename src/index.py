@@ -1,122 +1,970 @@
 from __future__ import annotations
 
+import array
+import bisect
 import heapq
+import itertools
 import math
-from dataclasses import dataclass
-from typing import Callable, Optional
+import operator
+import time
+from dataclasses import dataclass, field
+from multiprocessing.pool import Pool
+from typing import Callable, Iterator, Optional, Sequence
+
+from src import log, terms
+from src.cache import LRUCache
+
+POSTING_TYPECODE = "I"
+# rough per-entry memory overheads of Python objects used by `InvertedIndex`
+_TERM_OVERHEAD = 400
+_DOC_OVERHEAD = 150
+# relative slack of pruning threshold, covers rounding of partial scores
+_PRUNING_TOLERANCE = 1e-9
+SKIP_INTERVAL = 128
+# greater than any document ordinal, marks exhausted cursor
+END_DOC = 1 << 32
+ENGINES = ("python", "numpy", "maxscore", "daat", "impact")
+# default memory limit of cached query results
+RESULT_CACHE_BYTES = 64 * 2**20
+# rough memory overhead of a single `(score, doc_id)` result
+_RESULT_OVERHEAD = 120
+IMPACT_TYPECODE = "B"
+# number of quantized impact levels, the highest is given to the largest weight
+IMPACT_LEVELS = 255
+
+
+def _new_array() -> array.array:
+    return array.array(POSTING_TYPECODE)
 
 
 @dataclass
-class Posting:
-    doc_id: str
-    count: int
-    next: Optional[Posting] = None
+class Postings:
+    """
+    Postings of a single term as parallel packed arrays of document ordinals
+    and term counts.
+    """
+
+    docs: Sequence[int] = field(default_factory=_new_array)
+    counts: Sequence[int] = field(default_factory=_new_array)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return zip(self.docs, self.counts)
+
+    def cursor(self) -> PostingsCursor:
+        return PostingsCursor(self)
+
+
+class PostingsCursor:
+    """
+    Document-at-a-time iterator over postings sorted by document ordinals.
+    Every block of `SKIP_INTERVAL` postings is represented in a skip list by its
+    last ordinal, which lets the cursor jump over blocks without visiting them.
+    """
+
+    def __init__(self, postings: Postings) -> None:
+        self._docs = postings.docs
+        self._counts = postings.counts
+        self._skips = postings.docs[SKIP_INTERVAL - 1 :: SKIP_INTERVAL]
+        self._pos = 0
+        self.doc = self._docs[0] if len(self._docs) > 0 else END_DOC
+
+    @property
+    def count(self) -> int:
+        return self._counts[self._pos]
+
+    def next_doc(self) -> int:
+        """
+        Moves to the next posting and returns its document ordinal.
+        """
+        self._pos += 1
+        self.doc = self._docs[self._pos] if self._pos < len(self._docs) else END_DOC
+        return self.doc
+
+    def advance(self, target: int) -> int:
+        """
+        Moves to the first posting with document ordinal at least `target` and
+        returns the ordinal.
+        """
+        if self.doc >= target:
+            return self.doc
+
+        block = bisect.bisect_left(self._skips, target, self._pos // SKIP_INTERVAL)
+        start = max(self._pos, block * SKIP_INTERVAL)
+        end = min(len(self._docs), (block + 1) * SKIP_INTERVAL)
+        self._pos = bisect.bisect_left(self._docs, target, start, end)
+        self.doc = self._docs[self._pos] if self._pos < len(self._docs) else END_DOC
+        return self.doc
+
+
+@dataclass
+class ImpactPostings:
+    """
+    Postings of a single term ordered by quantized impact, highest first.
+    Documents of segment `i` have impact `impacts[i]` and are stored sorted by
+    ordinals in `docs[starts[i] : starts[i + 1]]`.
+    """
+
+    impacts: Sequence[int]
+    starts: Sequence[int]
+    docs: Sequence[int]
+
+    def segment(self, i: int) -> Sequence[int]:
+        return self.docs[self.starts[i] : self.starts[i + 1]]
 
 
 class InvertedIndex:
     def __init__(self) -> None:
-        self._lasts = {}
-        self._terms = {}
-        self._doc_freq = {}
+        self._terms: dict[str, Postings] = {}
+        self._doc_ids: list[str] = []
+        self._doc_ordinals: dict[str, int] = {}
+        self._norms: dict[str, Sequence[float]] = {}
+        self._bounds: dict[str, dict[str, float]] = {}
+        self._impacts: dict[str, dict[str, ImpactPostings]] = {}
+        self._impact_scales: dict[str, float] = {}
+        self._results = LRUCache(RESULT_CACHE_BYTES, _results_size)
+        self._stale = False
+        self._generation = 0
+        self._doc_count = 0
+
+    @property
+    def doc_count(self) -> int:
+        """
+        Returns number of documents in the collection, including empty ones.
+        Documents are counted with their first posting, documents without
+        postings have to be counted by increasing it.
+        """
+        return self._doc_count
+
+    @doc_count.setter
+    def doc_count(self, value: int) -> None:
+        self._doc_count = value
+        self._drop_statistics()
+
+    def _drop_statistics(self) -> None:
+        # statistics are only marked stale, they are cleared once read after the
+        # index changes, so that indexing does not pay for clearing them
+        self._stale = True
+        # results computed before the change are cached under the old generation
+        # and never found again, even if a concurrent query cleared the stale
+        # statistics before they are stored
+        self._generation += 1
+
+    def _check_statistics(self) -> None:
+        if self._stale:
+            self._stale = False
+            self._clear_statistics()
+
+    def _clear_statistics(self) -> None:
+        self._norms.clear()
+        self._bounds.clear()
+        self._impacts.clear()
+        self._impact_scales.clear()
+        self._results.clear()
+
+    def _intern(self, doc_id: str) -> int:
+        ordinal = self._doc_ordinals.get(doc_id, None)
+        if ordinal is None:
+            ordinal = len(self._doc_ids)
+            self._doc_ordinals[doc_id] = ordinal
+            self._doc_ids.append(doc_id)
+
+        return ordinal
 
     def add_posting(self, term: str, doc_id: str, count: int) -> None:
-        posting = Posting(doc_id, count, self._terms.get(term, None))
-        self._terms[term] = posting
-        if term not in self._lasts:
-            self._lasts[term] = posting
+        postings = self._terms.get(term, None)
+        if postings is None:
+            postings = Postings()
+            self._terms[term] = postings
 
-        self._doc_freq[term] = self._doc_freq.get(term, 0) + 1
+        doc = self._doc_ordinals.get(doc_id, None)
+        if doc is None:
+            # documents are counted with their first posting
+            doc = self._intern(doc_id)
+            self._doc_count += 1
+        if len(postings) == 0 or postings.docs[-1] < doc:
+            postings.docs.append(doc)
+            postings.counts.append(count)
+        else:
+            # keeps postings sorted by document ordinals
+            pos = bisect.bisect_left(postings.docs, doc)
+            postings.docs.insert(pos, doc)
+            postings.counts.insert(pos, count)
+        self._drop_statistics()
 
     def update_with(self, other: InvertedIndex) -> None:
         assert isinstance(
             other, InvertedIndex
         ), "InvertedIndex: Unable to merge instances of other classes."
 
-        for term in other._terms:
-            prev_first = self._terms.get(term, None)
-            self._terms[term] = other._terms[term]
-            if prev_first is None:
-                self._lasts[term] = other._lasts[term]
-            else:
-                other._lasts[term].next = prev_first
+        mapping = [self._intern(doc_id) for doc_id in other.doc_ids()]
+        # documents of `other` keep their order unless some were already indexed
+        monotonic = all(map(operator.lt, mapping, itertools.islice(mapping, 1, None)))
+        for term in other.terms():
+            other_postings = other.postings(term)
+            if len(other_postings) == 0:
+                continue
+
+            postings = self._terms.get(term, None)
+            if postings is None:
+                postings = Postings()
+                self._terms[term] = postings
+
+            other_docs = map(mapping.__getitem__, other_postings.docs)
+            if monotonic and (
+                len(postings) == 0
+                or postings.docs[-1] < mapping[other_postings.docs[0]]
+            ):
+                postings.docs.extend(other_docs)
+                postings.counts.extend(other_postings.counts)
+                continue
+
+            merged = sorted(
+                itertools.chain(
+                    zip(postings.docs, postings.counts),
+                    zip(other_docs, other_postings.counts),
+                )
+            )
+            postings.docs = array.array(POSTING_TYPECODE, (doc for doc, _ in merged))
+            postings.counts = array.array(
+                POSTING_TYPECODE, (count for _, count in merged)
+            )
+
+        self.doc_count += other.doc_count
+
+    @property
+    def result_cache(self) -> LRUCache:
+        """
+        Returns cache of query results, which is cleared whenever the index
+        changes.
+        """
+        self._check_statistics()
+        return self._results
+
+    def estimated_size(self) -> int:
+        """
+        Returns rough estimate of memory taken by the index in bytes.
+        """
+        postings_count = sum(len(postings) for postings in self._terms.values())
+        return (
+            2 * array.array(POSTING_TYPECODE).itemsize * postings_count
+            + _TERM_OVERHEAD * len(self._terms)
+            + _DOC_OVERHEAD * len(self._doc_ids)
+        )
+
+    def terms(self) -> Iterator[str]:
+        """
+        Returns iterator over all indexed terms.
+        """
+        return iter(self._terms)
+
+    def doc_ids(self) -> Sequence[str]:
+        """
+        Returns document IDs indexed by their ordinals.
+        """
+        return self._doc_ids
 
-            self._doc_freq[term] = self._doc_freq.get(term, 0) + other._doc_freq[term]
+    def doc_freq(self, term: str) -> int:
+        postings = self._terms.get(term, None)
+        return 0 if postings is None else len(postings)
+
+    def postings(self, term: str) -> Postings:
+        """
+        Returns postings of given term, empty if the term is not indexed.
+        """
+        return self._terms.get(term, Postings())
+
+    def postings_cursor(self, term: str) -> PostingsCursor:
+        """
+        Returns document-at-a-time cursor over postings of given term.
+        """
+        return self.postings(term).cursor()
+
+    def weighting(self, name: str) -> Callable[[int, int], float]:
+        return terms.get_weighting(name, self.doc_count)
+
+    def compute_norms(self) -> None:
+        """
+        Computes document vector norms and term weight bounds for all supported
+        weightings. Should be called once indexing is finished.
+        """
+        for name in terms.WEIGHTINGS:
+            self.doc_norms(name)
+            self._term_bounds(name)
+
+    def doc_norms(self, weighting: str) -> Sequence[float]:
+        """
+        Returns euclidean norms of document vectors indexed by document ordinals.
+        """
+        self._check_statistics()
+        norms = self._norms.get(weighting, None)
+        if norms is not None:
+            return norms
+
+        weight = self.weighting(weighting)
+        squares = [0.0] * len(self.doc_ids())
+        for term in self.terms():
+            term_doc_freq = self.doc_freq(term)
+            for doc, count in self.postings(term):
+                squares[doc] += weight(count, term_doc_freq) ** 2
+
+        norms = array.array("d", map(math.sqrt, squares))
+        self._norms[weighting] = norms
+        return norms
+
+    def max_weight(self, term: str, weighting: str) -> float:
+        """
+        Returns maximum normalized weight of `term` over all documents, which
+        bounds the term's contribution to any cosine similarity.
+        """
+        return self._term_bounds(weighting).get(term, 0.0)
+
+    def _max_term_bound(self, weighting: str) -> float:
+        return max(self._term_bounds(weighting).values(), default=0.0)
+
+    def _term_bounds(self, weighting: str) -> dict[str, float]:
+        self._check_statistics()
+        bounds = self._bounds.get(weighting, None)
+        if bounds is not None:
+            return bounds
+
+        weight = self.weighting(weighting)
+        norms = self.doc_norms(weighting)
+        bounds = {}
+        for term in self.terms():
+            term_doc_freq = self.doc_freq(term)
+            bounds[term] = max(
+                (
+                    weight(count, term_doc_freq) / norms[doc]
+                    for doc, count in self.postings(term)
+                ),
+                default=0.0,
+            )
+
+        self._bounds[weighting] = bounds
+        return bounds
+
+    def compute_impacts(self, weighting: str) -> None:
+        """
+        Builds impact ordered postings of all terms for `weighting`. Otherwise
+        they are built lazily for queried terms.
+        """
+        for term in self.terms():
+            self.impact_postings(term, weighting)
+
+    def impact_postings(self, term: str, weighting: str) -> ImpactPostings:
+        """
+        Returns postings of `term` ordered by impact, the term's normalized
+        weight in the document quantized to `IMPACT_LEVELS` levels.
+        """
+        self._check_statistics()
+        term_impacts = self._impacts.setdefault(weighting, {})
+        impact_postings = term_impacts.get(term, None)
+        if impact_postings is not None:
+            return impact_postings
+
+        weight = self.weighting(weighting)
+        norms = self.doc_norms(weighting)
+        scale = self._impact_scale(weighting)
+        term_doc_freq = self.doc_freq(term)
+        entries = sorted(
+            (-max(1, round(weight(count, term_doc_freq) / norms[doc] * scale)), doc)
+            for doc, count in self.postings(term)
+        )
+
+        impact_postings = ImpactPostings(
+            array.array(IMPACT_TYPECODE),
+            array.array(POSTING_TYPECODE, [0]),
+            _new_array(),
+        )
+        for neg_impact, segment in itertools.groupby(entries, key=lambda e: e[0]):
+            impact_postings.impacts.append(-neg_impact)
+            impact_postings.docs.extend(doc for _, doc in segment)
+            impact_postings.starts.append(len(impact_postings.docs))
+
+        term_impacts[term] = impact_postings
+        return impact_postings
+
+    def _impact_scale(self, weighting: str) -> float:
+        self._check_statistics()
+        scale = self._impact_scales.get(weighting, None)
+        if scale is None:
+            max_impact = self._max_term_bound(weighting)
+            scale = IMPACT_LEVELS / max_impact if max_impact > 0 else 1.0
+            self._impact_scales[weighting] = scale
+
+        return scale
 
     def get_most_similar(
         self,
         query: dict[str, int],
-        weighting: Callable[[int, int], float],
+        weighting: str,
         first_k: int = 1000,
+        engine: str = "python",
+        postings_budget: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> list[tuple[float, str]]:
+        """
+        Returns `first_k` most similar documents to `query` as `(score, doc_id)`
+        pairs, most similar first. Ties are broken by document ordinal.
+
+        `engine` selects scoring implementation. "python", "numpy" and "maxscore"
+        evaluate the query term-at-a-time, "maxscore" skips documents that
+        cannot enter the top `first_k` and, once no new document can, postings
+        of documents not seen before. "daat" evaluates the query
+        document-at-a-time and uses skip lists to avoid the same documents. All
+        of them return identical results.
+
+        "impact" is approximate. It processes segments of impact ordered
+        postings with highest query contributions first and stops after
+        `postings_budget` postings or `time_budget` seconds. Its scores are sums
+        of quantized impacts.
+
+        Results of exact engines are cached by query terms, `weighting` and
+        `first_k`.
+        """
+        log.count("queries")
+        self._check_statistics()
+        result_key = self._result_key(query, weighting, first_k, engine)
+        if result_key is not None:
+            similars = self._results.get(result_key)
+            if similars is not None:
+                return list(similars)
+
+        with log.stage(self._query_stage(None, 1)):
+            similars = self._get_most_similar(
+                query, weighting, first_k, engine, postings_budget, time_budget
+            )
+        if result_key is not None:
+            self._results.put(result_key, tuple(similars))
+
+        return similars
+
+    def _result_key(
+        self, query: dict[str, int], weighting: str, first_k: int, engine: str
+    ) -> Optional[tuple]:
+        if engine not in ENGINES:
+            raise ValueError(f"InvertedIndex: Unknown scoring engine {engine}.")
+
+        # results of approximate engine depend on budgets and timing
+        if engine == "impact":
+            return None
+
+        return (tuple(sorted(query.items())), weighting, first_k, self._generation)
+
+    def _get_most_similar(
+        self,
+        query: dict[str, int],
+        weighting: str,
+        first_k: int,
+        engine: str,
+        postings_budget: Optional[int],
+        time_budget: Optional[float],
     ) -> list[tuple[float, str]]:
-        query_weights = self._normalize_query(query, weighting)
-        scores, norms = self._compute_scores_w_norms(query_weights, weighting)
+        weight = self.weighting(weighting)
+        norms = self.doc_norms(weighting)
+        query_weights = self._normalize_query(query, weight)
+
+        if engine == "python":
+            top = self._top_k_python(query_weights, weight, norms, first_k)
+        elif engine == "numpy":
+            top = self._top_k_numpy(query_weights, weight, norms, first_k)
+        elif engine == "maxscore":
+            top = self._top_k_maxscore(query_weights, weighting, weight, norms, first_k)
+        elif engine == "daat":
+            top = self._top_k_daat(query_weights, weighting, weight, norms, first_k)
+        elif engine == "impact":
+            top = self._top_k_impact(
+                query_weights, weighting, first_k, postings_budget, time_budget
+            )
+        else:
+            raise ValueError(f"InvertedIndex: Unknown scoring engine {engine}.")
+
+        return [(doc_score, self._doc_id(doc)) for doc_score, doc in top]
+
+    def get_most_similar_batch(
+        self,
+        queries: list[dict[str, int]],
+        weighting: str,
+        first_k: int = 1000,
+        engine: str = "python",
+        processes: Optional[int] = None,
+        postings_budget: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> list[list[tuple[float, str]]]:
+        """
+        Returns result of `get_most_similar` for each of `queries`. Budgets apply
+        to each query separately.
+
+        With the python engine, postings of every distinct term are traversed and
+        weighted only once for the whole batch. When `processes` is greater than
+        one, queries are split among a process pool sharing this index.
+        """
+        log.count("queries", len(queries))
+        self._check_statistics()
+        similars = [None] * len(queries)
+        result_keys = [
+            self._result_key(query, weighting, first_k, engine) for query in queries
+        ]
+        missing = []
+        for i, result_key in enumerate(result_keys):
+            cached = None if result_key is None else self._results.get(result_key)
+            if cached is None:
+                missing.append(i)
+            else:
+                similars[i] = list(cached)
+
+        with log.stage(self._query_stage(processes, len(missing))):
+            computed = self._get_most_similar_batch(
+                [queries[i] for i in missing],
+                weighting,
+                first_k,
+                engine,
+                processes,
+                postings_budget,
+                time_budget,
+            )
+        for i, query_similars in zip(missing, computed):
+            similars[i] = query_similars
+            if result_keys[i] is not None:
+                self._results.put(result_keys[i], tuple(query_similars))
+
+        return similars
+
+    def _query_stage(self, processes: Optional[int], query_count: int) -> str:
+        """
+        Returns name of the stage timing queries in this process. Queries scored
+        by other processes are timed there as "query" and only their dispatch is
+        timed here.
+        """
+        if processes is not None and processes > 1 and query_count > 1:
+            return "dispatch"
+
+        return "query"
+
+    def _get_most_similar_batch(
+        self,
+        queries: list[dict[str, int]],
+        weighting: str,
+        first_k: int,
+        engine: str,
+        processes: Optional[int],
+        postings_budget: Optional[int],
+        time_budget: Optional[float],
+    ) -> list[list[tuple[float, str]]]:
+        # computed before forking, so that workers do not compute them again
+        norms = self.doc_norms(weighting)
+
+        if processes is not None and processes > 1 and len(queries) > 1:
+            chunk_size = math.ceil(len(queries) / processes)
+            chunks = [
+                (
+                    queries[i : i + chunk_size],
+                    weighting,
+                    first_k,
+                    engine,
+                    postings_budget,
+                    time_budget,
+                )
+                for i in range(0, len(queries), chunk_size)
+            ]
+            with Pool(
+                processes, initializer=_init_batch_worker, initargs=(self,)
+            ) as pool:
+                return [
+                    similars
+                    for chunk_similars in pool.map(_batch_worker, chunks)
+                    for similars in chunk_similars
+                ]
+
+        if engine != "python":
+            return [
+                self._get_most_similar(
+                    query, weighting, first_k, engine, postings_budget, time_budget
+                )
+                for query in queries
+            ]
+
+        weight = self.weighting(weighting)
+        all_query_weights = [self._normalize_query(query, weight) for query in queries]
+        term_weights = {}
+        for query_weights in all_query_weights:
+            for term in query_weights:
+                if term not in term_weights:
+                    term_doc_freq = self.doc_freq(term)
+                    postings = self.postings(term)
+                    term_weights[term] = (
+                        postings.docs,
+                        [weight(count, term_doc_freq) for count in postings.counts],
+                    )
+
+        results = []
+        for query_weights in all_query_weights:
+            scores = {}
+            for term, query_w in query_weights.items():
+                docs, doc_weights = term_weights[term]
+                for doc, doc_weight in zip(docs, doc_weights):
+                    scores[doc] = scores.get(doc, 0) + query_w * doc_weight
+
+            top = self._select_top_k(scores, norms, first_k)
+            results.append([(doc_score, self._doc_id(doc)) for doc_score, doc in top])
+
+        return results
+
+    def _top_k_python(
+        self,
+        query_weights: dict[str, float],
+        weighting: Callable[[int, int], float],
+        norms: Sequence[float],
+        first_k: int,
+    ) -> list[tuple[float, int]]:
+        scores = self._compute_scores(query_weights, weighting)
+        return self._select_top_k(scores, norms, first_k)
+
+    def _top_k_maxscore(
+        self,
+        query_weights: dict[str, float],
+        weighting_name: str,
+        weighting: Callable[[int, int], float],
+        norms: Sequence[float],
+        first_k: int,
+    ) -> list[tuple[float, int]]:
+        query_terms = list(query_weights)
+        term_bounds = [
+            query_weights[term] * self.max_weight(term, weighting_name)
+            for term in query_terms
+        ]
+        # terms with highest bounds first, so that the threshold rises quickly
+        order = sorted(
+            range(len(query_terms)), key=term_bounds.__getitem__, reverse=True
+        )
+        remaining_bounds = list(
+            itertools.accumulate((term_bounds[i] for i in reversed(order)), initial=0.0)
+        )[::-1]
+
+        partials = {}
+        pruned = set()
+        # contributions are kept in query order, so that the final sums are
+        # bit-identical to exhaustive scoring
+        contributions = {}
+        cutoff = 0.0
+        for step, i in enumerate(order):
+            term = query_terms[i]
+            query_w = query_weights[term]
+            term_doc_freq = self.doc_freq(term)
+            # documents not seen yet cannot reach the threshold
+            new_docs = len(partials) < first_k or remaining_bounds[step] >= cutoff
+            if new_docs:
+                term_postings = self.postings(term)
+            else:
+                term_postings = self._seen_postings(term, sorted(contributions))
+            for doc, count in term_postings:
+                doc_contributions = contributions.get(doc, None)
+                if doc_contributions is None:
+                    if not new_docs or doc in pruned:
+                        continue
+                    doc_contributions = [0] * len(query_terms)
+                    contributions[doc] = doc_contributions
+                    partials[doc] = 0.0
+
+                doc_contribution = query_w * weighting(count, term_doc_freq)
+                doc_contributions[i] = doc_contribution
+                partials[doc] += doc_contribution / norms[doc]
+
+            if len(partials) >= first_k > 0:
+                threshold = heapq.nlargest(first_k, partials.values())[-1]
+                cutoff = threshold * (1 - _PRUNING_TOLERANCE)
+                for doc in [
+                    doc
+                    for doc, partial in partials.items()
+                    if partial + remaining_bounds[step + 1] < cutoff
+                ]:
+                    del partials[doc]
+                    del contributions[doc]
+                    pruned.add(doc)
+
+        scores = {}
+        for doc, doc_contributions in contributions.items():
+            score = 0
+            for doc_contribution in doc_contributions:
+                score += doc_contribution
+            scores[doc] = score
+
+        return self._select_top_k(scores, norms, first_k)
+
+    def _seen_postings(self, term: str, docs: list[int]) -> Iterator[tuple[int, int]]:
+        """
+        Yields postings of `term` with document ordinals in sorted `docs`,
+        skipping the others.
+        """
+        cursor = self.postings_cursor(term)
+        for doc in docs:
+            if cursor.advance(doc) == doc:
+                yield doc, cursor.count
+
+    def _top_k_daat(
+        self,
+        query_weights: dict[str, float],
+        weighting_name: str,
+        weighting: Callable[[int, int], float],
+        norms: Sequence[float],
+        first_k: int,
+    ) -> list[tuple[float, int]]:
+        if first_k <= 0:
+            return []
+
+        query_terms = list(query_weights)
+        query_ws = [query_weights[term] for term in query_terms]
+        doc_freqs = [self.doc_freq(term) for term in query_terms]
+        cursors = [self.postings_cursor(term) for term in query_terms]
+        term_bounds = [
+            query_w * self.max_weight(term, weighting_name)
+            for term, query_w in zip(query_terms, query_ws)
+        ]
+        # terms with lowest bounds first, a prefix of terms whose bounds sum
+        # below the threshold cannot alone bring a document to the top
+        order = sorted(range(len(query_terms)), key=term_bounds.__getitem__)
+        prefix_bounds = list(
+            itertools.accumulate((term_bounds[i] for i in order), initial=0.0)
+        )
 
         min_heap = []
-        for doc_id, count in scores.items():
-            doc_score = count / math.sqrt(norms[doc_id])
+        cutoff = 0.0
+        non_essential = 0
+        while non_essential < len(order):
+            essential = order[non_essential:]
+            doc = min(cursors[i].doc for i in essential)
+            if doc == END_DOC:
+                break
+
+            norm = norms[doc]
+            # contributions are kept in query order, so that the final sums are
+            # bit-identical to term-at-a-time scoring
+            contributions = [0] * len(query_terms)
+            partial = 0.0
+            for i in essential:
+                cursor = cursors[i]
+                if cursor.doc == doc:
+                    contributions[i] = query_ws[i] * weighting(
+                        cursor.count, doc_freqs[i]
+                    )
+                    partial += contributions[i] / norm
+                    cursor.next_doc()
+
+            pruned = False
+            for j in range(non_essential - 1, -1, -1):
+                if partial + prefix_bounds[j + 1] < cutoff:
+                    pruned = True
+                    break
+
+                i = order[j]
+                cursor = cursors[i]
+                if cursor.advance(doc) == doc:
+                    contributions[i] = query_ws[i] * weighting(
+                        cursor.count, doc_freqs[i]
+                    )
+                    partial += contributions[i] / norm
+
+            if pruned:
+                continue
+
+            score = 0
+            for contribution in contributions:
+                score += contribution
+            entry = (score / norm, doc)
+            if len(min_heap) < first_k:
+                heapq.heappush(min_heap, entry)
+            elif entry > min_heap[0]:
+                heapq.heappushpop(min_heap, entry)
+
+            if len(min_heap) == first_k:
+                cutoff = min_heap[0][0] * (1 - _PRUNING_TOLERANCE)
+                while (
+                    non_essential < len(order)
+                    and prefix_bounds[non_essential + 1] < cutoff
+                ):
+                    non_essential += 1
+
+        min_heap.sort(reverse=True)
+        return min_heap
+
+    def _top_k_impact(
+        self,
+        query_weights: dict[str, float],
+        weighting_name: str,
+        first_k: int,
+        postings_budget: Optional[int],
+        time_budget: Optional[float],
+    ) -> list[tuple[float, int]]:
+        all_impact_postings = []
+        segments = []
+        for term, query_w in query_weights.items():
+            impact_postings = self.impact_postings(term, weighting_name)
+            for i, impact in enumerate(impact_postings.impacts):
+                segments.append((query_w * impact, len(all_impact_postings), i))
+            all_impact_postings.append(impact_postings)
+
+        # segments with highest contributions first
+        segments.sort(reverse=True)
+        # lazily built impact ordered postings do not count towards the budget
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        remaining = math.inf if postings_budget is None else postings_budget
+        scores = {}
+        for contribution, postings_idx, i in segments:
+            if remaining <= 0 or (
+                deadline is not None and time.perf_counter() >= deadline
+            ):
+                break
+
+            docs = all_impact_postings[postings_idx].segment(i)
+            if len(docs) > remaining:
+                docs = docs[:remaining]
+            remaining -= len(docs)
+            for doc in docs:
+                scores[doc] = scores.get(doc, 0) + contribution
+
+        scale = self._impact_scale(weighting_name)
+        return heapq.nlargest(
+            first_k, ((score / scale, doc) for doc, score in scores.items())
+        )
+
+    @staticmethod
+    def _select_top_k(
+        scores: dict[int, float], norms: Sequence[float], first_k: int
+    ) -> list[tuple[float, int]]:
+        if first_k <= 0:
+            return []
+
+        min_heap = []
+        for doc, score in scores.items():
+            entry = (score / norms[doc], doc)
             if len(min_heap) < first_k:
-                heapq.heappush(min_heap, (doc_score, doc_id))
-            elif doc_score > min_heap[0][0]:
-                heapq.heappushpop(min_heap, (doc_score, doc_id))
+                heapq.heappush(min_heap, entry)
+            elif entry > min_heap[0]:
+                heapq.heappushpop(min_heap, entry)
 
         # get max similarity first
-        return sorted(min_heap, key=lambda tup: tup[0], reverse=True)
+        min_heap.sort(reverse=True)
+        return min_heap
+
+    def _top_k_numpy(
+        self,
+        query_weights: dict[str, float],
+        weighting: Callable[[int, int], float],
+        norms: Sequence[float],
+        first_k: int,
+    ) -> list[tuple[float, int]]:
+        # numpy is needed only by this engine
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        scores = np.zeros(len(norms))
+        touched = np.zeros(len(norms), dtype=bool)
+        for term, query_w in query_weights.items():
+            postings = self.postings(term)
+            if len(postings) == 0:
+                continue
+
+            docs = np.frombuffer(postings.docs, dtype=np.uint32)
+            counts = np.frombuffer(postings.counts, dtype=np.uint32)
+            # weighting is evaluated once per distinct count and gathered, which
+            # keeps the weights bit-identical to the python engine
+            distinct_counts, count_idxs = np.unique(counts, return_inverse=True)
+            term_doc_freq = self.doc_freq(term)
+            distinct_weights = np.array(
+                [weighting(int(count), term_doc_freq) for count in distinct_counts],
+                dtype=np.float64,
+            )
+            scores[docs] += query_w * distinct_weights[count_idxs]
+            touched[docs] = True
+
+        cand_docs = np.flatnonzero(touched)
+        cand_scores = (
+            scores[cand_docs] / np.frombuffer(norms, dtype=np.float64)[cand_docs]
+        )
+        if len(cand_docs) > first_k > 0:
+            kth = len(cand_docs) - first_k
+            threshold = cand_scores[np.argpartition(cand_scores, kth)[kth]]
+            # keep all ties with the threshold so that ordinals decide
+            selected = cand_scores >= threshold
+            cand_docs, cand_scores = cand_docs[selected], cand_scores[selected]
+
+        order = np.lexsort((cand_docs, cand_scores))[::-1][:first_k]
+        return list(zip(cand_scores[order].tolist(), cand_docs[order].tolist()))
+
+    def _doc_id(self, doc: int) -> str:
+        return self._doc_ids[doc]
 
     def _normalize_query(
         self, query: dict[str, int], weighting: Callable[[int, int], float]
     ) -> dict[str, float]:
         q_norm = 0
         for term, count in query.items():
-            q_norm += weighting(count, self._doc_freq.get(term, 0)) ** 2
+            q_norm += weighting(count, self.doc_freq(term)) ** 2
 
         q_norm = math.sqrt(q_norm)
         return {term: count / q_norm for term, count in query.items()}
 
-    def _compute_scores_w_norms(
+    def _compute_scores(
         self, query_weights: dict[str, float], weighting: Callable[[int, int], float]
-    ) -> tuple[dict[str, float], dict[str, float]]:
+    ) -> dict[int, float]:
         scores = {}
-        norms = {}
         for term, query_w in query_weights.items():
-            term_doc_freq = self._doc_freq.get(term, 0)
-            posting = self._terms.get(term, None)
-            while posting is not None:
-                doc_weight = weighting(posting.count, term_doc_freq)
-                scores[posting.doc_id] = (
-                    scores.get(posting.doc_id, 0) + query_w * doc_weight
-                )
-                norms[posting.doc_id] = norms.get(posting.doc_id, 0) + doc_weight**2
-
-                posting = posting.next
+            term_doc_freq = self.doc_freq(term)
+            for doc, count in self.postings(term):
+                doc_weight = weighting(count, term_doc_freq)
+                scores[doc] = scores.get(doc, 0) + query_w * doc_weight
 
-        return scores, norms
+        return scores
 
     def _valid_check(self) -> bool:
-        postings = 0
-        for _, posting in self._terms.items():
-            unique_ids = set()
-            while posting is not None:
-                if posting.doc_id in unique_ids:
-                    return False
+        postings_count = 0
+        for term in self.terms():
+            postings = self.postings(term)
+            if not all(map(operator.lt, postings.docs, postings.docs[1:])):
+                return False
 
-                unique_ids.add(posting.doc_id)
-                posting = posting.next
+            postings_count += len(postings)
 
-            postings += len(unique_ids)
-
-        print(f"All right here, postings: {postings}")
+        print(f"All right here, postings: {postings_count}")
         return True
 
     def __str__(self) -> str:
         if not self._valid_check():
             return "invalid"
         string = ""
-        for term, posting in self._terms.items():
+        for term in self.terms():
             string += term + ":"
-            while posting is not None:
-                string += f" {posting.doc_id}({posting.count}) ->"
-                posting = posting.next
+            for doc, count in self.postings(term):
+                string += f" {self._doc_id(doc)}({count}) ->"
 
             string += "\n"
 
         return string
+
+
+def _results_size(similars: tuple[tuple[float, str], ...]) -> int:
+    return sum(_RESULT_OVERHEAD + len(doc_id) for _, doc_id in similars)
+
+
+_batch_index: Optional[InvertedIndex] = None
+
+
+def _init_batch_worker(index: InvertedIndex) -> None:
+    global _batch_index  # pylint: disable=global-statement
+    _batch_index = index
+
+
+def _batch_worker(
+    args: tuple[list[dict[str, int]], str, int, str, Optional[int], Optional[float]]
+) -> list[list[tuple[float, str]]]:
+    queries, weighting, first_k, engine, postings_budget, time_budget = args
+    with log.stage("query"):
+        # pylint: disable=protected-access
+        similars = _batch_index._get_most_similar_batch(
+            queries, weighting, first_k, engine, None, postings_budget, time_budget
+        )
+    log.flush_metrics()
+    return similars
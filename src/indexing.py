@@ -0,0 +1,317 @@
+import functools
+import os
+import shutil
+import tempfile
+from multiprocessing.pool import Pool
+from typing import Callable, Iterator, NamedTuple, Optional, Sequence
+
+from src import lemmas, log, storage, terms, utils
+from src.document import Document, StreamedDocument
+from src.index import InvertedIndex
+
+IndexPaths = Callable[[list[str]], InvertedIndex]
+# indexes the same paths into several indexes
+MultiIndexPaths = Callable[[list[str]], list[InvertedIndex]]
+
+
+class Pipeline(NamedTuple):
+    """
+    Turns parsed documents into terms. Text in tags blacklisted by `create_doc`
+    is omitted and the rest is split by `tokenizer`.
+    """
+
+    tokenizer: terms.Tokenizer
+    create_doc: type[Document]
+
+
+def index_documents(
+    paths: list[str], pipelines: Sequence[Pipeline]
+) -> list[InvertedIndex]:
+    """
+    Indexes documents in `paths` by each of `pipelines`. Every document is
+    parsed only once.
+    """
+    indexes = [InvertedIndex() for _ in pipelines]
+    for path in paths:
+        for doc in utils.stream_document_iter(path, Document):
+            doc_id = str(doc.id)
+            for index, pipeline in zip(indexes, pipelines):
+                tag_blacklist = pipeline.create_doc.TAG_BLACKLIST
+                doc_terms = pipeline.tokenizer(
+                    StreamedDocument(doc.fields, tag_blacklist).str_all
+                )
+                if len(doc_terms) == 0:
+                    # documents with postings are counted by the index
+                    index.doc_count += 1
+                with log.stage("postings"):
+                    for term_str, count in doc_terms.items():
+                        index.add_posting(term_str, doc_id, count)
+                log.count("postings", len(doc_terms))
+
+    return indexes
+
+
+def _index_single(index_paths: IndexPaths, paths: list[str]) -> list[InvertedIndex]:
+    return [index_paths(paths)]
+
+
+def _index_batch(args: tuple[MultiIndexPaths, list[str], list[str]]) -> list[str]:
+    index_paths, paths, out_paths = args
+    indexes = index_paths(paths)
+    with log.stage("save"):
+        for index, out_path in zip(indexes, out_paths):
+            storage.save(index, out_path, with_norms=False)
+    lemmas.flush_tables()
+    log.flush_metrics()
+    return out_paths
+
+
+def _index_paths(args: tuple[IndexPaths, list[str]]) -> InvertedIndex:
+    index_paths, paths = args
+    index = index_paths(paths)
+    lemmas.flush_tables()
+    log.flush_metrics()
+    return index
+
+
+def _merge_pair(args: tuple[str, str, str]) -> str:
+    first_path, second_path, out_path = args
+    with log.stage("merge"):
+        storage.merge([first_path, second_path], out_path, with_norms=False)
+    os.remove(first_path)
+    os.remove(second_path)
+    log.flush_metrics()
+    return out_path
+
+
+def _finish_index(args: tuple[Optional[str], str, str]) -> None:
+    partial_path, out_path, compression = args
+    with log.stage("save"):
+        if partial_path is None:
+            storage.save(InvertedIndex(), out_path, compression=compression)
+        else:
+            # merging a single index computes its norms
+            storage.merge([partial_path], out_path, compression)
+    log.flush_metrics()
+
+
+def _build_partial_indexes(
+    pool: Pool,
+    docs_paths_iter: Iterator[str],
+    index_paths: MultiIndexPaths,
+    index_count: int,
+    work_dir: str,
+    batch_size: int,
+) -> list[Optional[str]]:
+    """
+    Indexes batches of files into `index_count` indexes and merges partial
+    indexes of each in a reduction tree. Returns path of the final partial
+    index of each, None if there are no documents.
+    """
+    batch_paths = list(
+        pool.imap(
+            _index_batch,
+            (
+                (
+                    index_paths,
+                    paths,
+                    [
+                        os.path.join(work_dir, f"{j}-0-{i}.idx")
+                        for j in range(index_count)
+                    ],
+                )
+                for i, paths in enumerate(utils.batch(docs_paths_iter, batch_size))
+            ),
+        )
+    )
+    log.timed(f"Indexed {len(batch_paths)} batches")
+
+    all_partial_paths = [list(paths) for paths in zip(*batch_paths)]
+    if len(all_partial_paths) == 0:
+        return [None] * index_count
+
+    level = 0
+    while len(all_partial_paths[0]) > 1:
+        level += 1
+        pairs = [
+            (
+                partial_paths[i],
+                partial_paths[i + 1],
+                os.path.join(work_dir, f"{j}-{level}-{i // 2}.idx"),
+            )
+            for j, partial_paths in enumerate(all_partial_paths)
+            for i in range(0, len(partial_paths) - 1, 2)
+        ]
+        merged_paths = iter(pool.map(_merge_pair, pairs, chunksize=1))
+        for j, partial_paths in enumerate(all_partial_paths):
+            odd_path = partial_paths[-1] if len(partial_paths) % 2 == 1 else None
+            partial_paths = [next(merged_paths) for _ in range(len(partial_paths) // 2)]
+            if odd_path is not None:
+                partial_paths.append(odd_path)
+            all_partial_paths[j] = partial_paths
+        log.timed(f"Merged level {level}, {len(all_partial_paths[0])} indexes left")
+
+    return [partial_paths[0] for partial_paths in all_partial_paths]
+
+
+def build_index(
+    docs_paths_iter: Iterator[str],
+    index_paths: IndexPaths,
+    batch_size: int = 20,
+    processes: Optional[int] = None,
+    tmp_dir: Optional[str] = None,
+) -> InvertedIndex:
+    """
+    Builds index of all documents in parallel.
+
+    Workers index batches of `batch_size` files with `index_paths` and save the
+    partial indexes to `tmp_dir`. Adjacent partial indexes are then merged
+    pairwise by the workers in a reduction tree, so that the parent process only
+    loads the final index. Document ordinals follow the order of
+    `docs_paths_iter`.
+    """
+    work_dir = tempfile.mkdtemp(prefix="index-", dir=tmp_dir)
+    try:
+        with Pool(processes) as pool:
+            (partial_path,) = _build_partial_indexes(
+                pool,
+                docs_paths_iter,
+                functools.partial(_index_single, index_paths),
+                1,
+                work_dir,
+                batch_size,
+            )
+
+        index = InvertedIndex()
+        if partial_path is not None:
+            with log.stage("merge"), storage.load(partial_path) as partial:
+                index.update_with(partial)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return index
+
+
+def build_index_file(
+    docs_paths_iter: Iterator[str],
+    index_paths: IndexPaths,
+    out_path: str,
+    batch_size: int = 20,
+    processes: Optional[int] = None,
+    tmp_dir: Optional[str] = None,
+    compression: str = "none",
+) -> None:
+    """
+    Builds index of all documents as `build_index` and saves it with norms and
+    postings compressed by `compression` to `out_path`. The final partial index
+    is merged into `out_path` by a worker, so it is never loaded by the parent
+    process.
+    """
+    work_dir = tempfile.mkdtemp(prefix="index-", dir=tmp_dir)
+    try:
+        with Pool(processes) as pool:
+            (partial_path,) = _build_partial_indexes(
+                pool,
+                docs_paths_iter,
+                functools.partial(_index_single, index_paths),
+                1,
+                work_dir,
+                batch_size,
+            )
+            pool.apply(_finish_index, ((partial_path, out_path, compression),))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_indexes(
+    docs_paths_iter: Iterator[str],
+    pipelines: Sequence[Pipeline],
+    out_paths: Sequence[str],
+    batch_size: int = 20,
+    processes: Optional[int] = None,
+    tmp_dir: Optional[str] = None,
+    compression: str = "none",
+) -> None:
+    """
+    Builds index of all documents for each of `pipelines` and saves it to the
+    corresponding path in `out_paths`, parsing the documents only once.
+
+    Works as `build_index`, except that workers feed each parsed batch to all
+    pipelines and the partial indexes of all pipelines are merged together.
+    """
+    work_dir = tempfile.mkdtemp(prefix="index-", dir=tmp_dir)
+    try:
+        with Pool(processes) as pool:
+            partial_paths = _build_partial_indexes(
+                pool,
+                docs_paths_iter,
+                functools.partial(index_documents, pipelines=pipelines),
+                len(pipelines),
+                work_dir,
+                batch_size,
+            )
+            pool.map(
+                _finish_index,
+                [
+                    (partial_path, out_path, compression)
+                    for partial_path, out_path in zip(partial_paths, out_paths)
+                ],
+                chunksize=1,
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_index_spimi(
+    docs_paths_iter: Iterator[str],
+    index_paths: IndexPaths,
+    out_path: str,
+    memory_budget: int,
+    batch_size: int = 20,
+    processes: Optional[int] = None,
+    tmp_dir: Optional[str] = None,
+    compression: str = "none",
+) -> None:
+    """
+    Builds index of all documents in a single pass and saves it to `out_path`
+    without ever holding the whole index in memory.
+
+    Workers index batches of `batch_size` files, which are accumulated into an
+    in-memory block. Whenever the block exceeds `memory_budget` bytes, it is
+    flushed to `tmp_dir` with sorted terms. Finally, all blocks are merged into
+    the persisted index with postings compressed by `compression`.
+    """
+    work_dir = tempfile.mkdtemp(prefix="spimi-", dir=tmp_dir)
+    block_paths = []
+
+    def flush(block: InvertedIndex) -> None:
+        block_path = os.path.join(work_dir, f"{len(block_paths)}.idx")
+        with log.stage("save"):
+            storage.save(block, block_path, with_norms=False)
+        block_paths.append(block_path)
+        log.timed(f"Flushed block {len(block_paths)}")
+
+    try:
+        block = InvertedIndex()
+        with Pool(processes) as pool:
+            for batch_index in pool.imap(
+                _index_paths,
+                (
+                    (index_paths, paths)
+                    for paths in utils.batch(docs_paths_iter, batch_size)
+                ),
+            ):
+                with log.stage("merge"):
+                    block.update_with(batch_index)
+                if block.estimated_size() >= memory_budget:
+                    flush(block)
+                    block = InvertedIndex()
+
+        if block.doc_count > 0 or len(block_paths) == 0:
+            flush(block)
+
+        with log.stage("merge"):
+            storage.merge(block_paths, out_path, compression)
+        log.timed(f"Merged {len(block_paths)} blocks into {out_path}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
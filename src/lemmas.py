@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import atexit
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from src import log
+from src.cache import LRUCache
+
+LEMMA_CACHE_BYTES = 32 * 2**20
+# new lemmas are persisted in batches of this many forms
+WRITE_BATCH = 1000
+# approximate size of a form, its lemma and their cache entry
+_ENTRY_OVERHEAD = 200
+
+
+def _entry_size(lemma: str) -> int:
+    return _ENTRY_OVERHEAD + 2 * len(lemma)
+
+
+class _LemmaTable:
+    """
+    State of a lemma table in a single process: cache of looked up lemmas,
+    lemmas not yet persisted, connection to the table and morphological
+    dictionary, both opened lazily. Threads of the process share the
+    connection and dictionary, lemmas missing in the cache are looked up by one
+    thread at a time.
+    """
+
+    def __init__(self, dict_path: str, table_path: str, cache_bytes: int) -> None:
+        self.cache = LRUCache(cache_bytes, _entry_size)
+        self._dict_path = dict_path
+        self._table_path = table_path
+        self._pending: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._morpho = None
+        self._analyses = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            table_dir = os.path.dirname(self._table_path)
+            if table_dir != "":
+                os.makedirs(table_dir, exist_ok=True)
+
+            # several processes write to the table concurrently
+            self._connection = sqlite3.connect(
+                self._table_path, timeout=60, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS lemmas"
+                " (form TEXT PRIMARY KEY, lemma TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _analyze(self, form: str) -> str:
+        if self._morpho is None:
+            # pylint: disable-next=import-outside-toplevel
+            from ufal.morphodita import Morpho, TaggedLemmas
+
+            self._morpho = Morpho.load(self._dict_path)
+            if self._morpho is None:
+                raise ValueError(
+                    f"Lemmatizer: Unable to load dictionary {self._dict_path}."
+                )
+            self._analyses = TaggedLemmas()
+
+        log.count("lemmas_analyzed")
+        self._morpho.analyze(form, self._morpho.GUESSER, self._analyses)
+        if len(self._analyses) == 0:
+            return form
+        return self._morpho.rawLemma(self._analyses[0].lemma)
+
+    def lemma(self, form: str) -> str:
+        lemma = self.cache.get(form)
+        if lemma is not None:
+            return lemma
+
+        with self._lock:
+            lemma = self._pending.get(form, None)
+            if lemma is None:
+                row = (
+                    self._connect()
+                    .execute("SELECT lemma FROM lemmas WHERE form = ?", (form,))
+                    .fetchone()
+                )
+                if row is not None:
+                    lemma = row[0]
+                else:
+                    lemma = self._analyze(form)
+                    self._pending[form] = lemma
+                    if len(self._pending) >= WRITE_BATCH:
+                        self._flush()
+
+        self.cache.put(form, lemma)
+        return lemma
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if len(self._pending) == 0:
+            return
+
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO lemmas VALUES (?, ?)", self._pending.items()
+            )
+        self._pending.clear()
+
+
+_tables: dict[tuple[str, str], _LemmaTable] = {}
+_tables_lock = threading.Lock()
+_owner_pid: Optional[int] = None
+
+
+def _table(dict_path: str, table_path: str, cache_bytes: int) -> _LemmaTable:
+    global _owner_pid  # pylint: disable=global-statement
+    key = (dict_path, table_path)
+    with _tables_lock:
+        if _owner_pid != os.getpid():
+            # connections and pending lemmas of the parent are not inherited
+            _owner_pid = os.getpid()
+            _tables.clear()
+
+        table = _tables.get(key, None)
+        if table is None:
+            table = _LemmaTable(dict_path, table_path, cache_bytes)
+            _tables[key] = table
+        return table
+
+
+def flush_tables() -> None:
+    """
+    Persists lemmas found by this process. Worker processes should call it once
+    their task is done, the main process does so on exit.
+    """
+    if _owner_pid != os.getpid():
+        return
+
+    for table in _tables.values():
+        table.flush()
+
+
+atexit.register(flush_tables)
+
+
+class Lemmatizer:
+    """
+    Maps surface forms to lemmas of morphodita dictionary `dict_path`, to be
+    used as `term_map` of a tokenizer.
+
+    Each form is mapped to the lemma of its first analysis regardless of
+    context, so that the mapping can be memoized. Found lemmas are persisted to
+    a table at `table_path` shared by all processes and runs using the same
+    dictionary, and each process keeps recently used lemmas in a cache bounded
+    by `cache_bytes`. Only forms never seen before are analyzed.
+    """
+
+    def __init__(
+        self, dict_path: str, table_path: str, cache_bytes: int = LEMMA_CACHE_BYTES
+    ) -> None:
+        self._dict_path = dict_path
+        self._table_path = table_path
+        self._cache_bytes = cache_bytes
+
+    def _table(self) -> _LemmaTable:
+        return _table(self._dict_path, self._table_path, self._cache_bytes)
+
+    def __call__(self, form: str) -> str:
+        return self._table().lemma(form)
@@ -1,14 +1,222 @@
+import contextlib
+import cProfile
+import glob
+import json
+import os
+import pstats
+import resource
+import shutil
+import sys
+import tempfile
 import time
+import uuid
+from typing import Any, Optional
 
 prev_timer = None
 
+# directory where processes store their metrics, None when disabled
+_metrics_dir: Optional[str] = None
+_profiled_stages: frozenset[str] = frozenset()
+# metrics of the current process, inherited state is reset in forked workers
+_owner_pid: Optional[int] = None
+_process_id = ""
+_stages: dict[str, list[float]] = {}
+_counters: dict[str, int] = {}
+_events: list[dict[str, Any]] = []
+_active_stages: set[str] = set()
+_profiles: dict[str, cProfile.Profile] = {}
+_profiling = False
+
 
 def timed(message: str) -> None:
     global prev_timer
 
     now = time.perf_counter()
-    if prev_timer is not None:
-        message += f" [took {now - prev_timer:.2f}s]"
+    took = None if prev_timer is None else now - prev_timer
+    if took is not None:
+        message += f" [took {took:.2f}s]"
 
     prev_timer = now
     print(message)
+    if _metrics_dir is not None:
+        _reset_if_forked()
+        _events.append({"message": message, "seconds": took})
+
+
+def enable_metrics(profiled_stages: tuple[str, ...] = ()) -> None:
+    """
+    Starts collecting stage timers and counters in this process and in worker
+    processes started afterwards. Stages in `profiled_stages` are also profiled
+    by cProfile.
+    """
+    global _metrics_dir, _profiled_stages  # pylint: disable=global-statement
+    _metrics_dir = tempfile.mkdtemp(prefix="metrics-")
+    _profiled_stages = frozenset(profiled_stages)
+    _reset_if_forked()
+
+
+def _reset_if_forked() -> None:
+    global _owner_pid, _process_id, _profiling  # pylint: disable=global-statement
+    if _owner_pid == os.getpid():
+        return
+
+    _owner_pid = os.getpid()
+    _process_id = f"{_owner_pid}-{uuid.uuid4().hex[:8]}"
+    _stages.clear()
+    _counters.clear()
+    _events.clear()
+    _active_stages.clear()
+    _profiles.clear()
+    _profiling = False
+
+
+class _Stage:
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._start = 0.0
+        self._nested = False
+        self._profile: Optional[cProfile.Profile] = None
+
+    def __enter__(self) -> None:
+        global _profiling  # pylint: disable=global-statement
+        _reset_if_forked()
+        # time of recursively entered stages is counted only once
+        self._nested = self._name in _active_stages
+        if self._nested:
+            return
+
+        _active_stages.add(self._name)
+        if self._name in _profiled_stages and not _profiling:
+            self._profile = _profiles.setdefault(self._name, cProfile.Profile())
+            _profiling = True
+            self._profile.enable()
+        self._start = time.perf_counter()
+
+    def __exit__(self, *_: Any) -> None:
+        global _profiling  # pylint: disable=global-statement
+        if self._nested:
+            return
+
+        took = time.perf_counter() - self._start
+        if self._profile is not None:
+            self._profile.disable()
+            _profiling = False
+
+        _active_stages.discard(self._name)
+        totals = _stages.setdefault(self._name, [0.0, 0])
+        totals[0] += took
+        totals[1] += 1
+
+
+def stage(name: str) -> contextlib.AbstractContextManager:
+    """
+    Returns context manager adding its duration to the timer of stage `name`.
+    Does nothing unless metrics are enabled.
+    """
+    if _metrics_dir is None:
+        return contextlib.nullcontext()
+
+    return _Stage(name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """
+    Adds `amount` to counter `name` if metrics are enabled.
+    """
+    if _metrics_dir is None:
+        return
+
+    _reset_if_forked()
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+def _peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / 2**20 if sys.platform == "darwin" else peak_rss / 2**10
+
+
+def flush_metrics() -> None:
+    """
+    Stores metrics of this process, so that `export_metrics` can aggregate
+    them. Worker processes should call it after each task, as they may be
+    terminated without notice.
+    """
+    if _metrics_dir is None:
+        return
+
+    _reset_if_forked()
+    snapshot = {
+        "pid": os.getpid(),
+        "stages": {
+            name: {"seconds": seconds, "calls": calls}
+            for name, (seconds, calls) in _stages.items()
+        },
+        "counters": dict(_counters),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    path = os.path.join(_metrics_dir, f"{_process_id}.json")
+    with open(path + ".tmp", mode="w", encoding="utf-8") as file:
+        json.dump(snapshot, file)
+    os.replace(path + ".tmp", path)
+
+    for name, profile in _profiles.items():
+        profile.dump_stats(os.path.join(_metrics_dir, f"{name}-{_process_id}.prof"))
+
+
+def export_metrics(path: str) -> None:
+    """
+    Writes metrics of this process and all workers as JSON to `path`. Stage
+    timers and counters are summed over processes, which are also listed
+    separately. Profiles of each profiled stage are merged into
+    `path.<stage>.prof`.
+    """
+    if _metrics_dir is None:
+        return
+
+    flush_metrics()
+    processes = []
+    for snapshot_path in glob.glob(os.path.join(_metrics_dir, "*.json")):
+        with open(snapshot_path, mode="r", encoding="utf-8") as file:
+            snapshot = json.load(file)
+        snapshot["main"] = snapshot_path.endswith(f"{_process_id}.json")
+        processes.append(snapshot)
+
+    stages: dict[str, dict[str, float]] = {}
+    counters: dict[str, int] = {}
+    for snapshot in processes:
+        for name, totals in snapshot["stages"].items():
+            stage_totals = stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage_totals["seconds"] += totals["seconds"]
+            stage_totals["calls"] += totals["calls"]
+        for name, amount in snapshot["counters"].items():
+            counters[name] = counters.get(name, 0) + amount
+
+    processes.sort(key=lambda snapshot: (not snapshot["main"], snapshot["pid"]))
+    with open(path, mode="w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "stages": stages,
+                "counters": counters,
+                "peak_rss_mb": max(snapshot["peak_rss_mb"] for snapshot in processes),
+                "events": _events,
+                "processes": processes,
+            },
+            file,
+            indent=1,
+        )
+
+    for name in _profiled_stages:
+        profile_paths = glob.glob(os.path.join(_metrics_dir, f"{name}-*.prof"))
+        if len(profile_paths) > 0:
+            pstats.Stats(*profile_paths).dump_stats(f"{path}.{name}.prof")
+
+
+def disable_metrics() -> None:
+    """
+    Stops collecting metrics and removes those stored by processes.
+    """
+    global _metrics_dir  # pylint: disable=global-statement
+    if _metrics_dir is not None:
+        shutil.rmtree(_metrics_dir, ignore_errors=True)
+        _metrics_dir = None
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import array
+import math
+from typing import Iterable, Iterator, Optional, Sequence
+
+from src.index import InvertedIndex, Postings
+
+
+class MaskedIndex(InvertedIndex):
+    """
+    Read-only view of `index` without `excluded_terms`, such as stop words.
+
+    Excluded terms are removed from the index and from queries, and document
+    norms are corrected by subtracting their weights, so results match those of
+    an index built without the terms up to floating point rounding. Documents
+    keep their ordinals and the collection its document count.
+    """
+
+    def __init__(self, index: InvertedIndex, excluded_terms: Iterable[str]) -> None:
+        super().__init__()
+        self._index = index
+        self._excluded = frozenset(excluded_terms)
+        self.doc_count = index.doc_count
+
+    @property
+    def excluded_terms(self) -> frozenset[str]:
+        return self._excluded
+
+    def add_posting(self, term: str, doc_id: str, count: int) -> None:
+        raise TypeError("MaskedIndex: Index is read-only.")
+
+    def update_with(self, other: InvertedIndex) -> None:
+        raise TypeError("MaskedIndex: Index is read-only.")
+
+    def terms(self) -> Iterator[str]:
+        return (term for term in self._index.terms() if term not in self._excluded)
+
+    def doc_ids(self) -> Sequence[str]:
+        return self._index.doc_ids()
+
+    def doc_freq(self, term: str) -> int:
+        return 0 if term in self._excluded else self._index.doc_freq(term)
+
+    def postings(self, term: str) -> Postings:
+        return Postings() if term in self._excluded else self._index.postings(term)
+
+    def doc_norms(self, weighting: str) -> Sequence[float]:
+        self._check_statistics()
+        norms = self._norms.get(weighting, None)
+        if norms is not None:
+            return norms
+
+        # only postings of excluded terms are traversed, the rest of the norms
+        # comes from the stored ones
+        weight = self.weighting(weighting)
+        squares = array.array(
+            "d", (norm**2 for norm in self._index.doc_norms(weighting))
+        )
+        for term in self._excluded:
+            term_doc_freq = self._index.doc_freq(term)
+            for doc, count in self._index.postings(term):
+                squares[doc] -= weight(count, term_doc_freq) ** 2
+
+        norms = array.array("d", (math.sqrt(max(square, 0.0)) for square in squares))
+        self._norms[weighting] = norms
+        return norms
+
+    def _mask_query(self, query: dict[str, int]) -> dict[str, int]:
+        return {
+            term: count for term, count in query.items() if term not in self._excluded
+        }
+
+    def get_most_similar(
+        self,
+        query: dict[str, int],
+        weighting: str,
+        first_k: int = 1000,
+        engine: str = "python",
+        postings_budget: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> list[tuple[float, str]]:
+        return super().get_most_similar(
+            self._mask_query(query),
+            weighting,
+            first_k,
+            engine,
+            postings_budget,
+            time_budget,
+        )
+
+    def get_most_similar_batch(
+        self,
+        queries: list[dict[str, int]],
+        weighting: str,
+        first_k: int = 1000,
+        engine: str = "python",
+        processes: Optional[int] = None,
+        postings_budget: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> list[list[tuple[float, str]]]:
+        return super().get_most_similar_batch(
+            [self._mask_query(query) for query in queries],
+            weighting,
+            first_k,
+            engine,
+            processes,
+            postings_budget,
+            time_budget,
+        )
+
+    def _doc_id(self, doc: int) -> str:
+        return self._index._doc_id(doc)  # pylint: disable=protected-access
+
+    def __str__(self) -> str:
+        return f"MaskedIndex({self._index}, {len(self._excluded)} excluded terms)"
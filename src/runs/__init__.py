@@ -0,0 +1,82 @@
+import functools
+from typing import Iterator, Optional
+
+from src import indexing, log, terms, utils
+from src.index import InvertedIndex
+from src.query import Query
+
+
+def per_documents(pipeline: indexing.Pipeline, paths: list[str]) -> InvertedIndex:
+    return indexing.index_documents(paths, [pipeline])[0]
+
+
+def index_paths(pipeline: indexing.Pipeline) -> indexing.IndexPaths:
+    """
+    Returns function indexing documents in given paths by `pipeline`, which can
+    be passed to worker processes.
+    """
+    return functools.partial(per_documents, pipeline)
+
+
+def build_index(
+    pipeline: indexing.Pipeline, docs_paths_iter: Iterator[str]
+) -> InvertedIndex:
+    log.timed("Indexing started")
+    index = indexing.build_index(docs_paths_iter, index_paths(pipeline))
+    index.compute_norms()
+    log.timed("Indexing complete")
+    return index
+
+
+def search(
+    tokenizer: terms.Tokenizer,
+    weighting: str,
+    index: InvertedIndex,
+    queries_path: str,
+    output_file: str,
+    run_id: str,
+    engine: str = "python",
+    processes: Optional[int] = None,
+    postings_budget: Optional[int] = None,
+    time_budget: Optional[float] = None,
+) -> None:
+    """
+    Writes results of topics in `queries_path` tokenized by `tokenizer` and
+    scored with `weighting` to `output_file`.
+    """
+    queries = list(utils.get_query_iter(queries_path, Query))
+    queries_terms = [tokenizer(query.title) for query in queries]
+    all_similars = index.get_most_similar_batch(
+        queries_terms,
+        weighting,
+        engine=engine,
+        processes=processes,
+        postings_budget=postings_budget,
+        time_budget=time_budget,
+    )
+    print(f"Got similarities for {len(queries)} queries")
+
+    if engine == "impact":
+        exact_similars = index.get_most_similar_batch(
+            queries_terms, weighting, processes=processes
+        )
+        recall = utils.ranking_recall(exact_similars, all_similars)
+        print(f"Impact ordered search recovered {recall:.2%} of exact rankings")
+
+    with open(output_file, mode="w", encoding="utf-8") as output:
+        for query, similars in zip(queries, all_similars):
+            utils.write_qrels(output, similars, query.id, run_id)
+
+    log.timed("Done")
+
+
+def experiment(
+    pipeline: indexing.Pipeline,
+    weighting: str,
+    docs_paths_iter: Iterator[str],
+    queries_path: str,
+    output_file: str,
+    run_id: str,
+) -> None:
+    index = build_index(pipeline, docs_paths_iter)
+    search(pipeline.tokenizer, weighting, index, queries_path, output_file, run_id)
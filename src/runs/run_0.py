@@ -4,61 +4,17 @@ from multiprocessing.pool import Pool
 from queue import Empty as QueueEmpty
 from typing import Iterator
 
-from src import log, terms, utils
+from src import indexing, log, runs, terms, utils
 from src.document import Document
 from src.index import InvertedIndex
-from src.query import Query
 
 SEPS = terms.WHSP_SEPS + terms.PUNCT_SEPS
+TOKENIZER = terms.Tokenizer(SEPS)
+WEIGHTING = "natural"
 
 
-def per_document(path: str) -> InvertedIndex:
-    index = InvertedIndex()
-    for doc in utils.get_document_iter(path, Document):
-        doc_terms = terms.extract(doc.str_all, SEPS)
-        for term_str, count in doc_terms.items():
-            index.add_posting(term_str, str(doc.id), count)
-
-    return index
-
-
-def experiment(
-    docs_paths_iter: Iterator[str], queries_path: str, output_file: str, run_id: str
-) -> None:
-    index = InvertedIndex()
-
-    log.timed("Indexing started")
-    with Pool() as pool:
-        for i, docs_index in enumerate(
-            pool.imap(per_document, docs_paths_iter, chunksize=20)
-        ):
-            print(f"\rRecieved index {i + 1}", end="")
-            index.update_with(docs_index)
-
-    print()
-
-    log.timed("Indexing complete")
-
-    with open(output_file, mode="w", encoding="utf-8") as output:
-        for i, query in enumerate(utils.get_query_iter(queries_path, Query)):
-            query_terms = terms.extract(query.title, SEPS)
-            similars = index.get_most_similar(query_terms, terms.natural_weight)
-            utils.write_qrels(output, similars, query.id, run_id)
-            print(f"\rGot similarities for query {i + 1}", end="")
-
-    print()
-    log.timed("Done")
-
-
-def per_documents(paths: list[str]) -> InvertedIndex:
-    index = InvertedIndex()
-    for path in paths:
-        for doc in utils.get_document_iter(path, Document):
-            doc_terms = terms.extract(doc.str_all, SEPS)
-            for term_str, count in doc_terms.items():
-                index.add_posting(term_str, str(doc.id), count)
-
-    return index
+def get_pipeline() -> indexing.Pipeline:
+    return indexing.Pipeline(TOKENIZER, Document)
 
 
 def experiment_with_threads(
@@ -70,7 +26,7 @@ def experiment_with_threads(
 
     with futures.ThreadPoolExecutor() as executer:
         future_indexes = [
-            executer.submit(per_documents, paths)
+            executer.submit(runs.per_documents, get_pipeline(), paths)
             for paths in utils.batch(docs_paths_iter, 20)
         ]
         for i, future_index in enumerate(futures.as_completed(future_indexes)):
@@ -82,24 +38,18 @@ def experiment_with_threads(
 
     log.timed("Indexing complete")
 
-    with open(output_file, mode="w", encoding="utf-8") as output:
-        for i, query in enumerate(utils.get_query_iter(queries_path, Query)):
-            query_terms = terms.extract(query.title, SEPS)
-            similars = index.get_most_similar(query_terms, terms.natural_weight)
-            utils.write_qrels(output, similars, query.id, run_id)
-            print(f"\rGot similarities for query {i + 1}", end="")
-
-    print()
-    log.timed("Done")
+    runs.search(TOKENIZER, WEIGHTING, index, queries_path, output_file, run_id)
 
 
 def per_documents_with_queue(paths: list[str], queue: Queue) -> None:
     index = InvertedIndex()
     for path in paths:
-        for doc in utils.get_document_iter(path, Document):
-            doc_terms = terms.extract(doc.str_all, SEPS)
-            for term_str, count in doc_terms.items():
-                index.add_posting(term_str, str(doc.id), count)
+        for doc in utils.stream_document_iter(path, Document):
+            doc_terms = TOKENIZER(doc.str_all)
+            with log.stage("postings"):
+                for term_str, count in doc_terms.items():
+                    index.add_posting(term_str, str(doc.id), count)
+            log.count("postings", len(doc_terms))
 
     queue.put(index, True)
     print("Inverted index put on queue")
@@ -142,12 +92,4 @@ def experiment_with_syncmanager(
 
     log.timed("Indexing complete")
 
-    with open(output_file, mode="w", encoding="utf-8") as output:
-        for i, query in enumerate(utils.get_query_iter(queries_path, Query)):
-            query_terms = terms.extract(query.title, SEPS)
-            similars = index.get_most_similar(query_terms, terms.natural_weight)
-            utils.write_qrels(output, similars, query.id, run_id)
-            print(f"\rGot similarities for query {i + 1}", end="")
-
-    print()
-    log.timed("Done")
+    runs.search(TOKENIZER, WEIGHTING, index, queries_path, output_file, run_id)
@@ -0,0 +1,35 @@
+import functools
+import os
+
+from src import indexing, lemmas, terms
+from src.document import Document
+from src.runs import run_0_stopwords
+
+WEIGHTING = run_0_stopwords.WEIGHTING
+DICTIONARIES = {
+    "cs": "morphodita/czech-morfflex-161115.dict",
+    "en": "morphodita/english-morphium-wsj-140407.dict",
+}
+LEMMA_TABLE_DIR = "lemmas"
+
+
+@functools.cache
+def get_tokenizer(lan: str) -> terms.Tokenizer:
+    """
+    Returns tokenizer of run-0-stopwords which maps words to their lemmas.
+    """
+    dict_path = DICTIONARIES[lan]
+    dict_name = os.path.splitext(os.path.basename(dict_path))[0]
+    lemmatizer = lemmas.Lemmatizer(
+        dict_path, os.path.join(LEMMA_TABLE_DIR, f"{dict_name}.sqlite")
+    )
+    return terms.Tokenizer(
+        run_0_stopwords.SEPS,
+        run_0_stopwords.get_tokenizer(lan).stop_words,
+        lemmatizer,
+        memoize_map=False,
+    )
+
+
+def get_pipeline(lan: str) -> indexing.Pipeline:
+    return indexing.Pipeline(get_tokenizer(lan), Document)
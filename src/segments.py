@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+import array
+import bisect
+import contextlib
+import json
+import os
+import threading
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+from src import indexing, log, storage
+from src.index import POSTING_TYPECODE, ImpactPostings, InvertedIndex, Postings
+
+MANIFEST = "manifest.json"
+# norms of these weightings do not depend on collection statistics, so those
+# stored in segments stay valid as the collection changes
+_LOCAL_WEIGHTINGS = ("natural",)
+
+
+class _SegmentsView(InvertedIndex):
+    """
+    Read-only index of segments open at one moment, with ordinals of their
+    first documents and ordinals of deleted documents. Replaced as a whole
+    whenever segments change, so that every query runs against a consistent
+    collection and its statistics.
+    """
+
+    def __init__(
+        self,
+        names: tuple[str, ...],
+        segments: tuple[storage.MappedIndex, ...],
+        bases: tuple[int, ...],
+        deleted_docs: frozenset[int],
+        doc_ids: Optional[list[str]] = None,
+    ) -> None:
+        super().__init__()
+        self.names = names
+        self.segments = segments
+        self.bases = bases
+        self.deleted_docs = deleted_docs
+        self._all_doc_ids = doc_ids
+        self._cached_doc_freqs: dict[str, int] = {}
+        # number of calls of `SegmentedIndex` reading the view
+        self.readers = 0
+        self._doc_count = sum(segment.doc_count for segment in segments) - len(
+            deleted_docs
+        )
+
+    def terms(self) -> Iterator[str]:
+        return iter(
+            dict.fromkeys(term for segment in self.segments for term in segment.terms())
+        )
+
+    def doc_ids(self) -> Sequence[str]:
+        if self._all_doc_ids is None:
+            self._all_doc_ids = [
+                doc_id for segment in self.segments for doc_id in segment.doc_ids()
+            ]
+
+        return self._all_doc_ids
+
+    def doc_freq(self, term: str) -> int:
+        doc_freq = self._cached_doc_freqs.get(term, None)
+        if doc_freq is None:
+            if len(self.deleted_docs) > 0:
+                doc_freq = len(self.postings(term))
+            else:
+                doc_freq = sum(segment.doc_freq(term) for segment in self.segments)
+            self._cached_doc_freqs[term] = doc_freq
+
+        return doc_freq
+
+    def postings(self, term: str) -> Postings:
+        if len(self.segments) == 1 and len(self.deleted_docs) == 0:
+            return self.segments[0].postings(term)
+
+        docs = array.array(POSTING_TYPECODE)
+        counts = array.array(POSTING_TYPECODE)
+        for base, segment in zip(self.bases, self.segments):
+            segment_postings = segment.postings(term)
+            if len(self.deleted_docs) == 0:
+                docs.extend(map(base.__add__, segment_postings.docs))
+                counts.extend(segment_postings.counts)
+                continue
+
+            for doc, count in segment_postings:
+                if base + doc not in self.deleted_docs:
+                    docs.append(base + doc)
+                    counts.append(count)
+
+        return Postings(docs, counts)
+
+    def doc_norms(self, weighting: str) -> Sequence[float]:
+        norms = self._norms.get(weighting, None)
+        if norms is not None:
+            return norms
+
+        if weighting not in _LOCAL_WEIGHTINGS:
+            return super().doc_norms(weighting)
+
+        norms = array.array("d")
+        for segment in self.segments:
+            norms.extend(segment.doc_norms(weighting))
+
+        self._norms[weighting] = norms
+        return norms
+
+    def _doc_id(self, doc: int) -> str:
+        return self.doc_ids()[doc]
+
+
+class SegmentedIndex(InvertedIndex):
+    """
+    Read-only view of an index persisted as a directory of immutable segments.
+
+    New documents are indexed into a new segment and deleted documents are only
+    marked by tombstones, so updates cost time proportional to the change.
+    Document frequencies and counts are those of live documents in all
+    segments. Segments are merged in the background once there are more than
+    `max_segments` of them, which also drops the deleted documents.
+    """
+
+    def __init__(self, directory: str, max_segments: int = 8) -> None:
+        super().__init__()
+        self._directory = directory
+        self._max_segments = max_segments
+        self._lock = threading.Lock()
+        self._merge_thread: Optional[threading.Thread] = None
+        self._segment_ordinals: dict[str, dict[str, list[int]]] = {}
+        self._view = _SegmentsView((), (), (0,), frozenset())
+        self._read_views: set[_SegmentsView] = set()
+        # merged segments with their paths, closed and removed once no view
+        # containing them is read
+        self._retired: list[tuple[storage.MappedIndex, str]] = []
+
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, mode="r", encoding="utf-8") as file:
+                self._manifest = json.load(file)
+        else:
+            self._manifest = {"next_segment": 0, "segments": []}
+            self._write_manifest()
+
+        self._publish(self._open_segments(self._manifest["segments"]))
+
+    @property
+    def doc_count(self) -> int:
+        return self._view.doc_count
+
+    def _write_manifest(self) -> None:
+        manifest_path = os.path.join(self._directory, MANIFEST)
+        with open(manifest_path + ".tmp", mode="w", encoding="utf-8") as file:
+            json.dump(self._manifest, file, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _open_segments(self, entries: list[dict[str, Any]]) -> _SegmentsView:
+        """
+        Returns view of segments of manifest `entries`, reusing those already
+        open.
+        """
+        opened = dict(zip(self._view.names, self._view.segments))
+        segments = []
+        bases = [0]
+        deleted_docs = set()
+        for entry in entries:
+            segment = opened.get(entry["name"], None)
+            if segment is None:
+                segment = storage.load(os.path.join(self._directory, entry["name"]))
+            segments.append(segment)
+            deleted_docs.update(bases[-1] + doc for doc in entry["deleted"])
+            bases.append(bases[-1] + len(segment.doc_ids()))
+
+        segments = tuple(segments)
+        # document ordinals change only when segments are added or merged
+        doc_ids = (
+            self._view._all_doc_ids  # pylint: disable=protected-access
+            if segments == self._view.segments
+            else None
+        )
+        return _SegmentsView(
+            tuple(entry["name"] for entry in entries),
+            segments,
+            tuple(bases),
+            frozenset(deleted_docs),
+            doc_ids,
+        )
+
+    def _publish(self, view: _SegmentsView) -> None:
+        self._view = view
+        self._drop_statistics()
+
+    @contextlib.contextmanager
+    def _reading(self) -> Iterator[_SegmentsView]:
+        """
+        Yields the current view, whose segments stay open until the context
+        exits, even if they are merged meanwhile.
+        """
+        with self._lock:
+            view = self._view
+            view.readers += 1
+            self._read_views.add(view)
+        try:
+            yield view
+        finally:
+            with self._lock:
+                view.readers -= 1
+                if view.readers == 0:
+                    self._read_views.discard(view)
+                    self._close_retired()
+
+    def _close_retired(self) -> None:
+        # called with the lock held
+        read_segments = {
+            id(segment) for view in self._read_views for segment in view.segments
+        }
+        retired = []
+        for segment, path in self._retired:
+            if id(segment) in read_segments:
+                retired.append((segment, path))
+            else:
+                segment.close()
+                os.remove(path)
+        self._retired = retired
+
+    def _mark_deleted(
+        self, entry: dict[str, Any], segment: storage.MappedIndex, doc_ids: list[str]
+    ) -> list[int]:
+        """
+        Marks live documents of the segment of manifest `entry` with given IDs
+        as deleted. Returns their ordinals within the segment.
+        """
+        ordinals = self._segment_ordinals.get(entry["name"], None)
+        if ordinals is None:
+            ordinals = {}
+            for doc, doc_id in enumerate(segment.doc_ids()):
+                ordinals.setdefault(doc_id, []).append(doc)
+            self._segment_ordinals[entry["name"]] = ordinals
+
+        deleted = set(entry["deleted"])
+        marked = []
+        for doc_id in doc_ids:
+            for doc in ordinals.get(doc_id, ()):
+                if doc not in deleted:
+                    deleted.add(doc)
+                    marked.append(doc)
+
+        return marked
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {"directory": self._directory, "max_segments": self._max_segments}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__init__(state["directory"], state["max_segments"])
+
+    def add_posting(self, term: str, doc_id: str, count: int) -> None:
+        raise TypeError("SegmentedIndex: Use add_documents to index documents.")
+
+    def update_with(self, other: InvertedIndex) -> None:
+        raise TypeError("SegmentedIndex: Use add_documents to index documents.")
+
+    def add_documents(
+        self,
+        docs_paths_iter: Iterator[str],
+        index_paths: indexing.IndexPaths,
+        batch_size: int = 20,
+        processes: Optional[int] = None,
+        compression: str = "none",
+    ) -> None:
+        """
+        Indexes documents in a new segment. Documents with IDs already in the
+        index should be deleted first.
+        """
+        with self._lock:
+            name = f"segment-{self._manifest['next_segment']}.idx"
+            self._manifest["next_segment"] += 1
+
+        indexing.build_index_file(
+            docs_paths_iter,
+            index_paths,
+            os.path.join(self._directory, name),
+            batch_size,
+            processes,
+            compression=compression,
+        )
+        with self._lock:
+            entry = {"name": name, "deleted": []}
+            self._manifest["segments"].append(entry)
+            self._write_manifest()
+            view = self._open_segments(self._manifest["segments"])
+            self._publish(view)
+        log.timed(f"Added segment {name} with {view.segments[-1].doc_count} documents")
+
+        if self.segment_count() > self._max_segments:
+            self.merge_segments(compression)
+
+    def delete_documents(self, doc_ids: Iterable[str]) -> None:
+        """
+        Marks documents with given IDs as deleted in all current segments.
+        """
+        doc_ids = list(doc_ids)
+        if len(doc_ids) == 0:
+            return
+
+        with self._lock:
+            for entry, segment in zip(self._manifest["segments"], self._view.segments):
+                entry["deleted"].extend(self._mark_deleted(entry, segment, doc_ids))
+            self._write_manifest()
+            self._publish(self._open_segments(self._manifest["segments"]))
+
+    def merge_segments(self, compression: Optional[str] = None) -> threading.Thread:
+        """
+        Starts merging all current segments into one in a background thread,
+        unless a merge is already running. The index serves queries from the
+        old segments until the merge finishes. Returns the merging thread.
+
+        The merged segment keeps compression of the newest merged segment,
+        unless `compression` is given.
+        """
+        with self._lock:
+            if self._merge_thread is None or not self._merge_thread.is_alive():
+                self._merge_thread = threading.Thread(
+                    target=self._merge, args=(compression,), daemon=True
+                )
+                self._merge_thread.start()
+
+            return self._merge_thread
+
+    def wait_for_merge(self) -> None:
+        merge_thread = self._merge_thread
+        if merge_thread is not None:
+            merge_thread.join()
+
+    def _merge(self, compression: Optional[str]) -> None:
+        with self._lock:
+            merged_entries = [
+                {"name": entry["name"], "deleted": list(entry["deleted"])}
+                for entry in self._manifest["segments"]
+            ]
+            if len(merged_entries) < 2:
+                return
+
+            if compression is None:
+                compression = self._view.segments[-1].compression
+
+            name = f"segment-{self._manifest['next_segment']}.idx"
+            self._manifest["next_segment"] += 1
+
+        storage.merge(
+            [os.path.join(self._directory, entry["name"]) for entry in merged_entries],
+            os.path.join(self._directory, name),
+            compression,
+            [set(entry["deleted"]) for entry in merged_entries],
+        )
+
+        with self._lock:
+            segments = self._manifest["segments"]
+            # documents deleted while merging stay marked in the merged segment
+            deleted = []
+            base = 0
+            for i, merged_entry in enumerate(merged_entries):
+                dropped = sorted(merged_entry["deleted"])
+                for doc in segments[i]["deleted"][len(dropped) :]:
+                    deleted.append(base + doc - bisect.bisect_left(dropped, doc))
+                base += len(self._view.segments[i].doc_ids()) - len(dropped)
+
+            self._manifest["segments"] = [
+                {"name": name, "deleted": deleted}
+            ] + segments[len(merged_entries) :]
+            self._write_manifest()
+            merged_segments = self._view.segments[: len(merged_entries)]
+            # queries keep using the old segments until this assignment
+            self._publish(self._open_segments(self._manifest["segments"]))
+            for entry in merged_entries:
+                self._segment_ordinals.pop(entry["name"], None)
+            self._retired.extend(
+                (segment, os.path.join(self._directory, entry["name"]))
+                for segment, entry in zip(merged_segments, merged_entries)
+            )
+            self._close_retired()
+
+        log.timed(f"Merged {len(merged_entries)} segments into {name}")
+
+    def segment_count(self) -> int:
+        return len(self._view.segments)
+
+    def terms(self) -> Iterator[str]:
+        with self._reading() as view:
+            return view.terms()
+
+    def doc_ids(self) -> Sequence[str]:
+        with self._reading() as view:
+            return view.doc_ids()
+
+    def doc_freq(self, term: str) -> int:
+        with self._reading() as view:
+            return view.doc_freq(term)
+
+    def postings(self, term: str) -> Postings:
+        with self._reading() as view:
+            return view.postings(term)
+
+    def doc_norms(self, weighting: str) -> Sequence[float]:
+        with self._reading() as view:
+            return view.doc_norms(weighting)
+
+    def _term_bounds(self, weighting: str) -> dict[str, float]:
+        with self._reading() as view:
+            return view._term_bounds(weighting)  # pylint: disable=protected-access
+
+    def impact_postings(self, term: str, weighting: str) -> ImpactPostings:
+        with self._reading() as view:
+            return view.impact_postings(term, weighting)
+
+    def _impact_scale(self, weighting: str) -> float:
+        with self._reading() as view:
+            return view._impact_scale(weighting)  # pylint: disable=protected-access
+
+    # whole queries are evaluated by the view of segments open when they start
+
+    def _get_most_similar(
+        self,
+        query: dict[str, int],
+        weighting: str,
+        first_k: int,
+        engine: str,
+        postings_budget: Optional[int],
+        time_budget: Optional[float],
+    ) -> list[tuple[float, str]]:
+        with self._reading() as view:
+            # pylint: disable-next=protected-access
+            return view._get_most_similar(
+                query, weighting, first_k, engine, postings_budget, time_budget
+            )
+
+    def _get_most_similar_batch(
+        self,
+        queries: list[dict[str, int]],
+        weighting: str,
+        first_k: int,
+        engine: str,
+        processes: Optional[int],
+        postings_budget: Optional[int],
+        time_budget: Optional[float],
+    ) -> list[list[tuple[float, str]]]:
+        with self._reading() as view:
+            # pylint: disable-next=protected-access
+            return view._get_most_similar_batch(
+                queries,
+                weighting,
+                first_k,
+                engine,
+                processes,
+                postings_budget,
+                time_budget,
+            )
+
+    def _doc_id(self, doc: int) -> str:
+        with self._reading() as view:
+            return view._doc_id(doc)  # pylint: disable=protected-access
+
+    def __str__(self) -> str:
+        return f"SegmentedIndex({self._directory}, {self.segment_count()} segments)"
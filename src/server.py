@@ -0,0 +1,218 @@
+import collections
+import io
+import json
+import math
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from src import utils
+from src.index import InvertedIndex
+
+# number of latest requests latency percentiles are computed from
+LATENCY_WINDOW = 10000
+
+
+class LatencyStats:
+    """
+    Thread-safe record of latencies of the last `LATENCY_WINDOW` queries.
+    """
+
+    def __init__(self) -> None:
+        self._latencies: collections.deque[float] = collections.deque(
+            maxlen=LATENCY_WINDOW
+        )
+        self._query_count = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._query_count += 1
+
+    def summary(self) -> dict[str, Any]:
+        """
+        Returns number of recorded queries and latency percentiles in
+        milliseconds.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            query_count = self._query_count
+
+        return {
+            "queries": query_count,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        }
+
+
+class QueryService:
+    """
+    Answers queries over a loaded index and keeps latencies of recent queries.
+    """
+
+    def __init__(
+        self,
+        index: InvertedIndex,
+        tokenizer: Callable[[str], dict[str, int]],
+        weighting: str,
+        run_id: str,
+        engine: str = "python",
+        first_k: int = 1000,
+    ) -> None:
+        self.index = index
+        self.tokenizer = tokenizer
+        self.weighting = weighting
+        self.run_id = run_id
+        self.engine = engine
+        self.first_k = first_k
+        self.latencies = LatencyStats()
+
+    def search(self, text: str, query_id: str, first_k: Optional[int] = None) -> str:
+        """
+        Returns ranking of documents most similar to `text` in TREC format.
+        """
+        start = time.perf_counter()
+        similars = self.index.get_most_similar(
+            self.tokenizer(text),
+            self.weighting,
+            self.first_k if first_k is None else first_k,
+            self.engine,
+        )
+        output = io.StringIO()
+        utils.write_qrels(output, similars, query_id, self.run_id)
+
+        self.latencies.record(time.perf_counter() - start)
+        return output.getvalue()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns number of answered queries, latency percentiles in milliseconds
+        over the last `LATENCY_WINDOW` queries and result cache counters.
+        """
+        return {
+            **self.latencies.summary(),
+            "cache_hits": self.index.result_cache.hits,
+            "cache_misses": self.index.result_cache.misses,
+        }
+
+
+def _percentile(sorted_values: list[float], percent: float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def parse_first_k(params: dict[str, str]) -> Optional[int]:
+    """
+    Returns number of documents requested by parameter `k`, if any. Raises
+    `ValueError` unless it is a positive integer.
+    """
+    if "k" not in params:
+        return None
+
+    try:
+        first_k = int(params["k"])
+    except ValueError:
+        first_k = 0
+    if first_k < 1:
+        raise ValueError("Parameter k must be a positive integer.")
+    return first_k
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    """
+    Serves `GET /search?query=...&id=...&k=...` with TREC formatted ranking and
+    `GET /stats` with JSON statistics.
+    """
+
+    server: Any
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        service: QueryService = self.server.service
+
+        if url.path == "/stats":
+            self._respond(200, "application/json", json.dumps(service.stats()))
+        elif url.path == "/search" and "query" in params:
+            try:
+                first_k = parse_first_k(params)
+            except ValueError as error:
+                self._respond(400, "text/plain", f"{error}\n")
+                return
+
+            try:
+                ranking = service.search(
+                    params["query"], params.get("id", "0"), first_k
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                self._respond(500, "text/plain", f"{error}\n")
+                return
+
+            self._respond(200, "text/plain", ranking)
+        else:
+            self._respond(404, "text/plain", "Use /search?query=... or /stats.\n")
+
+    def _respond(self, status: int, content_type: str, body: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # clients of Unix sockets have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=W0622
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: QueryService) -> None:
+        super().__init__(address, _QueryHandler)
+        self.service = service
+
+
+class UnixQueryServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: QueryService) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _QueryHandler)
+        self.service = service
+
+    def server_close(self) -> None:
+        super().server_close()
+        os.remove(self.server_address)
+
+
+def serve(address: str, service: QueryService) -> None:
+    """
+    Serves queries until interrupted, each request in its own thread. `address`
+    is either `host:port` or `unix:path` of a Unix socket.
+    """
+    if address.startswith("unix:"):
+        server = UnixQueryServer(address[len("unix:") :], service)
+    else:
+        host, _, port = address.rpartition(":")
+        server = QueryServer((host, int(port)), service)
+
+    with server:
+        print(f"Serving queries on {address}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,81 @@
+import html
+import re
+from typing import Iterator, TextIO
+
+DOC_TAG = "DOC"
+# should be increased whenever parsing changes, invalidates cached documents
+PARSER_VERSION = 1
+
+_DOC_START = re.compile(r"<DOC(?:\s[^>]*)?>")
+_DOC_END = "</DOC>"
+_TOKEN = re.compile(
+    r"<!--.*?-->|<!\[CDATA\[(?P<cdata>.*?)\]\]>|<[!?][^>]*>"
+    r"|<(?P<close>/?)(?P<name>[A-Za-z][\w.:-]*)[^>]*?(?P<empty>/?)>",
+    re.DOTALL,
+)
+
+
+def iter_doc_sources(file: TextIO, chunk_size: int = 1 << 16) -> Iterator[str]:
+    """
+    Returns iterator over raw contents of `DOC` elements in `file`, reading it
+    in chunks of `chunk_size` characters.
+    """
+    pending = ""
+    while True:
+        chunk = file.read(chunk_size)
+        pending += chunk
+        pos = 0
+        while True:
+            start = _DOC_START.search(pending, pos)
+            if start is None:
+                # keep a possibly incomplete start tag for the next chunk
+                partial = pending.rfind("<", pos)
+                pos = len(pending) if partial == -1 else partial
+                break
+
+            end = pending.find(_DOC_END, start.end())
+            if end == -1:
+                pos = start.start()
+                break
+
+            yield pending[start.end() : end]
+            pos = end + len(_DOC_END)
+
+        pending = pending[pos:]
+        if not chunk:
+            return
+
+
+def parse_fields(source: str) -> list[tuple[str, str]]:
+    """
+    Splits raw `DOC` contents into `(tag, text)` pairs in document order. Each
+    text belongs to the innermost enclosing tag, or to `DOC_TAG` if there is
+    none. Entities are unescaped.
+    """
+    fields = []
+    stack = [DOC_TAG]
+    pos = 0
+    for token in _TOKEN.finditer(source):
+        if token.start() > pos:
+            fields.append((stack[-1], html.unescape(source[pos : token.start()])))
+        pos = token.end()
+
+        if token.group("cdata") is not None:
+            fields.append((stack[-1], token.group("cdata")))
+            continue
+
+        name = token.group("name")
+        if name is None or token.group("empty"):
+            continue
+
+        if not token.group("close"):
+            stack.append(name)
+        elif name in stack[1:]:
+            # SGML allows omitted end tags, close everything up to `name`
+            while stack.pop() != name:
+                pass
+
+    if pos < len(source):
+        fields.append((stack[-1], html.unescape(source[pos:])))
+
+    return fields
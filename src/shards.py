@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import array
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+from multiprocessing import Pipe, Pool, Process
+from multiprocessing.connection import Connection
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+from src import indexing, lemmas, log, masked, storage
+from src.index import POSTING_TYPECODE, InvertedIndex, Postings
+
+MANIFEST = "shards.json"
+
+
+def _build_shard(args: tuple[indexing.IndexPaths, list[str], str, str]) -> int:
+    index_paths, paths, out_path, compression = args
+    index = index_paths(paths)
+    lemmas.flush_tables()
+    # norms depend on statistics of the whole collection
+    with log.stage("save"):
+        storage.save(index, out_path, with_norms=False, compression=compression)
+    log.flush_metrics()
+    return index.doc_count
+
+
+def build_shards(
+    docs_paths_iter: Iterator[str],
+    index_paths: indexing.IndexPaths,
+    directory: str,
+    shard_count: int,
+    compression: str = "none",
+) -> None:
+    """
+    Partitions documents into `shard_count` shards of consecutive files and
+    indexes each of them in its own process into `directory`.
+    """
+    paths = list(docs_paths_iter)
+    chunk_size = max(math.ceil(len(paths) / shard_count), 1)
+    chunks = [paths[i : i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    names = [f"shard-{i}.idx" for i in range(len(chunks))]
+
+    os.makedirs(directory, exist_ok=True)
+    with Pool(len(chunks)) as pool:
+        doc_counts = pool.map(
+            _build_shard,
+            [
+                (index_paths, chunk, os.path.join(directory, name), compression)
+                for chunk, name in zip(chunks, names)
+            ],
+            chunksize=1,
+        )
+
+    with open(os.path.join(directory, MANIFEST), mode="w", encoding="utf-8") as file:
+        json.dump({"shards": names}, file, indent=1)
+    log.timed(f"Indexed {sum(doc_counts)} documents into {len(names)} shards")
+
+
+class _ShardView(InvertedIndex):
+    """
+    Read-only view of a shard which weights terms by statistics of the whole
+    collection, so that its scores equal those of an unsharded index.
+    """
+
+    def __init__(
+        self, shard: storage.MappedIndex, doc_count: int, doc_freqs: dict[str, int]
+    ) -> None:
+        super().__init__()
+        self._shard = shard
+        self._doc_freqs = doc_freqs
+        self.doc_count = doc_count
+
+    def terms(self) -> Iterator[str]:
+        return self._shard.terms()
+
+    def doc_ids(self) -> Sequence[str]:
+        return self._shard.doc_ids()
+
+    def doc_freq(self, term: str) -> int:
+        return self._doc_freqs.get(term, 0)
+
+    def postings(self, term: str) -> Postings:
+        return self._shard.postings(term)
+
+    def _doc_id(self, doc: int) -> str:
+        return self._shard._doc_id(doc)  # pylint: disable=protected-access
+
+
+def _serve_shard(path: str, connection: Connection) -> None:
+    """
+    Answers requests of `ShardedIndex` about the shard at `path` until closed.
+    """
+    shard = storage.load(path)
+    view = None
+    while True:
+        request, *args = connection.recv()
+        try:
+            if request == "close":
+                break
+            if request == "statistics":
+                reply = (
+                    shard.doc_count,
+                    len(shard.doc_ids()),
+                    [(term, shard.doc_freq(term)) for term in shard.terms()],
+                )
+            elif request == "set_statistics":
+                doc_count, doc_freqs, excluded_terms = args
+                view = _ShardView(shard, doc_count, doc_freqs)
+                if len(excluded_terms) > 0:
+                    view = masked.MaskedIndex(view, excluded_terms)
+                reply = None
+            elif request == "doc_ids":
+                reply = list(shard.doc_ids())
+            elif request == "postings":
+                postings = shard.postings(*args)
+                # memory-mapped postings cannot be pickled
+                reply = (
+                    array.array(POSTING_TYPECODE, postings.docs),
+                    array.array(POSTING_TYPECODE, postings.counts),
+                )
+            elif request == "search":
+                with log.stage("query"):
+                    # pylint: disable=protected-access
+                    reply = view._get_most_similar_batch(*args, None, None, None)
+                log.flush_metrics()
+            else:
+                raise ValueError(f"ShardedIndex: Unknown request {request}.")
+        except Exception as error:  # pylint: disable=broad-except
+            connection.send((False, error))
+        else:
+            connection.send((True, reply))
+
+    connection.close()
+
+
+class ShardedIndex(InvertedIndex):
+    """
+    Read-only index of documents partitioned into shards built by
+    `build_shards`.
+
+    Every shard is queried by its own process. Queries are broadcast to all
+    shards, each of which returns its top documents scored with document
+    frequencies aggregated over all shards, and the per-shard rankings are
+    merged. Results of exact engines are thus identical to those of an
+    unsharded index.
+
+    `excluded_terms` are hidden as by `MaskedIndex`, each shard correcting the
+    norms of its documents.
+    """
+
+    def __init__(self, directory: str, excluded_terms: Iterable[str] = ()) -> None:
+        super().__init__()
+        self._directory = directory
+        self._excluded = frozenset(excluded_terms)
+        self._lock = threading.Lock()
+        self._all_doc_ids: Optional[list[str]] = None
+
+        with open(
+            os.path.join(directory, MANIFEST), mode="r", encoding="utf-8"
+        ) as file:
+            names = json.load(file)["shards"]
+
+        self._connections: list[Connection] = []
+        self._processes: list[Process] = []
+        for name in names:
+            connection, shard_connection = Pipe()
+            process = Process(
+                target=_serve_shard,
+                args=(os.path.join(directory, name), shard_connection),
+                daemon=True,
+            )
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        doc_count = 0
+        # first document ordinal of each shard
+        self._bases = [0]
+        self._doc_freqs: dict[str, int] = {}
+        for shard_doc_count, doc_id_count, shard_doc_freqs in self._broadcast(
+            "statistics"
+        ):
+            doc_count += shard_doc_count
+            self._bases.append(self._bases[-1] + doc_id_count)
+            for term, doc_freq in shard_doc_freqs:
+                self._doc_freqs[term] = self._doc_freqs.get(term, 0) + doc_freq
+
+        self.doc_count = doc_count
+        # shards weight excluded terms to subtract them from document norms
+        self._broadcast("set_statistics", doc_count, self._doc_freqs, self._excluded)
+        for term in self._excluded:
+            self._doc_freqs.pop(term, None)
+
+    def _broadcast(self, request: str, *args: Any) -> list[Any]:
+        """
+        Sends request to all shards and returns their replies in shard order.
+        """
+        with self._lock:
+            for connection in self._connections:
+                connection.send((request, *args))
+
+            replies = [connection.recv() for connection in self._connections]
+
+        for ok, reply in replies:
+            if not ok:
+                raise reply
+
+        return [reply for _, reply in replies]
+
+    def close(self) -> None:
+        with self._lock:
+            for connection, process in zip(self._connections, self._processes):
+                connection.send(("close",))
+                process.join()
+                connection.close()
+
+            self._connections = []
+            self._processes = []
+
+    @property
+    def excluded_terms(self) -> frozenset[str]:
+        return self._excluded
+
+    def add_posting(self, term: str, doc_id: str, count: int) -> None:
+        raise TypeError("ShardedIndex: Index is read-only.")
+
+    def update_with(self, other: InvertedIndex) -> None:
+        raise TypeError("ShardedIndex: Index is read-only.")
+
+    def shard_count(self) -> int:
+        return len(self._connections)
+
+    def terms(self) -> Iterator[str]:
+        return iter(self._doc_freqs)
+
+    def doc_ids(self) -> Sequence[str]:
+        if self._all_doc_ids is None:
+            self._all_doc_ids = [
+                doc_id
+                for shard_doc_ids in self._broadcast("doc_ids")
+                for doc_id in shard_doc_ids
+            ]
+
+        return self._all_doc_ids
+
+    def doc_freq(self, term: str) -> int:
+        return self._doc_freqs.get(term, 0)
+
+    def postings(self, term: str) -> Postings:
+        if term in self._excluded:
+            return Postings()
+
+        docs = array.array(POSTING_TYPECODE)
+        counts = array.array(POSTING_TYPECODE)
+        for base, (shard_docs, shard_counts) in zip(
+            self._bases, self._broadcast("postings", term)
+        ):
+            docs.extend(map(base.__add__, shard_docs))
+            counts.extend(shard_counts)
+
+        return Postings(docs, counts)
+
+    def compute_impacts(self, weighting: str) -> None:
+        raise ValueError("ShardedIndex: Impact engine is not supported.")
+
+    def _query_stage(self, processes: Optional[int], query_count: int) -> str:
+        return "dispatch"
+
+    def _get_most_similar(
+        self,
+        query: dict[str, int],
+        weighting: str,
+        first_k: int,
+        engine: str,
+        postings_budget: Optional[int],
+        time_budget: Optional[float],
+    ) -> list[tuple[float, str]]:
+        return self._get_most_similar_batch(
+            [query], weighting, first_k, engine, None, postings_budget, time_budget
+        )[0]
+
+    def _get_most_similar_batch(
+        self,
+        queries: list[dict[str, int]],
+        weighting: str,
+        first_k: int,
+        engine: str,
+        processes: Optional[int],
+        postings_budget: Optional[int],
+        time_budget: Optional[float],
+    ) -> list[list[tuple[float, str]]]:
+        # quantization of impacts is specific to each shard
+        if engine == "impact":
+            raise ValueError("ShardedIndex: Impact engine is not supported.")
+
+        if len(queries) == 0:
+            return []
+
+        queries = [
+            {term: count for term, count in query.items() if term not in self._excluded}
+            for query in queries
+        ]
+        shard_similars = self._broadcast("search", queries, weighting, first_k, engine)
+        results = []
+        for query_similars in zip(*shard_similars):
+            # shards hold consecutive ranges of document ordinals, so ordering
+            # ties by shard keeps the tie-breaking of an unsharded index
+            merged = heapq.merge(
+                *(
+                    [(score, shard, doc_id) for score, doc_id in similars]
+                    for shard, similars in enumerate(query_similars)
+                ),
+                key=lambda entry: entry[:2],
+                reverse=True,
+            )
+            results.append(
+                [
+                    (score, doc_id)
+                    for score, _, doc_id in itertools.islice(merged, first_k)
+                ]
+            )
+
+        return results
+
+    def _doc_id(self, doc: int) -> str:
+        return self.doc_ids()[doc]
+
+    def __str__(self) -> str:
+        return f"ShardedIndex({self._directory}, {self.shard_count()} shards)"
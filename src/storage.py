@@ -0,0 +1,655 @@
+from __future__ import annotations
+
+import array
+import bisect
+import functools
+import heapq
+import itertools
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from typing import Any, BinaryIO, Callable, Container, Iterator, Optional, Sequence
+
+from src import log, terms
+from src.cache import LRUCache
+from src.compression import decode_block, decode_postings, encode_postings
+from src.index import (
+    END_DOC,
+    POSTING_TYPECODE,
+    InvertedIndex,
+    Postings,
+    PostingsCursor,
+)
+
+MAGIC = b"VSMI"
+VERSION = 5
+COMPRESSIONS = ("none", "vbyte")
+# default memory limit of decoded compressed postings
+POSTINGS_CACHE_BYTES = 64 * 2**20
+# rough memory overhead of cached postings
+_POSTINGS_OVERHEAD = 200
+
+# magic, version, postings compression, document count, document ID count,
+# term count, posting count
+_HEADER = struct.Struct("<4sII4xQQQQ")
+# offsets of: doc offsets, doc blob, term offsets, term blob, term starts,
+# document frequencies, posting doc ordinals (encoded postings when
+# compressed), posting counts (block skips when compressed), term starts in
+# block skips (unused when not compressed), document norms and term weight
+# bounds for each weighting in `terms.WEIGHTINGS`
+_STATISTICS = 9
+_SECTION_COUNT = _STATISTICS + 2 * len(terms.WEIGHTINGS)
+_SECTIONS = struct.Struct(f"<{_SECTION_COUNT}Q")
+_ALIGN = 8
+# attributes of `MappedIndex` holding views of the mapped file
+_MAPPED_ATTRIBUTES = (
+    "_doc_offsets",
+    "_doc_blob",
+    "_term_starts",
+    "_doc_freqs",
+    "_encoded",
+    "_block_starts",
+    "_block_skips",
+    "_post_docs",
+    "_post_counts",
+)
+
+
+def _write_aligned(file: BinaryIO, data: bytes) -> int:
+    """
+    Writes `data` at the next aligned position and returns its offset.
+    """
+    padding = -file.tell() % _ALIGN
+    file.write(b"\0" * padding)
+    offset = file.tell()
+    file.write(data)
+    return offset
+
+
+def _encode_strings(strings: list[str]) -> tuple[bytes, bytes]:
+    offsets = array.array("Q", [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode("utf-8")
+        offsets.append(len(blob))
+
+    return offsets.tobytes(), bytes(blob)
+
+
+def _write_tables(
+    file: BinaryIO,
+    compression: str,
+    doc_count: int,
+    doc_ids: Sequence[str],
+    term_strs: list[str],
+    term_starts: array.array,
+    doc_freqs: array.array,
+    post_count: int,
+    post_docs_offset: int,
+    post_counts_offset: int,
+    block_starts: array.array,
+) -> list[int]:
+    """
+    Writes document and term tables at the end of `file` and the header at its
+    beginning. Returns section offsets, norms are left out.
+    """
+    doc_offsets, doc_blob = _encode_strings(doc_ids)
+    term_offsets, term_blob = _encode_strings(term_strs)
+    file.seek(0, os.SEEK_END)
+    offsets = [
+        _write_aligned(file, data)
+        for data in [
+            doc_offsets,
+            doc_blob,
+            term_offsets,
+            term_blob,
+            term_starts.tobytes(),
+            doc_freqs.tobytes(),
+        ]
+    ]
+    offsets += [post_docs_offset, post_counts_offset]
+    offsets.append(
+        _write_aligned(file, block_starts.tobytes()) if compression == "vbyte" else 0
+    )
+    offsets += [0] * (_SECTION_COUNT - len(offsets))
+
+    file.seek(0)
+    file.write(
+        _HEADER.pack(
+            MAGIC,
+            VERSION,
+            COMPRESSIONS.index(compression),
+            doc_count,
+            len(doc_ids),
+            len(term_strs),
+            post_count,
+        )
+    )
+    file.write(_SECTIONS.pack(*offsets))
+    return offsets
+
+
+def _statistics(index: InvertedIndex, term_strs: list[str]) -> list[bytes]:
+    """
+    Returns document norms followed by term weight bounds for all weightings.
+    """
+    norms = [
+        array.array("d", index.doc_norms(name)).tobytes() for name in terms.WEIGHTINGS
+    ]
+    bounds = [
+        array.array("d", (index.max_weight(term, name) for term in term_strs)).tobytes()
+        for name in terms.WEIGHTINGS
+    ]
+    return norms + bounds
+
+
+def _write_statistics(
+    file: BinaryIO, offsets: list[int], statistics: list[bytes]
+) -> None:
+    file.seek(0, os.SEEK_END)
+    for i, data in enumerate(statistics):
+        offsets[_STATISTICS + i] = _write_aligned(file, data)
+
+    file.seek(_HEADER.size)
+    file.write(_SECTIONS.pack(*offsets))
+
+
+def save(
+    index: InvertedIndex, path: str, with_norms: bool = True, compression: str = "none"
+) -> None:
+    """
+    Serializes `index` into a binary file which can be memory-mapped by `load`.
+
+    The file consists of a document ID table, a sorted term dictionary with
+    document frequencies, contiguous postings blocks, one per term, and
+    document norms for every supported weighting. Norms can be omitted for
+    partial indexes, they are then computed on demand after loading.
+
+    With "vbyte" `compression`, postings are stored as variable-byte encoded
+    document gaps and counts in blocks, which can be skipped without decoding.
+    """
+    term_strs = sorted(index.terms())
+    term_starts = array.array("Q", [0])
+    doc_freqs = array.array("I")
+    post_docs = array.array(POSTING_TYPECODE)
+    post_counts = array.array(POSTING_TYPECODE)
+    encoded = bytearray()
+    block_skips = array.array("Q")
+    block_starts = array.array("Q", [0])
+    for term in term_strs:
+        postings = index.postings(term)
+        if compression == "vbyte":
+            term_encoded, skips = encode_postings(postings.docs, postings.counts)
+            encoded += term_encoded
+            term_starts.append(len(encoded))
+            block_skips.extend(skips)
+            block_starts.append(len(block_skips) // 2)
+        else:
+            post_docs.extend(postings.docs)
+            post_counts.extend(postings.counts)
+            term_starts.append(len(post_docs))
+        doc_freqs.append(index.doc_freq(term))
+
+    with open(path, mode="wb") as file:
+        file.write(b"\0" * (_HEADER.size + _SECTIONS.size))
+        if compression == "vbyte":
+            post_count = sum(len(index.postings(term)) for term in term_strs)
+            post_docs_offset = _write_aligned(file, encoded)
+            post_counts_offset = _write_aligned(file, block_skips.tobytes())
+        else:
+            post_count = len(post_docs)
+            post_docs_offset = _write_aligned(file, post_docs.tobytes())
+            post_counts_offset = _write_aligned(file, post_counts.tobytes())
+        offsets = _write_tables(
+            file,
+            compression,
+            index.doc_count,
+            index.doc_ids(),
+            term_strs,
+            term_starts,
+            doc_freqs,
+            post_count,
+            post_docs_offset,
+            post_counts_offset,
+            block_starts,
+        )
+        if with_norms:
+            _write_statistics(file, offsets, _statistics(index, term_strs))
+        log.count("index_bytes", file.seek(0, os.SEEK_END))
+
+
+def merge(
+    paths: list[str],
+    out_path: str,
+    compression: str = "none",
+    deleted: Optional[list[Container[int]]] = None,
+    with_norms: bool = True,
+) -> None:
+    """
+    Merges saved indexes of disjoint document sets into a single index file
+    with postings compressed by `compression` and, unless `with_norms` is
+    False, with norms. Documents of `paths[i]` get ordinals after those of
+    `paths[i - 1]`. When given, documents with ordinals in `deleted[i]` are
+    dropped from `paths[i]`.
+
+    Terms are merged in a single k-way pass over the sorted term dictionaries,
+    so only the dictionaries and document tables are held in memory.
+    """
+    blocks = [load(path) for path in paths]
+    try:
+        _merge_blocks(blocks, out_path, compression, deleted, with_norms)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def _merge_blocks(
+    blocks: list[MappedIndex],
+    out_path: str,
+    compression: str,
+    deleted: Optional[list[Container[int]]],
+    with_norms: bool,
+) -> None:
+    # new ordinals of block documents, None for the dropped ones
+    remaps: list[Sequence[Optional[int]]] = []
+    doc_ids: list[str] = []
+    doc_count = 0
+    for i, block in enumerate(blocks):
+        block_deleted = () if deleted is None else deleted[i]
+        base = len(doc_ids)
+        remap = []
+        for doc, doc_id in enumerate(block.doc_ids()):
+            if doc in block_deleted:
+                remap.append(None)
+            else:
+                remap.append(len(doc_ids))
+                doc_ids.append(doc_id)
+
+        dropped = len(remap) - (len(doc_ids) - base)
+        remaps.append(remap if dropped > 0 else range(base, len(doc_ids)))
+        doc_count += block.doc_count - dropped
+
+    term_strs = []
+    term_starts = array.array("Q", [0])
+    doc_freqs = array.array("I")
+    block_starts = array.array("Q", [0])
+    # holds posting counts, or block skips when compressed
+    with open(out_path, mode="wb+") as file, tempfile.TemporaryFile() as counts_file:
+        file.write(b"\0" * (_HEADER.size + _SECTIONS.size))
+        post_docs_offset = _write_aligned(file, b"")
+        block_terms = [
+            zip(block.terms(), itertools.repeat(i)) for i, block in enumerate(blocks)
+        ]
+        post_count = 0
+        for term, group in itertools.groupby(
+            heapq.merge(*block_terms), key=lambda entry: entry[0]
+        ):
+            docs = array.array(POSTING_TYPECODE)
+            counts = array.array(POSTING_TYPECODE)
+            for _, i in group:
+                postings = blocks[i].postings(term)
+                if isinstance(remaps[i], range):
+                    docs.extend(map(remaps[i].__getitem__, postings.docs))
+                    counts.extend(postings.counts)
+                    continue
+
+                for doc, count in postings:
+                    doc = remaps[i][doc]
+                    if doc is not None:
+                        docs.append(doc)
+                        counts.append(count)
+
+            if len(docs) == 0:
+                continue
+
+            if compression == "vbyte":
+                term_encoded, skips = encode_postings(docs, counts)
+                file.write(term_encoded)
+                term_starts.append(file.tell() - post_docs_offset)
+                counts_file.write(skips.tobytes())
+                block_starts.append(block_starts[-1] + len(skips) // 2)
+            else:
+                file.write(docs.tobytes())
+                counts_file.write(counts.tobytes())
+                term_starts.append(term_starts[-1] + len(docs))
+            post_count += len(docs)
+            term_strs.append(term)
+            doc_freqs.append(len(docs))
+
+        counts_file.seek(0)
+        post_counts_offset = _write_aligned(file, b"")
+        shutil.copyfileobj(counts_file, file)
+
+        offsets = _write_tables(
+            file,
+            compression,
+            doc_count,
+            doc_ids,
+            term_strs,
+            term_starts,
+            doc_freqs,
+            post_count,
+            post_docs_offset,
+            post_counts_offset,
+            block_starts,
+        )
+        file.flush()
+
+        if with_norms:
+            with load(out_path) as merged:
+                statistics = _statistics(merged, term_strs)
+            _write_statistics(file, offsets, statistics)
+        log.count("index_bytes", file.seek(0, os.SEEK_END))
+
+
+def load(path: str) -> MappedIndex:
+    """
+    Opens index saved by `save` without reading postings into memory.
+    """
+    return MappedIndex(path)
+
+
+class MappedIndex(InvertedIndex):
+    """
+    Read-only `InvertedIndex` whose postings are memory-mapped from a file.
+
+    Processes opening the same file share its pages through the page cache.
+    Pickling transfers only the path, so instances can be passed to workers.
+
+    Compressed postings are decoded on each access, except for recently used
+    ones kept in a cache bounded by `postings_cache_bytes`. Cursors decode
+    blocks of postings only once they reach them.
+    """
+
+    def __init__(
+        self, path: str, postings_cache_bytes: int = POSTINGS_CACHE_BYTES
+    ) -> None:
+        super().__init__()
+        self._path = path
+        self._postings_cache = LRUCache(postings_cache_bytes, _postings_size)
+        self._open()
+
+    def _open(self) -> None:
+        with open(self._path, mode="rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            version,
+            compression_id,
+            doc_count,
+            doc_id_count,
+            term_count,
+            post_count,
+        ) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"MappedIndex: {self._path} is not a supported index.")
+
+        sections = _SECTIONS.unpack_from(self._mmap, _HEADER.size)
+        view = memoryview(self._mmap)
+
+        def section(idx: int, fmt: str, length: int) -> memoryview:
+            start = sections[idx]
+            return view[start : start + length * struct.calcsize(fmt)].cast(fmt)
+
+        # set directly, the stored norms below stay valid
+        self._doc_count = doc_count
+        self._doc_offsets = section(0, "Q", doc_id_count + 1)
+        self._doc_blob = view[sections[1] : sections[1] + self._doc_offsets[-1]]
+        term_offsets = section(2, "Q", term_count + 1)
+        term_blob = bytes(view[sections[3] : sections[3] + term_offsets[-1]])
+        self._term_starts = section(4, "Q", term_count + 1)
+        self._doc_freqs = section(5, "I", term_count)
+        self._compression = COMPRESSIONS[compression_id]
+        self._post_count = post_count
+        if self._compression == "vbyte":
+            self._encoded = view[sections[6] : sections[6] + self._term_starts[-1]]
+            self._block_starts = section(8, "Q", term_count + 1)
+            self._block_skips = section(7, "Q", 2 * self._block_starts[-1])
+        else:
+            self._post_docs = section(6, POSTING_TYPECODE, post_count)
+            self._post_counts = section(7, POSTING_TYPECODE, post_count)
+
+        weightings_count = len(terms.WEIGHTINGS)
+        self._norms = {
+            name: section(_STATISTICS + i, "d", doc_id_count)
+            for i, name in enumerate(terms.WEIGHTINGS)
+            if sections[_STATISTICS + i] != 0
+        }
+        self._stored_bounds = {
+            name: section(_STATISTICS + weightings_count + i, "d", term_count)
+            for i, name in enumerate(terms.WEIGHTINGS)
+            if sections[_STATISTICS + weightings_count + i] != 0
+        }
+        self._term_ids = {
+            term_blob[term_offsets[i] : term_offsets[i + 1]].decode("utf-8"): i
+            for i in range(term_count)
+        }
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {
+            "path": self._path,
+            "postings_cache_bytes": self._postings_cache.max_bytes,
+        }
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__init__(state["path"], state["postings_cache_bytes"])
+
+    def __enter__(self) -> MappedIndex:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Unmaps the index file, the index must not be used afterwards. Postings
+        returned before keep the file mapped until they are released.
+        """
+        if self._mmap is None:
+            return
+
+        self._postings_cache.clear()
+        self._clear_statistics()
+        self._norms = {}
+        self._stored_bounds = {}
+        # views of the mapping have to be released before it is closed
+        for name in _MAPPED_ATTRIBUTES:
+            setattr(self, name, None)
+        mapping, self._mmap = self._mmap, None
+        try:
+            mapping.close()
+        except BufferError:
+            # the mapping is closed once remaining views are garbage collected
+            pass
+
+    @property
+    def postings_cache(self) -> LRUCache:
+        return self._postings_cache
+
+    @property
+    def compression(self) -> str:
+        return self._compression
+
+    def add_posting(self, term: str, doc_id: str, count: int) -> None:
+        raise TypeError("MappedIndex: Index is read-only.")
+
+    def update_with(self, other: InvertedIndex) -> None:
+        raise TypeError("MappedIndex: Index is read-only.")
+
+    def terms(self) -> Iterator[str]:
+        return iter(self._term_ids)
+
+    def doc_ids(self) -> Sequence[str]:
+        return _DocIdTable(self)
+
+    def doc_freq(self, term: str) -> int:
+        term_id = self._term_ids.get(term, None)
+        return 0 if term_id is None else self._doc_freqs[term_id]
+
+    def max_weight(self, term: str, weighting: str) -> float:
+        bounds = self._stored_bounds.get(weighting, None)
+        if bounds is None:
+            return super().max_weight(term, weighting)
+
+        term_id = self._term_ids.get(term, None)
+        return 0.0 if term_id is None else bounds[term_id]
+
+    def _max_term_bound(self, weighting: str) -> float:
+        bounds = self._stored_bounds.get(weighting, None)
+        if bounds is None:
+            return super()._max_term_bound(weighting)
+
+        return max(bounds, default=0.0)
+
+    def postings(self, term: str) -> Postings:
+        term_id = self._term_ids.get(term, None)
+        if term_id is None:
+            return Postings()
+
+        start, end = self._term_starts[term_id], self._term_starts[term_id + 1]
+        if self._compression == "vbyte":
+            postings = self._postings_cache.get(term_id)
+            if postings is None:
+                log.count("postings_decoded")
+                postings = Postings(
+                    *decode_postings(self._encoded[start:end], POSTING_TYPECODE)
+                )
+                self._postings_cache.put(term_id, postings)
+            return postings
+
+        return Postings(self._post_docs[start:end], self._post_counts[start:end])
+
+    def postings_cursor(self, term: str) -> PostingsCursor:
+        term_id = self._term_ids.get(term, None)
+        if term_id is None or self._compression != "vbyte":
+            return super().postings_cursor(term)
+
+        postings = self._postings_cache.get(term_id)
+        if postings is not None:
+            return postings.cursor()
+
+        first_block = self._block_starts[term_id]
+        last_block = self._block_starts[term_id + 1]
+        return _BlockCursor(
+            self._block_skips[2 * first_block : 2 * last_block : 2],
+            functools.partial(self._block_postings, term_id),
+        )
+
+    def _block_postings(self, term_id: int, block: int) -> Postings:
+        """
+        Returns postings in given block of `term_id`, decoded blocks are cached
+        like whole postings.
+        """
+        postings = self._postings_cache.get((term_id, block))
+        if postings is not None:
+            return postings
+
+        skip = 2 * (self._block_starts[term_id] + block)
+        start = self._term_starts[term_id]
+        if block > 0:
+            prev_doc = self._block_skips[skip - 2]
+            start += self._block_skips[skip - 1]
+        else:
+            prev_doc = 0
+        end = self._term_starts[term_id] + self._block_skips[skip + 1]
+        log.count("blocks_decoded")
+        postings = Postings(
+            *decode_block(self._encoded[start:end], prev_doc, POSTING_TYPECODE)
+        )
+        self._postings_cache.put((term_id, block), postings)
+        return postings
+
+    def postings_size(self) -> tuple[int, int]:
+        """
+        Returns size of stored postings in bytes, together with the size they
+        would take uncompressed.
+        """
+        uncompressed = 2 * array.array(POSTING_TYPECODE).itemsize * self._post_count
+        if self._compression == "vbyte":
+            return self._term_starts[-1], uncompressed
+
+        return uncompressed, uncompressed
+
+    def _doc_id(self, doc: int) -> str:
+        start, end = self._doc_offsets[doc], self._doc_offsets[doc + 1]
+        return bytes(self._doc_blob[start:end]).decode("utf-8")
+
+    def __str__(self) -> str:
+        return f"MappedIndex({self._path})"
+
+
+def _postings_size(postings: Postings) -> int:
+    return _POSTINGS_OVERHEAD + 2 * array.array(POSTING_TYPECODE).itemsize * len(
+        postings
+    )
+
+
+class _BlockCursor(PostingsCursor):
+    """
+    `PostingsCursor` over compressed postings, which gets a block from
+    `block_postings` only once the cursor reaches it. Blocks whose last
+    document ordinals in `last_docs` precede the target of `advance` are
+    skipped without decoding.
+    """
+
+    # pylint: disable-next=super-init-not-called
+    def __init__(
+        self, last_docs: Sequence[int], block_postings: Callable[[int], Postings]
+    ) -> None:
+        self._last_docs = last_docs
+        self._block_postings = block_postings
+        self._load(0)
+
+    def _load(self, block: int) -> None:
+        self._block = block
+        self._pos = 0
+        if block == len(self._last_docs):
+            self._docs = self._counts = ()
+            self.doc = END_DOC
+            return
+
+        postings = self._block_postings(block)
+        self._docs, self._counts = postings.docs, postings.counts
+        self.doc = self._docs[0]
+
+    def next_doc(self) -> int:
+        self._pos += 1
+        if self._pos < len(self._docs):
+            self.doc = self._docs[self._pos]
+        else:
+            self._load(self._block + 1)
+        return self.doc
+
+    def advance(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+
+        block = bisect.bisect_left(self._last_docs, target, self._block)
+        if block != self._block:
+            self._load(block)
+            if self.doc >= target:
+                return self.doc
+
+        self._pos = bisect.bisect_left(self._docs, target, self._pos)
+        self.doc = self._docs[self._pos]
+        return self.doc
+
+
+class _DocIdTable(Sequence[str]):
+    """
+    Lazily decoded document ID table of `MappedIndex`.
+    """
+
+    def __init__(self, index: MappedIndex) -> None:
+        self._index = index
+
+    def __len__(self) -> int:
+        return len(self._index._doc_offsets) - 1
+
+    def __getitem__(self, doc: int) -> str:
+        if not 0 <= doc < len(self):
+            raise IndexError("_DocIdTable: Document ordinal out of range.")
+        return self._index._doc_id(doc)
@@ -1,36 +1,83 @@
+import functools
 import math
 import re
-from collections import namedtuple
-from typing import Callable, Optional
+from collections import Counter, namedtuple
+from typing import Any, Callable, Iterable, Optional
+
+from src import log
 
 Term = namedtuple("Token", ["str", "count"])
 
 
+class Tokenizer:
+    def __init__(
+        self,
+        separators: str,
+        stop_words: Optional[Iterable[str]] = None,
+        term_map: Optional[Callable[[str], str]] = None,
+        memoize_map: bool = True,
+    ) -> None:
+        """
+        Initializes tokenizer splitting strings on characters in `separators`,
+        omitting `stop_words` and mapping the remaining words with `term_map`.
+        Mapped words are memoized unless `memoize_map` is False, e.g. when
+        `term_map` bounds its own cache.
+        """
+        self._pattern = re.compile("[^" + separators + "]+")
+        self._stop_words = frozenset(() if stop_words is None else stop_words)
+        self._term_map = term_map
+        self._memoize_map = memoize_map
+        self._mapped = {}
+
+    @property
+    def stop_words(self) -> frozenset[str]:
+        return self._stop_words
+
+    def __call__(self, string: str) -> dict[str, int]:
+        """
+        Returns counts of terms in `string`.
+        """
+        with log.stage("tokenize"):
+            return self._count_terms(string)
+
+    def _count_terms(self, string: str) -> dict[str, int]:
+        words = self._pattern.findall(string)
+        log.count("tokens", len(words))
+        counts = Counter(words)
+        for word in self._stop_words.intersection(counts):
+            del counts[word]
+
+        if self._term_map is None:
+            return counts
+
+        # words are mapped once per distinct word, the results are memoized
+        mapped_counts = Counter()
+        for word, count in counts.items():
+            if not self._memoize_map:
+                mapped_counts[self._term_map(word)] += count
+                continue
+
+            term = self._mapped.get(word, None)
+            if term is None:
+                term = self._term_map(word)
+                self._mapped[word] = term
+            mapped_counts[term] += count
+
+        return mapped_counts
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_mapped"] = {}
+        return state
+
+
 def extract(
     string: str,
     separators: str,
     stop_words: Optional[set[str]] = None,
     term_map: Optional[Callable[[str], str]] = None,
 ) -> dict[str, int]:
-    words = re.split("[" + separators + "]", string)
-
-    if stop_words is None:
-        stop_words = set()
-
-    stop_words.add("")
-
-    if term_map is None:
-        # pylint: disable=unnecessary-lambda-assignment
-        term_map = lambda x: x
-
-    counts = {}
-    for word in words:
-        if word in stop_words:
-            continue
-        word = term_map(word)
-        counts[word] = counts.get(word, 0) + 1
-
-    return counts
+    return Tokenizer(separators, stop_words, term_map)(string)
 
 
 def natural_weight(count: int, _) -> float:
@@ -46,6 +93,22 @@ def tf_idf_weight(
     return log_tf * log_idf
 
 
+WEIGHTINGS = ("natural", "tfidf")
+
+
+def get_weighting(name: str, document_count: int) -> Callable[[int, int], float]:
+    """
+    Returns weighting function `(term_frequency, document_frequency) -> weight`
+    identified by `name` for collection of `document_count` documents.
+    """
+    if name == "natural":
+        return natural_weight
+    if name == "tfidf":
+        return functools.partial(tf_idf_weight, document_count)
+
+    raise ValueError(f"Unknown weighting {name}. Choose one of {WEIGHTINGS}.")
+
+
 WHSP_SEPS = r" \n\t"
 PUNCT_SEPS = r",.:;?!"
 PUNCT_EXT_SEPS = r'-_"\'/'
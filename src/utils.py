@@ -1,14 +1,11 @@
 import io
 import os
-from itertools import zip_longest
-from math import log
-from multiprocessing.pool import Pool
 from typing import Any, Callable, Iterator
 
 import bs4
 
-from src import log, terms
-from src.document import Document
+from src import doc_cache, log, sgml
+from src.document import Document, StreamedDocument
 from src.query import Query
 
 
@@ -21,13 +18,32 @@ def get_filename_iter(dir_name: str, file_with_filenames: str) -> Iterator[str]:
             yield os.path.join(dir_name, filename[:-1])
 
 
-def get_document_iter(
-    doc_path: str, create_doc: Callable[[bs4.element.Tag], Document]
-) -> Iterator[Document]:
+def stream_document_iter(
+    doc_path: str, create_doc: type[Document]
+) -> Iterator[StreamedDocument]:
+    """
+    Returns iterator over documents in `doc_path`, which is parsed incrementally
+    without building the whole tree. Each document is freed once consumed. Tags
+    blacklisted by `create_doc` are omitted from `str_all`.
+
+    When the document cache is enabled, parsed fields are read from the cache
+    instead.
+    """
+    log.count("bytes", os.path.getsize(doc_path))
+    if doc_cache.cache_dir() is not None:
+        with log.stage("parse"):
+            docs = doc_cache.parsed_documents(doc_path)
+        log.count("documents", len(docs))
+        for fields in docs:
+            yield StreamedDocument(fields, create_doc.TAG_BLACKLIST)
+        return
+
     with open(doc_path, mode="r", encoding="utf-8") as file_handle:
-        soup = bs4.BeautifulSoup(file_handle, "xml")
-        for doc_tag in soup.find_all("DOC"):
-            yield create_doc(doc_tag)
+        for source in sgml.iter_doc_sources(file_handle):
+            with log.stage("parse"):
+                fields = sgml.parse_fields(source)
+            log.count("documents")
+            yield StreamedDocument(fields, create_doc.TAG_BLACKLIST)
 
 
 def get_query_iter(
@@ -49,6 +65,25 @@ def write_qrels(
         print("\t".join([query_id, "0", doc_id, str(rank), str(sim), run_id]), file=out)
 
 
+def ranking_recall(
+    exact_similars: list[list[tuple[float, str]]],
+    approx_similars: list[list[tuple[float, str]]],
+) -> float:
+    """
+    Returns mean fraction of documents in exact rankings which are also found in
+    approximate rankings of the same queries.
+    """
+    recalls = []
+    for exact, approx in zip(exact_similars, approx_similars):
+        if len(exact) == 0:
+            continue
+
+        approx_ids = {doc_id for _, doc_id in approx}
+        recalls.append(sum(doc_id in approx_ids for _, doc_id in exact) / len(exact))
+
+    return sum(recalls) / len(recalls) if len(recalls) > 0 else 1.0
+
+
 def batch(iterable: Iterator[Any], batch_size: int) -> Iterator[list[Any]]:
     batch = []
     for element in iterable:
@@ -64,47 +99,3 @@ def batch(iterable: Iterator[Any], batch_size: int) -> Iterator[list[Any]]:
 def load_stopwords(path: str) -> set[str]:
     with open(path, mode="r", encoding="utf-8") as file:
         return set(file.read().splitlines())
-
-
-def gen_stopwords_per_document(args: tuple[str, str]) -> dict[str, int]:
-    doc_path, separators = args
-    term_counts = {}
-    doc_count = 0
-    for doc in get_document_iter(doc_path, Document):
-        doc_terms = terms.extract(doc.str_all, separators)
-        doc_count += 1
-        for term_str, count in doc_terms.items():
-            term_counts[term_str] = term_counts.get(term_str, 0) + count
-
-    return term_counts, doc_count
-
-
-def generate_stopwords(
-    docs_paths_iter: Iterator[str],
-    separators: str,
-    threshold_freq: float,
-    output_file: str,
-) -> None:
-    log.timed("Parsing documents...")
-
-    term_counts = {}
-    doc_count = 0
-    with Pool() as pool:
-        for docs_term_counts, doc_count in pool.imap(
-            gen_stopwords_per_document,
-            zip_longest(docs_paths_iter, [], fillvalue=separators),
-            chunksize=20,
-        ):
-            doc_count += doc_count
-            print(f"\rParsed doc {doc_count}", end="")
-            for term, count in docs_term_counts.items():
-                term_counts[term] = term_counts.get(term, 0) + count
-
-    print()
-
-    log.timed("Parsing complete")
-
-    with open(output_file, mode="w", encoding="utf-8") as stopword_file:
-        for term, count in term_counts.items():
-            if count / doc_count > threshold_freq:
-                print(term, file=stopword_file)
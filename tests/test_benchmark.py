@@ -0,0 +1,23 @@
+import os
+
+import main
+from src import benchmark, utils
+from src.document import DocumentCS
+
+
+def test_runs_differ_from_cli_runs_only_in_stop_words(tmp_path) -> None:
+    stopwords_path = os.path.join(tmp_path, "stopwords.txt")
+    with open(stopwords_path, mode="w", encoding="utf-8") as file:
+        print("ka\nto", file=file)
+
+    for name, run in benchmark.RUNS.items():
+        assert run.run is main.AVAILABLE_RUNS[f"{name}_cs"]
+        pipeline = run.pipeline(stopwords_path)
+        expected = (
+            utils.load_stopwords(stopwords_path) if run.omits_stopwords else set()
+        )
+        assert pipeline.tokenizer.stop_words == expected
+
+    pipeline = benchmark.RUNS["run-0-tagblacklist"].pipeline(stopwords_path)
+    assert pipeline.create_doc is DocumentCS
+    assert pipeline.tokenizer("ka, po; to") == {"po": 1}
@@ -0,0 +1,73 @@
+import pickle
+
+from src.cache import LRUCache
+from src.index import InvertedIndex
+
+
+def test_least_recently_used_entries_are_evicted() -> None:
+    cache = LRUCache(10, len)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+    assert (len(cache), cache.size, cache.hits, cache.misses) == (2, 8, 3, 1)
+
+    # replaced values are not counted twice
+    cache.put("a", "aa")
+    assert cache.size == 6
+    # values larger than the cache are not stored
+    cache.put("d", "d" * 11)
+    assert cache.get("d") is None
+    assert len(cache) == 2
+
+
+def test_shrinking_and_clearing() -> None:
+    cache = LRUCache(10, len)
+    for key in "abc":
+        cache.put(key, "xxx")
+    cache.max_bytes = 4
+    assert cache.get("c") == "xxx"
+    assert cache.get("b") is None
+
+    cache.max_bytes = 0
+    assert (len(cache), cache.size) == (0, 0)
+    cache.put("a", "")
+    cache.clear()
+    assert (len(cache), cache.size, cache.hits, cache.misses) == (0, 0, 1, 1)
+
+
+def test_pickled_cache_keeps_entries() -> None:
+    cache = LRUCache(10, len)
+    cache.put("a", "aaaa")
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.get("a") == "aaaa"
+    copy.put("b", "bbbbbbbb")
+    assert copy.get("a") is None
+
+
+def test_results_are_cached_until_index_changes() -> None:
+    index = InvertedIndex()
+    index.add_posting("cat", "d1", 1)
+    index.add_posting("dog", "d2", 2)
+
+    similars = index.get_most_similar({"cat": 1}, "tfidf")
+    assert index.get_most_similar({"cat": 1}, "tfidf") == similars
+    assert (index.result_cache.hits, index.result_cache.misses) == (1, 1)
+    # results of other weightings and lengths are cached separately
+    index.get_most_similar({"cat": 1}, "natural")
+    index.get_most_similar({"cat": 1}, "tfidf", 1)
+    assert index.result_cache.hits == 1
+
+    index.add_posting("cat", "d3", 1)
+    similars = index.get_most_similar({"cat": 1}, "tfidf")
+    assert sorted(doc_id for _, doc_id in similars) == ["d1", "d3"]
+    assert index.result_cache.hits == 1
+
+    other = InvertedIndex()
+    other.add_posting("cat", "d4", 5)
+    index.update_with(other)
+    assert len(index.get_most_similar({"cat": 1}, "tfidf")) == 3
+    assert index.result_cache.hits == 1
@@ -0,0 +1,131 @@
+import math
+import os
+import random
+from collections import Counter
+
+import pytest
+
+from src import benchmark, collection_stats, utils
+from src.runs import run_0_tfidf
+
+
+def _zipf_counts(seed: int, tokens: int = 20000) -> Counter:
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(2000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return Counter(rng.choices(words, weights, k=tokens))
+
+
+def test_sketch_overestimates_within_bound() -> None:
+    counts = _zipf_counts(0)
+    width = 512
+    sketch = collection_stats.CountMinSketch(width, 4)
+    for term, count in counts.items():
+        sketch.add(term, count)
+
+    bound = math.e / width * sum(counts.values())
+    errors = [sketch.estimate(term) - count for term, count in counts.items()]
+    assert min(errors) >= 0
+    # the bound holds for each term with probability 1 - exp(-4)
+    assert sum(error > bound for error in errors) <= 0.05 * len(errors)
+    assert sketch.estimate("unknown") <= bound
+
+
+def test_merged_sketches_equal_single_sketch() -> None:
+    parts = [_zipf_counts(seed, 2000) for seed in range(3)]
+    merged = collection_stats.CountMinSketch(64, 3)
+    single = collection_stats.CountMinSketch(64, 3)
+    for part in parts:
+        sketch = collection_stats.CountMinSketch(64, 3)
+        for term, count in part.items():
+            sketch.add(term, count)
+            single.add(term, count)
+        merged.merge(sketch)
+
+    assert all(
+        merged.estimate(term) == single.estimate(term)
+        for part in parts
+        for term in part
+    )
+
+
+@pytest.mark.parametrize("capacity", [1, 10, 100])
+def test_heavy_hitters_keep_frequent_terms(capacity: int) -> None:
+    parts = [_zipf_counts(seed) for seed in range(3)]
+    heavy_hitters = collection_stats.HeavyHitters(capacity)
+    for part in parts:
+        part_hitters = collection_stats.HeavyHitters(capacity)
+        for term, count in part.items():
+            part_hitters.add(term, count)
+        heavy_hitters.merge(part_hitters)
+
+    counts = sum(parts, Counter())
+    total = sum(counts.values())
+    kept = set(heavy_hitters)
+    assert len(kept) <= 2 * capacity
+    assert {
+        term for term, count in counts.items() if count > total / (capacity + 1)
+    } <= kept
+
+
+@pytest.fixture(scope="module")
+def paths(tmp_path_factory: pytest.TempPathFactory) -> list[str]:
+    documents_path, _, _ = benchmark.generate_collection(
+        str(tmp_path_factory.mktemp("collection")),
+        file_count=6,
+        docs_per_file=20,
+        doc_length=50,
+        vocabulary_size=300,
+        topic_count=1,
+    )
+    doc_dir = documents_path[: documents_path.rfind(".")]
+    return list(utils.get_filename_iter(doc_dir, documents_path))
+
+
+def test_parallel_statistics_match_serial_ones(paths: list[str]) -> None:
+    serial = collection_stats.CollectionStatistics(None)
+    tokenizer = run_0_tfidf.TOKENIZER
+    for path in paths:
+        serial.add_file(path, tokenizer)
+
+    exact = collection_stats.collect_statistics(
+        iter(paths), run_0_tfidf.SEPS, None, batch_size=2, processes=2
+    )
+    approx = collection_stats.collect_statistics(
+        iter(paths), run_0_tfidf.SEPS, 2**16, heavy_hitters=200, processes=2
+    )
+    assert (exact.doc_count, exact.token_count) == (
+        serial.doc_count,
+        serial.token_count,
+    )
+    assert (approx.doc_count, approx.token_count) == (
+        serial.doc_count,
+        serial.token_count,
+    )
+    for term in serial.heavy_hitters:
+        assert exact.doc_freq(term) == serial.doc_freq(term)
+        assert exact.collection_freq(term) == serial.collection_freq(term)
+        assert approx.doc_freq(term) >= serial.doc_freq(term)
+        assert approx.collection_freq(term) >= serial.collection_freq(term)
+
+    # thresholds above the average document length over `heavy_hitters + 1`
+    for criterion in collection_stats.STOPWORD_CRITERIA:
+        assert approx.stopwords(0.5, criterion) == exact.stopwords(0.5, criterion)
+        assert len(exact.stopwords(0.5, criterion)) > 0
+
+
+def test_unknown_stopword_criterion() -> None:
+    with pytest.raises(ValueError):
+        collection_stats.CollectionStatistics().stopwords(0.1, "tf")
+
+
+def test_dead_worker_is_reported(
+    paths: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def crash(*_) -> None:
+        # dies without sending anything, as if killed
+        os._exit(3)  # pylint: disable=protected-access
+
+    monkeypatch.setattr(collection_stats.CollectionStatistics, "add_file", crash)
+    with pytest.raises(RuntimeError):
+        collection_stats.collect_statistics(iter(paths), run_0_tfidf.SEPS, processes=2)
@@ -0,0 +1,91 @@
+import os
+import random
+
+import pytest
+
+from src import compression, storage
+from src.index import END_DOC, POSTING_TYPECODE, InvertedIndex
+
+EDGE_NUMBERS = [0, 1, 127, 128, 255, 16383, 16384, 2**32 - 1, 2**32, 2**63 - 1]
+
+
+def _postings(length: int, seed: int = 0) -> tuple[list[int], list[int]]:
+    rng = random.Random(seed)
+    docs = sorted(rng.sample(range(20 * length + 1), length))
+    counts = [rng.choice([1, 1, 2, 3, 200, 70000]) for _ in range(length)]
+    return docs, counts
+
+
+def test_vbyte_round_trip() -> None:
+    rng = random.Random(0)
+    numbers = EDGE_NUMBERS + [
+        rng.randrange(2 ** rng.randrange(1, 40)) for _ in range(1000)
+    ]
+    assert compression.vbyte_decode(compression.vbyte_encode(numbers)) == numbers
+    # every number fits into a single byte
+    small = list(range(128))
+    encoded = compression.vbyte_encode(small)
+    assert len(encoded) == len(small)
+    assert compression.vbyte_decode(encoded) == small
+    assert compression.vbyte_decode(b"") == []
+
+
+@pytest.mark.parametrize("length", [0, 1, 127, 128, 129, 300])
+def test_postings_round_trip(length: int) -> None:
+    docs, counts = _postings(length)
+    data, skips = compression.encode_postings(docs, counts)
+    decoded_docs, decoded_counts = compression.decode_postings(data, POSTING_TYPECODE)
+    assert list(decoded_docs) == docs
+    assert list(decoded_counts) == counts
+
+    # every block is decoded on its own from the end of the previous one
+    block_count = -(-length // compression.BLOCK_SIZE)
+    assert len(skips) == 2 * block_count
+    prev_doc, start = 0, 0
+    for block in range(block_count):
+        last_doc, end = skips[2 * block], skips[2 * block + 1]
+        block_docs, block_counts = compression.decode_block(
+            data[start:end], prev_doc, POSTING_TYPECODE
+        )
+        first = block * compression.BLOCK_SIZE
+        assert list(block_docs) == docs[first : first + compression.BLOCK_SIZE]
+        assert list(block_counts) == counts[first : first + compression.BLOCK_SIZE]
+        assert block_docs[-1] == last_doc
+        prev_doc, start = last_doc, end
+    assert start == len(data)
+
+
+@pytest.fixture(scope="module")
+def compressed_index(tmp_path_factory: pytest.TempPathFactory) -> storage.MappedIndex:
+    index = InvertedIndex()
+    for term, length in (("rare", 3), ("frequent", 1000)):
+        docs, counts = _postings(length, seed=length)
+        for doc, count in zip(docs, counts):
+            index.add_posting(term, f"d{doc}", count)
+
+    path = os.path.join(tmp_path_factory.mktemp("compressed"), "index.idx")
+    storage.save(index, path, compression="vbyte")
+    loaded = storage.load(path)
+    # cursors decode blocks instead of reading whole cached postings
+    loaded.postings_cache.max_bytes = 0
+    return loaded
+
+
+@pytest.mark.parametrize("term", ["rare", "frequent"])
+def test_block_cursor_matches_postings_cursor(
+    compressed_index: storage.MappedIndex, term: str
+) -> None:
+    postings = compressed_index.postings(term)
+    rng = random.Random(1)
+    for _ in range(20):
+        cursor = compressed_index.postings_cursor(term)
+        expected = postings.cursor()
+        assert cursor.doc == expected.doc
+        while expected.doc != END_DOC:
+            if rng.random() < 0.5:
+                target = expected.doc + rng.randrange(1, 600)
+                assert cursor.advance(target) == expected.advance(target)
+            else:
+                assert cursor.next_doc() == expected.next_doc()
+            if expected.doc != END_DOC:
+                assert cursor.count == expected.count
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from src import doc_cache, sgml, utils
+from src.document import DocumentCS
+
+SOURCE = """<DOC>
+<DOCNO>CS-1</DOCNO>
+<TITLE>Příliš žluťoučký kůň</TITLE>
+<TEXT><P>úpěl ďábelské ódy</P> &amp; more</TEXT>
+</DOC>
+<DOC>
+<DOCNO>CS-2</DOCNO>
+<TEXT></TEXT>
+</DOC>
+"""
+
+
+@pytest.fixture
+def parses(monkeypatch: pytest.MonkeyPatch, tmp_path) -> list[str]:
+    """
+    Enables the cache in a temporary directory and returns list of parsed
+    document sources.
+    """
+    monkeypatch.setattr(doc_cache, "_cache_dir", None)
+    doc_cache.set_cache_dir(os.path.join(tmp_path, "cache"))
+
+    parsed = []
+    parse_fields = sgml.parse_fields
+
+    def counting_parse_fields(source: str) -> list[tuple[str, str]]:
+        parsed.append(source)
+        return parse_fields(source)
+
+    monkeypatch.setattr(sgml, "parse_fields", counting_parse_fields)
+    return parsed
+
+
+def _write_documents(tmp_path, source: str = SOURCE) -> str:
+    doc_path = os.path.join(tmp_path, "documents.sgml")
+    with open(doc_path, mode="w", encoding="utf-8") as file:
+        file.write(source)
+    return doc_path
+
+
+def test_cached_documents_match_parsed_ones(tmp_path, parses: list[str]) -> None:
+    doc_path = _write_documents(tmp_path)
+    docs = doc_cache.parsed_documents(doc_path)
+    assert len(parses) == 2
+    assert len(os.listdir(doc_cache.cache_dir())) == 1
+
+    assert doc_cache.parsed_documents(doc_path) == docs
+    assert len(parses) == 2
+
+    cached = [
+        (doc.id, doc.str_all)
+        for doc in utils.stream_document_iter(doc_path, DocumentCS)
+    ]
+    doc_cache.set_cache_dir(None)
+    parsed = [
+        (doc.id, doc.str_all)
+        for doc in utils.stream_document_iter(doc_path, DocumentCS)
+    ]
+    assert cached == parsed
+    assert parsed[0] == ("CS-1", "\n\nPříliš žluťoučký kůň\núpěl ďábelské ódy & more\n")
+
+
+def test_changed_file_is_parsed_again(tmp_path, parses: list[str]) -> None:
+    doc_path = _write_documents(tmp_path)
+    doc_cache.parsed_documents(doc_path)
+    _write_documents(tmp_path, SOURCE.replace("CS-2", "CS-3"))
+    docs = doc_cache.parsed_documents(doc_path)
+    assert len(parses) == 4
+    assert dict(docs[1])["DOCNO"] == "CS-3"
+
+
+def test_new_parser_version_invalidates_entries(
+    tmp_path, parses: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    doc_path = _write_documents(tmp_path)
+    docs = doc_cache.parsed_documents(doc_path)
+    monkeypatch.setattr(sgml, "PARSER_VERSION", sgml.PARSER_VERSION + 1)
+    assert doc_cache.parsed_documents(doc_path) == docs
+    assert len(parses) == 4
+    assert len(os.listdir(doc_cache.cache_dir())) == 2
+
+
+def test_corrupted_entry_is_replaced(tmp_path, parses: list[str]) -> None:
+    doc_path = _write_documents(tmp_path)
+    docs = doc_cache.parsed_documents(doc_path)
+    (entry,) = os.listdir(doc_cache.cache_dir())
+    with open(os.path.join(doc_cache.cache_dir(), entry), mode="wb") as file:
+        file.write(b"garbage")
+
+    assert doc_cache.parsed_documents(doc_path) == docs
+    assert doc_cache.parsed_documents(doc_path) == docs
+    assert len(parses) == 4
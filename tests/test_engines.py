@@ -0,0 +1,198 @@
+import os
+from typing import Iterator
+
+import pytest
+
+from src import (
+    benchmark,
+    indexing,
+    masked,
+    runs,
+    segments,
+    shards,
+    storage,
+    terms,
+    utils,
+)
+from src.document import Document
+from src.index import ENGINES, InvertedIndex
+from src.query import Query
+from src.runs import run_0_tfidf
+
+# engines returning the same results as the term-at-a-time "python" engine
+EXACT_ENGINES = [engine for engine in ENGINES if engine != "impact"]
+INDEX_TYPES = (
+    "memory",
+    "none",
+    "vbyte",
+    "spimi",
+    "shards",
+    "segments",
+    "masked",
+    "masked_shards",
+)
+
+
+class Collection:
+    """
+    Synthetic collection with topics and stop words in `directory`. Frequent
+    terms have postings spanning several compressed blocks.
+    """
+
+    def __init__(self, directory: str) -> None:
+        documents_path, topics_path, stopwords_path = benchmark.generate_collection(
+            directory,
+            file_count=6,
+            docs_per_file=60,
+            doc_length=60,
+            vocabulary_size=500,
+            topic_count=15,
+            query_length=3,
+            stopword_count=20,
+        )
+        doc_dir = documents_path[: documents_path.rfind(".")]
+        self.paths = list(utils.get_filename_iter(doc_dir, documents_path))
+        self.stopwords = utils.load_stopwords(stopwords_path)
+        self.pipeline = run_0_tfidf.get_pipeline()
+        self.queries = [
+            self.pipeline.tokenizer(query.title)
+            for query in utils.get_query_iter(topics_path, Query)
+        ]
+        self.queries += [{"unknown": 1}, {"unknown": 1, "ka": 2}, {}]
+
+    def index_paths(self) -> indexing.IndexPaths:
+        return runs.index_paths(self.pipeline)
+
+
+@pytest.fixture(scope="module")
+def collection(tmp_path_factory: pytest.TempPathFactory) -> Collection:
+    return Collection(str(tmp_path_factory.mktemp("collection")))
+
+
+@pytest.fixture(scope="module")
+def reference(collection: Collection) -> InvertedIndex:
+    index = runs.build_index(collection.pipeline, iter(collection.paths))
+    index.result_cache.max_bytes = 0
+    return index
+
+
+def _build(
+    index_type: str, collection: Collection, reference: InvertedIndex, directory: str
+) -> tuple[InvertedIndex, InvertedIndex]:
+    """
+    Returns index of given type together with in-memory index of the same
+    documents it should match.
+    """
+    if index_type == "memory":
+        return reference, reference
+
+    if index_type in storage.COMPRESSIONS:
+        path = os.path.join(directory, "index.idx")
+        storage.save(reference, path, compression=index_type)
+        return storage.load(path), reference
+
+    if index_type == "spimi":
+        path = os.path.join(directory, "index.idx")
+        indexing.build_index_spimi(
+            iter(collection.paths),
+            collection.index_paths(),
+            path,
+            memory_budget=2**16,
+            batch_size=2,
+            tmp_dir=directory,
+            compression="vbyte",
+        )
+        return storage.load(path), reference
+
+    if index_type == "shards":
+        shards.build_shards(
+            iter(collection.paths), collection.index_paths(), directory, 3
+        )
+        return shards.ShardedIndex(directory), reference
+
+    if index_type == "segments":
+        index = segments.SegmentedIndex(directory)
+        half = len(collection.paths) // 2
+        for paths in (collection.paths[:half], collection.paths[half:]):
+            index.add_documents(iter(paths), collection.index_paths())
+        return index, reference
+
+    pipeline = indexing.Pipeline(
+        terms.Tokenizer(run_0_tfidf.SEPS, collection.stopwords), Document
+    )
+    without_stopwords = runs.build_index(pipeline, iter(collection.paths))
+    without_stopwords.result_cache.max_bytes = 0
+    if index_type == "masked_shards":
+        shards.build_shards(
+            iter(collection.paths), collection.index_paths(), directory, 3
+        )
+        index = shards.ShardedIndex(directory, collection.stopwords)
+        return index, without_stopwords
+
+    return masked.MaskedIndex(reference, collection.stopwords), without_stopwords
+
+
+@pytest.fixture(scope="module", params=INDEX_TYPES)
+def indexes(
+    request: pytest.FixtureRequest,
+    collection: Collection,
+    reference: InvertedIndex,
+    tmp_path_factory: pytest.TempPathFactory,
+) -> Iterator[tuple[InvertedIndex, InvertedIndex]]:
+    directory = str(tmp_path_factory.mktemp(request.param))
+    index, expected = _build(request.param, collection, reference, directory)
+    # results of other engines would be served from the cache
+    index.result_cache.max_bytes = 0
+    if isinstance(index, storage.MappedIndex):
+        # cursors would not decode postings already decoded by other engines
+        index.postings_cache.max_bytes = 0
+    yield index, expected
+    if isinstance(index, shards.ShardedIndex):
+        index.close()
+
+
+def _assert_same(
+    similars: list[tuple[float, str]], expected: list[tuple[float, str]]
+) -> None:
+    """
+    Asserts that rankings match up to rounding of scores, which may reorder
+    documents with equal scores.
+    """
+    assert [score for score, _ in similars] == pytest.approx(
+        [score for score, _ in expected], rel=1e-9
+    )
+    expected_scores = {doc_id: score for score, doc_id in expected}
+    for score, doc_id in similars:
+        # documents tied with the last one may be cut off instead of others
+        expected_score = expected_scores.get(doc_id, expected[-1][0])
+        assert score == pytest.approx(expected_score, rel=1e-9)
+
+
+@pytest.mark.parametrize("first_k", [10, 1000])
+@pytest.mark.parametrize("weighting", terms.WEIGHTINGS)
+@pytest.mark.parametrize("engine", EXACT_ENGINES)
+def test_engine_matches_python_engine(
+    indexes: tuple[InvertedIndex, InvertedIndex],
+    collection: Collection,
+    engine: str,
+    weighting: str,
+    first_k: int,
+) -> None:
+    index, expected_index = indexes
+    excluded = getattr(index, "excluded_terms", ())
+    for query in collection.queries:
+        # the index without stop words gets topics tokenized without them
+        expected_query = {
+            term: count for term, count in query.items() if term not in excluded
+        }
+        expected = expected_index.get_most_similar(expected_query, weighting, first_k)
+        similars = index.get_most_similar(query, weighting, first_k, engine)
+        _assert_same(similars, expected)
+        # exact engines agree on the same index up to the last bit
+        assert similars == index.get_most_similar(query, weighting, first_k)
+
+
+def test_doc_ids_and_counts_match(indexes: tuple[InvertedIndex, InvertedIndex]) -> None:
+    index, expected_index = indexes
+    assert index.doc_count == expected_index.doc_count
+    assert sorted(index.doc_ids()) == sorted(expected_index.doc_ids())
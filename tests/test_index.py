@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from src import storage
+from src.index import InvertedIndex
+
+
+def test_documents_are_counted_with_first_posting(tmp_path) -> None:
+    index = InvertedIndex()
+    index.add_posting("b", "d2", 1)
+    index.add_posting("a", "d1", 2)
+    index.add_posting("a", "d2", 1)
+    assert index.doc_count == 2
+
+    # a document without postings
+    index.doc_count += 1
+    path = os.path.join(tmp_path, "index.idx")
+    storage.save(index, path)
+    loaded = storage.load(path)
+    assert loaded.doc_count == 3
+    assert list(loaded.doc_ids()) == ["d2", "d1"]
+
+    other = InvertedIndex()
+    other.add_posting("a", "d3", 1)
+    index.update_with(other)
+    assert index.doc_count == 4
+
+
+def _mapped_paths() -> set[str]:
+    with open("/proc/self/maps", mode="r", encoding="utf-8") as maps:
+        return {line.split(maxsplit=5)[-1].strip() for line in maps}
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs procfs")
+def test_merge_closes_mapped_files(tmp_path) -> None:
+    paths = []
+    for i in range(2):
+        index = InvertedIndex()
+        index.add_posting("a", f"d{i}", i + 1)
+        paths.append(os.path.join(tmp_path, f"part-{i}.idx"))
+        storage.save(index, paths[-1], with_norms=False)
+
+    out_path = os.path.join(tmp_path, "index.idx")
+    storage.merge(paths, out_path)
+    assert _mapped_paths().isdisjoint([*paths, out_path])
+
+    with storage.load(out_path) as loaded:
+        postings = loaded.postings("a")
+        assert out_path in _mapped_paths()
+    # postings returned before closing stay readable
+    assert list(postings) == [(0, 1), (1, 2)]
+    del postings
+    assert out_path not in _mapped_paths()
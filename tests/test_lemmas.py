@@ -0,0 +1,146 @@
+import sqlite3
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import pytest
+
+from src import lemmas, terms
+
+
+class _TaggedLemma:
+    def __init__(self, lemma: str) -> None:
+        self.lemma = lemma
+
+
+class _StubMorpho:
+    """
+    Dictionary whose lemma of a word is the word without a trailing "s", words
+    with digits are unknown.
+    """
+
+    GUESSER = 1
+    analyzed: list[str] = []
+
+    @staticmethod
+    def load(dict_path: str) -> Optional["_StubMorpho"]:
+        return None if dict_path == "missing.dict" else _StubMorpho()
+
+    def analyze(self, form: str, guesser: int, analyses: list) -> int:
+        assert guesser == self.GUESSER
+        _StubMorpho.analyzed.append(form)
+        analyses.clear()
+        if form.isalpha():
+            analyses.append(_TaggedLemma(form.removesuffix("s") + "_^(stub)"))
+        return 0
+
+    def rawLemma(self, lemma: str) -> str:  # pylint: disable=invalid-name
+        return lemma.split("_")[0]
+
+
+@pytest.fixture(autouse=True)
+def morpho(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """
+    Replaces morphodita by `_StubMorpho` and returns the list of analyzed forms.
+    """
+    morphodita = types.ModuleType("ufal.morphodita")
+    morphodita.Morpho = _StubMorpho
+    morphodita.TaggedLemmas = list
+    ufal = types.ModuleType("ufal")
+    ufal.morphodita = morphodita
+    monkeypatch.setitem(sys.modules, "ufal", ufal)
+    monkeypatch.setitem(sys.modules, "ufal.morphodita", morphodita)
+    monkeypatch.setattr(_StubMorpho, "analyzed", [])
+    # tables of a test are not flushed into directories of other tests
+    monkeypatch.setattr(lemmas, "_tables", {})
+    return _StubMorpho.analyzed
+
+
+def _stored(table_path: str) -> dict[str, str]:
+    with sqlite3.connect(table_path) as connection:
+        return dict(connection.execute("SELECT form, lemma FROM lemmas"))
+
+
+def test_forms_are_analyzed_once(tmp_path, morpho: list[str]) -> None:
+    lemmatizer = lemmas.Lemmatizer("stub.dict", str(tmp_path / "lemmas.sqlite"))
+    assert [lemmatizer(form) for form in ["cats", "dogs", "cats", "cat"]] == [
+        "cat",
+        "dog",
+        "cat",
+        "cat",
+    ]
+    assert lemmatizer("r2d2") == "r2d2"
+    assert morpho == ["cats", "dogs", "cat", "r2d2"]
+
+
+def test_lemmas_are_shared_through_table(tmp_path, morpho: list[str]) -> None:
+    table_path = str(tmp_path / "tables" / "lemmas.sqlite")
+    lemmatizer = lemmas.Lemmatizer("stub.dict", table_path)
+    lemmatizer("cats")
+    lemmas.flush_tables()
+    assert _stored(table_path) == {"cats": "cat"}
+
+    # a new process starts with an empty cache
+    lemmas._tables.clear()  # pylint: disable=protected-access
+    assert lemmas.Lemmatizer("stub.dict", table_path)("cats") == "cat"
+    assert morpho == ["cats"]
+
+
+def test_pending_lemmas_are_written_in_batches(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(lemmas, "WRITE_BATCH", 2)
+    table_path = str(tmp_path / "lemmas.sqlite")
+    lemmatizer = lemmas.Lemmatizer("stub.dict", table_path)
+    lemmatizer("cats")
+    assert _stored(table_path) == {}
+    lemmatizer("dogs")
+    assert _stored(table_path) == {"cats": "cat", "dogs": "dog"}
+
+
+def test_cache_is_bounded(tmp_path, morpho: list[str]) -> None:
+    cache_bytes = 3 * lemmas._entry_size("word")  # pylint: disable=protected-access
+    lemmatizer = lemmas.Lemmatizer(
+        "stub.dict", str(tmp_path / "lemmas.sqlite"), cache_bytes
+    )
+    forms = [f"word{letter}s" for letter in "abcdefgh"]
+    assert [lemmatizer(form) for form in forms + forms] == [
+        form[:-1] for form in forms + forms
+    ]
+    table = lemmas._table(  # pylint: disable=protected-access
+        "stub.dict", str(tmp_path / "lemmas.sqlite"), cache_bytes
+    )
+    assert len(table.cache) <= 3
+    # evicted lemmas are found among pending ones instead of analyzed again
+    assert morpho == forms
+
+
+def test_lookups_from_several_threads(tmp_path, morpho: list[str]) -> None:
+    table_path = str(tmp_path / "lemmas.sqlite")
+    lemmatizer = lemmas.Lemmatizer("stub.dict", table_path)
+    lemmatizer("warmup")
+    lemmas.flush_tables()
+
+    forms = [f"form{letter}s" for letter in "abcdefghijklmnopqrstuvwxyz"] * 8
+    with ThreadPoolExecutor(4) as executor:
+        found = list(executor.map(lemmatizer, forms + ["warmup"]))
+
+    assert found == [form[:-1] for form in forms] + ["warmup"]
+    assert sorted(morpho) == sorted(set(forms) | {"warmup"})
+
+
+def test_missing_dictionary(tmp_path) -> None:
+    lemmatizer = lemmas.Lemmatizer("missing.dict", str(tmp_path / "lemmas.sqlite"))
+    with pytest.raises(ValueError):
+        lemmatizer("cats")
+
+
+def test_tokenizer_maps_forms_to_lemmas(tmp_path) -> None:
+    lemmatizer = lemmas.Lemmatizer("stub.dict", str(tmp_path / "lemmas.sqlite"))
+    tokenizer = terms.Tokenizer(" ", ["the"], lemmatizer, memoize_map=False)
+    assert tokenizer("the cats chase the cat dogs") == {
+        "cat": 2,
+        "chase": 1,
+        "dog": 1,
+    }
@@ -0,0 +1,40 @@
+import json
+import os
+from typing import Iterator
+
+import pytest
+
+from src import log
+from src.index import InvertedIndex
+
+
+@pytest.fixture
+def metrics_path(tmp_path) -> Iterator[str]:
+    log.enable_metrics()
+    try:
+        yield os.path.join(tmp_path, "metrics.json")
+    finally:
+        log.disable_metrics()
+
+
+def _stages(metrics_path: str) -> dict[str, dict[str, float]]:
+    log.export_metrics(metrics_path)
+    with open(metrics_path, mode="r", encoding="utf-8") as file:
+        return json.load(file)["stages"]
+
+
+def test_delegated_queries_are_timed_once(metrics_path: str) -> None:
+    index = InvertedIndex()
+    for doc in range(10):
+        index.add_posting(f"t{doc % 3}", f"d{doc}", doc + 1)
+    queries = [{f"t{term}": 1} for term in range(3)]
+
+    index.get_most_similar_batch(queries, "tfidf")
+    assert _stages(metrics_path)["query"]["calls"] == 1
+
+    index.result_cache.clear()
+    index.get_most_similar_batch(queries, "tfidf", processes=2)
+    stages = _stages(metrics_path)
+    # timed by each of two workers and as dispatch by this process
+    assert stages["query"]["calls"] == 3
+    assert stages["dispatch"]["calls"] == 1
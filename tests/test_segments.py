@@ -0,0 +1,207 @@
+import os
+import threading
+from typing import Iterable
+
+import pytest
+
+from src import benchmark, runs, segments, terms, utils
+from src.document import Document
+from src.index import InvertedIndex
+from src.runs import run_0_tfidf
+
+
+class Collection:
+    """
+    Synthetic collection of files and queries of their terms.
+    """
+
+    def __init__(self, directory: str) -> None:
+        documents_path, _, _ = benchmark.generate_collection(
+            directory,
+            file_count=8,
+            docs_per_file=15,
+            doc_length=40,
+            vocabulary_size=200,
+            topic_count=1,
+        )
+        doc_dir = documents_path[: documents_path.rfind(".")]
+        self.paths = list(utils.get_filename_iter(doc_dir, documents_path))
+        self.index_paths = runs.index_paths(run_0_tfidf.get_pipeline())
+        vocabulary = sorted(self.reference(self.paths).terms())
+        self.queries = [
+            {vocabulary[i]: 1, vocabulary[(7 * i + 1) % len(vocabulary)]: 2}
+            for i in range(0, len(vocabulary), len(vocabulary) // 15)
+        ]
+
+    def reference(
+        self, paths: Iterable[str], deleted: Iterable[str] = ()
+    ) -> InvertedIndex:
+        """
+        Returns in-memory index of documents in `paths` except `deleted` ones.
+        """
+        deleted = set(deleted)
+        index = InvertedIndex()
+        for path in paths:
+            for doc in utils.stream_document_iter(path, Document):
+                if doc.id not in deleted:
+                    for term, count in run_0_tfidf.TOKENIZER(doc.str_all).items():
+                        index.add_posting(term, doc.id, count)
+        return index
+
+
+@pytest.fixture(scope="module")
+def collection(tmp_path_factory: pytest.TempPathFactory) -> Collection:
+    return Collection(str(tmp_path_factory.mktemp("collection")))
+
+
+def _assert_matches(index: InvertedIndex, expected: InvertedIndex, queries) -> None:
+    assert index.doc_count == expected.doc_count
+    for weighting in terms.WEIGHTINGS:
+        for query in queries:
+            similars = index.get_most_similar(query, weighting, 20)
+            expected_similars = expected.get_most_similar(query, weighting, 20)
+            assert [doc_id for _, doc_id in similars] == [
+                doc_id for _, doc_id in expected_similars
+            ]
+            assert [score for score, _ in similars] == pytest.approx(
+                [score for score, _ in expected_similars], rel=1e-9
+            )
+
+
+def test_added_and_deleted_documents(tmp_path, collection: Collection) -> None:
+    directory = os.path.join(tmp_path, "segments")
+    index = segments.SegmentedIndex(directory, max_segments=10)
+    for start in range(0, 6, 2):
+        index.add_documents(
+            iter(collection.paths[start : start + 2]), collection.index_paths
+        )
+    assert index.segment_count() == 3
+    assert list(index.doc_ids()) == list(
+        collection.reference(collection.paths[:6]).doc_ids()
+    )
+    _assert_matches(
+        index, collection.reference(collection.paths[:6]), collection.queries
+    )
+
+    deleted = ["BENCH-0-1", "BENCH-3-0", "BENCH-5-14", "unknown"]
+    index.delete_documents(deleted)
+    expected = collection.reference(collection.paths[:6], deleted)
+    _assert_matches(index, expected, collection.queries)
+    # deletions are persisted in the manifest
+    _assert_matches(segments.SegmentedIndex(directory), expected, collection.queries)
+
+
+def test_merge_drops_deleted_documents(tmp_path, collection: Collection) -> None:
+    directory = os.path.join(tmp_path, "segments")
+    index = segments.SegmentedIndex(directory, max_segments=2)
+    index.add_documents(iter(collection.paths[:2]), collection.index_paths)
+    index.add_documents(iter(collection.paths[2:4]), collection.index_paths)
+    index.delete_documents(["BENCH-1-3"])
+    # a third segment starts a merge
+    index.add_documents(iter(collection.paths[4:6]), collection.index_paths)
+    index.wait_for_merge()
+
+    assert index.segment_count() == 1
+    expected = collection.reference(collection.paths[:6], ["BENCH-1-3"])
+    _assert_matches(index, expected, collection.queries)
+    assert list(index.doc_ids()) == list(expected.doc_ids())
+    with open(os.path.join(directory, segments.MANIFEST), encoding="utf-8") as file:
+        assert '"deleted": []' in file.read()
+    # only the merged segment and the manifest are left
+    assert len(os.listdir(directory)) == 2
+
+
+def test_queries_during_merge_see_consistent_collection(
+    tmp_path, collection: Collection
+) -> None:
+    index = segments.SegmentedIndex(os.path.join(tmp_path, "segments"), 100)
+    for path in collection.paths[:4]:
+        index.add_documents(iter([path]), collection.index_paths)
+    index.result_cache.max_bytes = 0
+    expected = [
+        index.get_most_similar(query, "natural", 20) for query in collection.queries
+    ]
+
+    failures = []
+    stop = threading.Event()
+
+    def query_repeatedly() -> None:
+        while not stop.is_set():
+            for query, similars in zip(collection.queries, expected):
+                if index.get_most_similar(query, "natural", 20) != similars:
+                    failures.append(query)
+
+    thread = threading.Thread(target=query_repeatedly)
+    thread.start()
+    index.merge_segments().join()
+    stop.set()
+    thread.join()
+
+    assert index.segment_count() == 1
+    assert failures == []
+
+
+def test_merge_keeps_compression(tmp_path, collection: Collection) -> None:
+    index = segments.SegmentedIndex(os.path.join(tmp_path, "segments"), 100)
+    for path in collection.paths[:3]:
+        index.add_documents(iter([path]), collection.index_paths, compression="vbyte")
+    index.merge_segments().join()
+    assert index.segment_count() == 1
+    assert index._view.segments[0].compression == "vbyte"  # pylint: disable=W0212
+
+
+def test_result_of_replaced_view_is_not_cached(
+    tmp_path, collection: Collection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    index = segments.SegmentedIndex(os.path.join(tmp_path, "segments"))
+    index.add_documents(iter(collection.paths[:2]), collection.index_paths)
+    query, other_query = collection.queries[:2]
+    (_, deleted), *_ = index.get_most_similar(query, "natural")
+    index.delete_documents(["unknown"])
+    get_most_similar = index._get_most_similar  # pylint: disable=W0212
+
+    def racing_get_most_similar(*args) -> list[tuple[float, str]]:
+        # the index changes and another query clears its statistics while the
+        # result on the old segments is computed
+        similars = get_most_similar(*args)
+        monkeypatch.undo()
+        index.delete_documents([deleted])
+        index.get_most_similar(other_query, "natural")
+        return similars
+
+    monkeypatch.setattr(index, "_get_most_similar", racing_get_most_similar)
+    index.get_most_similar(query, "natural")
+    similars = index.get_most_similar(query, "natural")
+    assert deleted not in [doc_id for _, doc_id in similars]
+
+
+def test_merged_segments_are_removed_once_not_read(
+    tmp_path, collection: Collection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    directory = os.path.join(tmp_path, "segments")
+    index = segments.SegmentedIndex(directory, 100)
+    for path in collection.paths[:3]:
+        index.add_documents(iter([path]), collection.index_paths)
+    query = collection.queries[0]
+    expected = index.get_most_similar(query, "natural")
+    index.result_cache.max_bytes = 0
+    old_names = sorted(os.listdir(directory))
+    # pylint: disable-next=protected-access
+    get_most_similar = segments._SegmentsView._get_most_similar
+
+    def merging_get_most_similar(view, *args) -> list[tuple[float, str]]:
+        monkeypatch.undo()
+        # the merge finishes while the query reads the old segments
+        index.merge_segments().join()
+        assert index.segment_count() == 1
+        assert set(old_names) <= set(os.listdir(directory))
+        return get_most_similar(view, *args)
+
+    monkeypatch.setattr(
+        segments._SegmentsView,  # pylint: disable=protected-access
+        "_get_most_similar",
+        merging_get_most_similar,
+    )
+    assert index.get_most_similar(query, "natural") == expected
+    assert len(os.listdir(directory)) == 2
+    assert index.get_most_similar(query, "natural") == expected
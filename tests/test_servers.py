@@ -0,0 +1,199 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Iterator
+from urllib.parse import urlencode
+
+import pytest
+
+from src import async_server, benchmark, runs, server, storage, utils
+from src.index import InvertedIndex
+from src.runs import run_0_tfidf
+
+RUN_ID = "run-0-tfidf_cs"
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory: pytest.TempPathFactory) -> InvertedIndex:
+    documents_path, _, _ = benchmark.generate_collection(
+        str(tmp_path_factory.mktemp("collection")),
+        file_count=2,
+        docs_per_file=20,
+        doc_length=30,
+        vocabulary_size=100,
+        topic_count=1,
+    )
+    doc_dir = documents_path[: documents_path.rfind(".")]
+    paths = utils.get_filename_iter(doc_dir, documents_path)
+    return runs.build_index(run_0_tfidf.get_pipeline(), paths)
+
+
+@pytest.fixture(scope="module")
+def query_text(index: InvertedIndex) -> str:
+    vocabulary = sorted(index.terms())
+    return " ".join(vocabulary[:: len(vocabulary) // 3])
+
+
+def _get(url: str) -> tuple[int, str]:
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as error:
+        return error.code, error.read().decode("utf-8")
+
+
+def _expected(index: InvertedIndex, text: str, query_id: str, first_k: int) -> str:
+    similars = index.get_most_similar(
+        run_0_tfidf.TOKENIZER(text), run_0_tfidf.WEIGHTING, first_k
+    )
+    output = io.StringIO()
+    utils.write_qrels(output, similars, query_id, RUN_ID)
+    return output.getvalue()
+
+
+@contextlib.contextmanager
+def _serve_threaded(service: server.QueryService) -> Iterator[str]:
+    with server.QueryServer(("127.0.0.1", 0), service) as query_server:
+        thread = threading.Thread(target=query_server.serve_forever)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{query_server.server_address[1]}"
+        finally:
+            query_server.shutdown()
+            thread.join()
+
+
+@pytest.fixture
+def threaded_url(index: InvertedIndex) -> Iterator[str]:
+    service = server.QueryService(
+        index, run_0_tfidf.TOKENIZER, run_0_tfidf.WEIGHTING, RUN_ID, first_k=5
+    )
+    with _serve_threaded(service) as url:
+        yield url
+
+
+def test_threaded_server_ranks_documents(
+    threaded_url: str, index: InvertedIndex, query_text: str
+) -> None:
+    query = urlencode({"query": query_text, "id": "7"})
+    assert _get(f"{threaded_url}/search?{query}") == (
+        200,
+        _expected(index, query_text, "7", 5),
+    )
+    assert _get(f"{threaded_url}/search?{query}&k=2") == (
+        200,
+        _expected(index, query_text, "7", 2),
+    )
+
+    status, body = _get(f"{threaded_url}/stats")
+    assert status == 200
+    assert json.loads(body)["queries"] == 2
+
+
+@pytest.mark.parametrize("first_k", ["0", "-3", "many"])
+def test_threaded_server_rejects_invalid_k(threaded_url: str, first_k: str) -> None:
+    status, _ = _get(f"{threaded_url}/search?query=w0&k={first_k}")
+    assert status == 400
+
+
+def test_threaded_server_reports_failed_search(index: InvertedIndex) -> None:
+    service = server.QueryService(
+        index, run_0_tfidf.TOKENIZER, run_0_tfidf.WEIGHTING, RUN_ID, engine="unknown"
+    )
+    with _serve_threaded(service) as url:
+        status, body = _get(f"{url}/search?query=w0")
+
+    assert status == 500
+    assert "Unknown scoring engine" in body
+
+
+@contextlib.contextmanager
+def _serve_async(query_server: async_server.AsyncQueryServer) -> Iterator[str]:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    loop = asyncio.new_event_loop()
+    serving = loop.create_task(query_server.serve(f"127.0.0.1:{port}"))
+
+    def serve_until_cancelled() -> None:
+        with contextlib.suppress(asyncio.CancelledError):
+            loop.run_until_complete(serving)
+
+    thread = threading.Thread(target=serve_until_cancelled)
+    thread.start()
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                _get(f"{url}/stats")
+                break
+            except urllib.error.URLError:
+                if not thread.is_alive() or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        yield url
+    finally:
+        loop.call_soon_threadsafe(serving.cancel)
+        thread.join()
+        loop.close()
+
+
+def test_async_server_ranks_documents(
+    tmp_path, index: InvertedIndex, query_text: str
+) -> None:
+    index_path = os.path.join(tmp_path, "index.idx")
+    storage.save(index, index_path)
+    query_server = async_server.AsyncQueryServer(
+        index_path,
+        run_0_tfidf.TOKENIZER,
+        run_0_tfidf.WEIGHTING,
+        RUN_ID,
+        first_k=5,
+        processes=1,
+    )
+    query = urlencode({"query": query_text, "id": "7"})
+    with _serve_async(query_server) as url:
+        assert _get(f"{url}/search?{query}") == (
+            200,
+            _expected(index, query_text, "7", 5),
+        )
+        assert _get(f"{url}/search?{query}&k=2") == (
+            200,
+            _expected(index, query_text, "7", 2),
+        )
+        for first_k in ["0", "-3", "many"]:
+            assert _get(f"{url}/search?{query}&k={first_k}")[0] == 400
+
+        status, body = _get(f"{url}/stats")
+
+    assert status == 200
+    assert json.loads(body)["queries"] == 2
+
+
+def test_async_worker_builds_impacts(
+    tmp_path, index: InvertedIndex, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    index_path = os.path.join(tmp_path, "index.idx")
+    storage.save(index, index_path)
+    monkeypatch.setattr(async_server, "_worker_index", None)
+    monkeypatch.setattr(async_server, "_worker_tokenizer", None)
+    # pylint: disable=protected-access
+    async_server._init_worker(
+        storage.load,
+        index_path,
+        frozenset(),
+        run_0_tfidf.TOKENIZER,
+        run_0_tfidf.WEIGHTING,
+        "impact",
+    )
+    impacts = async_server._worker_index._impacts[run_0_tfidf.WEIGHTING]
+    assert impacts.keys() == set(index.terms())
@@ -0,0 +1,89 @@
+import io
+import os
+from typing import Iterator
+
+import bs4
+import pytest
+
+from src import benchmark, sgml, utils
+from src.document import Document, DocumentCS, DocumentEN
+
+SOURCE = """<DOC id="1">
+<DOCNO>D-1</DOCNO>
+<DOCID>17</DOCID>
+<HD>Tom &amp; Jerry</HD>
+<TEXT>
+<P>Cats &lt;chase&gt; mice.</P>
+<P>Mice <B>hide</B> in holes.</P>
+</TEXT>
+<SN>Section</SN>
+</DOC>
+<DOC>
+<DOCNO>D-2</DOCNO>
+Text outside of fields, <EMPTY/> with an empty tag.
+<TEXT><![CDATA[Raw <text>]]></TEXT>
+</DOC>
+"""
+
+
+def _bs4_documents(doc_path: str, create_doc: type[Document]) -> Iterator[Document]:
+    """
+    Reference parsing of the whole file into a tree, the documents are wrapped
+    in a root element so that they form a single XML document.
+    """
+    with open(doc_path, mode="r", encoding="utf-8") as file_handle:
+        soup = bs4.BeautifulSoup(f"<ROOT>{file_handle.read()}</ROOT>", "xml")
+        for doc_tag in soup.find_all("DOC"):
+            yield create_doc(doc_tag)
+
+
+def _assert_same_documents(doc_path: str, create_doc: type[Document]) -> None:
+    expected = [(doc.id, doc.str_all) for doc in _bs4_documents(doc_path, create_doc)]
+    streamed = [
+        (doc.id, doc.str_all)
+        for doc in utils.stream_document_iter(doc_path, create_doc)
+    ]
+    assert streamed == expected
+
+
+@pytest.mark.parametrize("create_doc", [DocumentCS, DocumentEN])
+def test_parser_matches_bs4(tmp_path, create_doc: type[Document]) -> None:
+    doc_path = os.path.join(tmp_path, "documents.sgml")
+    with open(doc_path, mode="w", encoding="utf-8") as file:
+        file.write(SOURCE)
+
+    _assert_same_documents(doc_path, create_doc)
+
+
+def test_parser_matches_bs4_on_generated_collection(tmp_path) -> None:
+    documents_path, _, _ = benchmark.generate_collection(
+        str(tmp_path), file_count=2, docs_per_file=10, topic_count=1
+    )
+    doc_dir = documents_path[: documents_path.rfind(".")]
+    for doc_path in utils.get_filename_iter(doc_dir, documents_path):
+        _assert_same_documents(doc_path, DocumentCS)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_documents_span_chunks(chunk_size: int) -> None:
+    sources = list(sgml.iter_doc_sources(io.StringIO(SOURCE), chunk_size))
+    assert [dict(sgml.parse_fields(source))["DOCNO"] for source in sources] == [
+        "D-1",
+        "D-2",
+    ]
+    assert sources[1].startswith("\n<DOCNO>D-2</DOCNO>")
+
+
+def test_comments_are_omitted() -> None:
+    assert sgml.parse_fields("<P>one<!-- <P>two</P> --> three</P>") == [
+        ("P", "one"),
+        ("P", " three"),
+    ]
+
+
+def test_omitted_end_tags_close_enclosing_fields() -> None:
+    assert sgml.parse_fields("<TEXT><P>one<P>two</TEXT>tail") == [
+        ("P", "one"),
+        ("P", "two"),
+        ("DOC", "tail"),
+    ]
@@ -0,0 +1,89 @@
+import pickle
+import re
+from typing import Callable, Optional
+
+import pytest
+
+from src import terms
+from src.runs import run_0, run_0_tfidf
+
+TEXTS = [
+    "",
+    "Cats chase mice, mice hide.",
+    "  The cat (and the dog)\n\tsaid: 'hello'!  hello?? ",
+    'slash/separated-words_and "quotes" [brackets]',
+]
+
+
+def _extract_reference(
+    string: str,
+    separators: str,
+    stop_words: Optional[set[str]] = None,
+    term_map: Optional[Callable[[str], str]] = None,
+) -> dict[str, int]:
+    """
+    Splits `string` on every separator and counts the words one by one.
+    """
+    stop_words = set() if stop_words is None else set(stop_words)
+    counts = {}
+    for word in re.split("[" + separators + "]", string):
+        if word == "" or word in stop_words:
+            continue
+        word = word if term_map is None else term_map(word)
+        counts[word] = counts.get(word, 0) + 1
+
+    return counts
+
+
+@pytest.mark.parametrize("separators", [run_0.SEPS, run_0_tfidf.SEPS])
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("stop_words", [None, {"the", "hello"}])
+@pytest.mark.parametrize("term_map", [None, str.lower])
+def test_tokenizer_matches_reference(
+    separators: str,
+    text: str,
+    stop_words: Optional[set[str]],
+    term_map: Optional[Callable[[str], str]],
+) -> None:
+    tokenizer = terms.Tokenizer(separators, stop_words, term_map)
+    expected = _extract_reference(text, separators, stop_words, term_map)
+    assert tokenizer(text) == expected
+    # memoized terms give the same counts
+    assert tokenizer(text) == expected
+    assert terms.extract(text, separators, stop_words, term_map) == expected
+
+
+def test_extract_keeps_stop_words() -> None:
+    stop_words = {"the"}
+    terms.extract("the cat", " ", stop_words)
+    assert stop_words == {"the"}
+
+
+@pytest.mark.parametrize("memoize_map", [True, False])
+def test_term_map_is_called_once_per_distinct_word(memoize_map: bool) -> None:
+    mapped = []
+
+    def term_map(word: str) -> str:
+        mapped.append(word)
+        return word.lower()
+
+    tokenizer = terms.Tokenizer(" ", ["a"], term_map, memoize_map)
+    assert tokenizer("Cat cat a Cat dog") == {"cat": 3, "dog": 1}
+    assert sorted(mapped) == ["Cat", "cat", "dog"]
+
+    tokenizer("cat mouse")
+    expected = ["mouse"] if memoize_map else ["cat", "mouse"]
+    assert sorted(mapped[3:]) == expected
+
+
+def test_pickled_tokenizer_drops_memoized_terms() -> None:
+    tokenizer = terms.Tokenizer(" ", None, str.upper)
+    tokenizer("cat dog")
+    copy = pickle.loads(pickle.dumps(tokenizer))
+    assert copy.__getstate__()["_mapped"] == {}
+    assert copy("cat") == {"CAT": 1}
+
+
+def test_unknown_weighting() -> None:
+    with pytest.raises(ValueError):
+        terms.get_weighting("bm25", 10)